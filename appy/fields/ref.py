@@ -1,6 +1,8 @@
 # ~license~
 # ------------------------------------------------------------------------------
 import sys, re, os.path
+from BTrees.OOBTree import OOBTree
+from persistent.list import PersistentList
 from appy import Object
 from appy.fields import Field, Initiator
 from appy.fields.search import Search
@@ -56,6 +58,131 @@ class Position:
             res += 1
         return res
 
+# ------------------------------------------------------------------------------
+class IndexedList(PersistentList):
+    '''List of tied object IDs, as stored by a Ref field having attribute
+       "indexedRefs" being True, with indexes allowing to avoid walking the
+       whole list when linking, unlinking or searching tied objects.'''
+
+    # Indexes are volatile: loading the list from the database already costs a
+    # complete walk of the list, so they are (re)built lazily, at most once per
+    # load, and then maintained by the methods below:
+    # - "_v_members" is the set of IDs, for membership tests;
+    # - "_v_positions" maps every ID to its position within the list. Because
+    #   most insertions and removals shift positions, it is simply dropped and
+    #   rebuilt when needed.
+    # Moreover, the list keeps, in persistent dict "sortKeys", the sort key of
+    # every tied object, as computed by the method defined in the Ref's
+    # attribute "insert": tied objects do not need to be loaded anymore when
+    # computing where to insert a new one. The key of a tied object is dropped
+    # when this object is reindexed (see m_forgetSortKeys on the base mixin),
+    # and recomputed when needed.
+
+    def __init__(self, initlist=None):
+        PersistentList.__init__(self, initlist)
+        # The sort keys of tied objects ~{s_id: key}~
+        self.sortKeys = OOBTree()
+
+    def getMembers(self):
+        '''Returns the set of IDs, building it if required'''
+        r = getattr(self, '_v_members', None)
+        if r is None:
+            r = self._v_members = set(self.data)
+        return r
+
+    def getPositions(self):
+        '''Returns the dict of positions, building it if required'''
+        r = getattr(self, '_v_positions', None)
+        if r is None:
+            r = self._v_positions = {}
+            for i, id in enumerate(self.data): r[id] = i
+        return r
+
+    def dropIndexes(self):
+        '''Drops the volatile indexes, after a change that can't be applied to
+           them.'''
+        self._v_members = self._v_positions = None
+
+    def __contains__(self, id): return id in self.getMembers()
+
+    def index(self, id, *args):
+        if args: return PersistentList.index(self, id, *args)
+        i = self.getPositions().get(id)
+        # Positions may be outdated if the list has been directly modified,
+        # ie, sorted via attribute "data".
+        if (i is None) or (i >= len(self.data)) or (self.data[i] != id):
+            self._v_positions = None
+            i = self.getPositions().get(id)
+            if i is None: raise ValueError('%s not in list' % id)
+        return i
+
+    def append(self, id):
+        PersistentList.append(self, id)
+        self.getMembers().add(id)
+        positions = getattr(self, '_v_positions', None)
+        if positions is not None: positions[id] = len(self.data) - 1
+
+    def insert(self, i, id):
+        PersistentList.insert(self, i, id)
+        self.getMembers().add(id)
+        self._v_positions = None
+
+    def remove(self, id):
+        self.__delitem__(self.index(id))
+
+    def __delitem__(self, i):
+        id = self.data[i]
+        PersistentList.__delitem__(self, i)
+        self.getMembers().discard(id)
+        self._v_positions = None
+        if id in self.sortKeys: del self.sortKeys[id]
+
+    # Other methods modifying the list simply drop the indexes
+    def __setitem__(self, i, id):
+        PersistentList.__setitem__(self, i, id)
+        self.dropIndexes()
+
+    def __setslice__(self, i, j, other):
+        PersistentList.__setslice__(self, i, j, other)
+        self.dropIndexes()
+
+    def __delslice__(self, i, j):
+        PersistentList.__delslice__(self, i, j)
+        self.dropIndexes()
+
+    def __iadd__(self, other):
+        r = PersistentList.__iadd__(self, other)
+        self.dropIndexes()
+        return r
+
+    def extend(self, other):
+        PersistentList.extend(self, other)
+        self.dropIndexes()
+
+    def pop(self, i=-1):
+        r = PersistentList.pop(self, i)
+        self.dropIndexes()
+        return r
+
+    def getSortKey(self, id, compute):
+        '''Returns the sort key of the tied object whose p_id is given. If it
+           is not known yet, it is computed by calling function p_compute with
+           p_id as unique arg.'''
+        keys = self.sortKeys
+        if id in keys: return keys[id]
+        r = keys[id] = compute(id)
+        return r
+
+    def clearSortKeys(self, ids=None):
+        '''Removes the sort keys of the tied objects whose p_ids are given, or
+           all the sort keys if p_ids is None.'''
+        keys = self.sortKeys
+        if ids is None:
+            keys.clear()
+        else:
+            for id in ids:
+                if id in keys: del keys[id]
+
 # ------------------------------------------------------------------------------
 class RefInitiator(Initiator):
     '''When an object is added via a Ref field, this class gives information
@@ -743,7 +870,7 @@ class Ref(Field):
       showGlobalActions=True, collapsible=False, links=True, viewAdded=True,
       noValueLabel='choose_a_value', noObjectLabel='no_ref',
       addLabel='object_add', filterable=True, supTitle=None, subTitle=None,
-      separator=None, actions=None):
+      separator=None, actions=None, indexedRefs=False):
         # The class whose tied objects will be instances of
         self.klass = klass
         # Specify "attribute" only for a back reference: it will be the name
@@ -872,6 +999,18 @@ class Ref(Field):
         # object is inserted at some given place: tied objects are more
         # maintained in the order of their insertion.
         self.insert = insert
+        # If you plan to tie many objects (thousands) via this Ref, set
+        # "indexedRefs" to True: the IDs of tied objects will be stored in an
+        # IndexedList instance (see the class above) instead of a standard
+        # persistent list. Linking and unlinking objects, or getting the
+        # position of a tied object, will not walk the whole list anymore.
+        # Moreover, if "insert" is a method, its result for every tied object is
+        # computed once and stored in the list: tied objects do not need to be
+        # loaded anymore for determining where to insert a new one. The key of
+        # a tied object is dropped as soon as this object is reindexed, if this
+        # Ref has a back Ref. If it has not, or if keys depend on other objects,
+        # call m_clearSortKeys when they become outdated.
+        self.indexedRefs = indexedRefs
         # Immediately before an object is going to be linked via this Ref field,
         # method potentially specified in "beforeLink" will be executed and will
         # take the object to link as single parameter.
@@ -1195,20 +1334,17 @@ class Ref(Field):
             res.batchSize = maxPerPage or self.maxPerPage
         if startNumber != None:
             res.startNumber = startNumber
-        # Get the objects given their uids
-        i = res.startNumber
-        tool = obj.getTool()
-        while i < (res.startNumber + res.batchSize):
-            if i >= res.totalNumber: break
-            # Retrieve every reference in the correct format according to p_type
-            tied = tool.getObject(uids[i])
+        # Get the objects given their uids, with a single catalog query
+        start = res.startNumber
+        uids = uids[start:start + res.batchSize]
+        objects = obj.getTool().getObjects(uids, appy=appy)
+        for i in range(len(uids)):
+            tied = objects[i]
             if not tied:
                 obj.log(OBJECT_NOT_FOUND % (self.name, obj.id, uids[i]),
                         type='error')
             else:
-                if appy: tied = tied.appy()
                 res.objects.append(tied)
-            i += 1
         # Manage parameter p_noListIfSingleObj
         if noListIfSingleObj and (self.multiplicity[1] == 1):
             if res.objects:
@@ -1553,6 +1689,13 @@ class Ref(Field):
         elif nbOfRefs > maxRef:
             return obj.translate('max_ref_violated')
 
+    def clearSortKeys(self, obj, ids=None):
+        '''If this Ref is indexed (see attribute "indexedRefs"), removes, from
+           the sort keys stored on p_obj, those of the tied objects whose p_ids
+           are given, or all of them if p_ids is None.'''
+        refs = getattr(obj.o.aq_base, self.name, None)
+        if isinstance(refs, IndexedList): refs.clearSortKeys(ids)
+
     def linkObject(self, obj, value, back=False, noSecurity=True,
                    executeMethods=True, at=None):
         '''This method links p_value (which can be a list of objects) to p_obj
@@ -1581,7 +1724,14 @@ class Ref(Field):
         # Gets the list of referred objects (=list of uids), or create it.
         refs = getattr(zobj.aq_base, self.name, None)
         if refs is None:
-            refs = zobj.getProductConfig().PersistentList()
+            if self.indexedRefs:
+                refs = IndexedList()
+            else:
+                refs = zobj.getProductConfig().PersistentList()
+            setattr(zobj, self.name, refs)
+        elif self.indexedRefs and not isinstance(refs, IndexedList):
+            # The list was created before this Ref was indexed: convert it
+            refs = IndexedList(refs)
             setattr(zobj, self.name, refs)
         # Insert p_value into it
         uid = value.o.id
@@ -1605,24 +1755,32 @@ class Ref(Field):
             # insert the new object.
             tool = zobj.getTool()
             insertOrder = self.insert(obj, value)
+            getKey = lambda id: self.insert(obj, tool.getObject(id, appy=True))
+            if isinstance(refs, IndexedList):
+                # Use the sort keys stored in the list
+                compute = getKey
+                getKey = lambda id: refs.getSortKey(id, compute)
             i = 0
             inserted = False
             while i < len(refs):
-                tied = tool.getObject(refs[i], appy=True)
-                if self.insert(obj, tied) > insertOrder:
+                if getKey(refs[i]) > insertOrder:
                     refs.insert(i, uid)
                     inserted = True
                     break
                 i += 1
             if not inserted: refs.append(uid)
+            if isinstance(refs, IndexedList): refs.sortKeys[uid] = insertOrder
         else:
-            # It is a tuple ('sort', method). Perform a full sort.
+            # It is a tuple ('sort', method). Perform a full sort, with the keys
+            # of tied objects in their current state.
             refs.append(uid)
             tool = zobj.getTool()
+            method = self.insert[1]
+            tied = dict(zip(refs.data, tool.getObjects(refs.data, appy=True)))
+            getKey = lambda id: method(obj, tied[id])
             # Warning: "refs" is a persistent list whose method "sort" has no
             # param "key".
-            refs.data.sort(key=lambda uid:self.insert[1](obj, \
-                                                tool.getObject(uid, appy=True)))
+            refs.data.sort(key=getKey)
             refs._p_changed = 1
         # Update the back reference (if existing)
         if not back and self.back:
@@ -1703,10 +1861,13 @@ class Ref(Field):
         if not objects: objects = []
         if type(objects) not in sutils.sequenceTypes: objects = [objects]
         tool = obj.getTool()
+        # Get the objects corresponding to UIDs with a single catalog query
+        uids = [o for o in objects if isinstance(o, basestring)]
+        if uids: tied = dict(zip(uids, tool.getObjects(uids, appy=True)))
         for i in range(len(objects)):
             if isinstance(objects[i], basestring):
                 # We have an UID here
-                objects[i] = tool.getObject(objects[i], appy=True)
+                objects[i] = tied[objects[i]]
             else:
                 # Be sure to have an Appy object
                 objects[i] = objects[i].appy()
@@ -2059,7 +2220,7 @@ class Ref(Field):
             if isinstance(requestValue, basestring):
                 return [tool.getObject(requestValue)]
             else:
-                return [tool.getObject(rv) for rv in requestValue]
+                return tool.getObjects(requestValue)
         res = []
         # No object can be selected if the popup has not been opened yet
         if 'semantics' not in rq:
@@ -2070,7 +2231,7 @@ class Ref(Field):
         tool = obj.tool
         if rq['semantics'] == 'checked':
             # Simply get the selected objects from their uid
-            return [tool.getObject(uid) for uid in uids]
+            return tool.getObjects(uids)
         else:
             # If link=popup, replay the search in self.select to get the list of
             # uids that were shown in the popup. If link=popupRef, simply get
@@ -2086,9 +2247,8 @@ class Ref(Field):
             elif self.link == 'popupRef':
                 initiatorObj, fieldName = self.select(obj)
                 linkUids = initiatorObj.ids(fieldName)
-            for uid in linkUids:
-                if uid not in uids:
-                    res.append(tool.getObject(uid))
+            res = tool.getObjects([uid for uid in linkUids \
+                                   if uid not in uids])
         return res
 
     def onSelectFromPopup(self, obj):
@@ -502,16 +502,91 @@ class ToolMixin(BaseMixin):
                 if not appy:
                     res = res.o
             else:
-                res = app.catalog(UID=uid)
-                if not res: return
-                res = res[0]
-                if brain: return res
-                res = res._unrestrictedGetObject()
+                # Then, try to traverse the object's path if it is known
+                res = not brain and self.getObjectAt(uid) or None
+                if res is None:
+                    res = app.catalog(UID=uid)
+                    if not res: return
+                    res = res[0]
+                    if brain: return res
+                    gutils.objectPaths.set(uid, res.getPath())
+                    res = res._unrestrictedGetObject()
         else:
             res = getattr(app.temp_folder, uid)
         if not appy: return res
         return res.appy()
 
+    def getObjectAt(self, uid):
+        '''Gets the object whose p_uid is given, by traversing its path as
+           found in gutils.objectPaths. Returns None if the path is unknown or
+           if the object is not found there anymore.'''
+        paths = gutils.objectPaths
+        path = paths.get(uid)
+        if not path: return
+        try:
+            r = self.getPhysicalRoot().unrestrictedTraverse(path)
+        except ConflictError:
+            raise
+        except Exception:
+            r = None
+        # Traversal uses acquisition: an object that has been moved higher in
+        # the tree may still be found, under a wrong parent, via its old path.
+        # The object's physical path must thus be the cached one.
+        if (getattr(r, 'id', None) != uid) or \
+           ('/'.join(r.getPhysicalPath()) != path):
+            # The object was deleted or moved, ie, by another process
+            paths.pop(uid)
+            return
+        return r
+
+    def getObjects(self, uids, appy=False, brain=False):
+        '''Retrieves the objects whose p_uids are given, with a single catalog
+           query. r_ is a list of objects (or brains if p_brain is True), in
+           the same order as p_uids, containing None for every UID for which no
+           object was found.'''
+        if not uids: return []
+        # Search first among wrappers: it is more performant
+        req = getattr(self, 'REQUEST', None)
+        wrappers = None
+        if not brain and req and hasattr(req, 'wrappers'):
+            wrappers = req.wrappers
+        if wrappers:
+            missing = [uid for uid in uids if uid not in wrappers]
+        else:
+            missing = uids
+        # Then, traverse the paths of objects whose paths are known
+        found = {}
+        if not brain:
+            for uid in missing:
+                obj = self.getObjectAt(uid)
+                if obj is not None: found[uid] = obj
+            if found: missing = [uid for uid in missing if uid not in found]
+        # Get the brains of all other objects, keyed by UID. The UID of an
+        # object is also its ID, being the last part of its path.
+        brains = {}
+        if missing:
+            paths = gutils.objectPaths
+            for b in self.getPhysicalRoot().catalog(UID=list(missing)):
+                path = b.getPath()
+                uid = os.path.basename(path)
+                brains[uid] = b
+                paths.set(uid, path)
+        r = []
+        for uid in uids:
+            if wrappers and (uid in wrappers):
+                obj = wrappers[uid]
+                if not appy: obj = obj.o
+            elif uid in found:
+                obj = found[uid]
+                if appy: obj = obj.appy()
+            else:
+                obj = brains.get(uid)
+                if obj and not brain:
+                    obj = obj._unrestrictedGetObject()
+                    if appy: obj = obj.appy()
+            r.append(obj)
+        return r
+
     def toObject(self, brain, noSecurity=False, appy=False):
         '''Get an object from a catalog's p_brain. If appy is True, it returns
            an Appy object instead of a Zope object. If p_noSecurity is True,
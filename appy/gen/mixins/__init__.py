@@ -198,6 +198,8 @@ class BaseMixin:
             del self.REQUEST.wrappers[self.id]
         except AttributeError:
             pass
+        # Forget the object's path
+        objectPaths.pop(self.id)
         # Delete the filesystem folder corresponding to this object
         folder = os.path.join(*self.getFsFolder())
         if os.path.exists(folder):
@@ -601,9 +603,14 @@ class BaseMixin:
            recompute: all the indexes not being in this list will be.'''
         path = '/'.join(self.getPhysicalPath())
         catalog = self.getPhysicalRoot().catalog
+        # Remember or forget the object's path (see ToolMixin.getObject)
         if unindex:
             catalog.uncatalog_object(path)
+            objectPaths.pop(self.id)
         else:
+            objectPaths.set(self.id, path)
+            # The sort keys stored for this object may be outdated
+            self.forgetSortKeys()
             if indexes:
                 # Get the names of the indexes to take into account
                 names = indexes
@@ -620,6 +627,21 @@ class BaseMixin:
                 names = self.wrapperClass.getIndexes().keys()
                 catalog.catalog_object(self, path, idxs=names)
 
+    def forgetSortKeys(self):
+        '''Removes the sort key of this object from the indexed Refs it is tied
+           to, whose attribute "insert" is a method (see
+           appy.fields.ref.IndexedList).'''
+        tool = None
+        for field in self.getAllAppyTypes():
+            if (field.type != 'Ref') or not field.isBack: continue
+            forward = field.back
+            if not forward.indexedRefs or not callable(forward.insert): continue
+            ids = getattr(self.aq_base, field.name, None)
+            if not ids: continue
+            tool = tool or self.getTool()
+            for obj in tool.getObjects(ids, appy=True):
+                if obj: forward.clearSortKeys(obj, (self.id,))
+
     def xml(self, action=None):
         '''If no p_action is defined, this method returns the XML version of
            this object. Else, it calls method named p_action on the
@@ -4,6 +4,18 @@ import re, os, os.path, base64, urllib, types
 from appy import Object
 from appy.px import Px
 from appy.shared import utils as sutils
+from appy.shared.cache import LruCache
+
+# Process-wide cache of object paths ~{s_uid: s_path}~ -------------------------
+# Getting an object from its UID requires a catalog query. Because the UID of
+# an object never changes, the path of any object found via the catalog or
+# being (re)indexed is kept here: getting the object again simply consists in
+# traversing its path (see ToolMixin.getObject). Entries are removed when
+# objects are unindexed or deleted. Because this cache is not shared between
+# processes, any path found here is checked before being used: the object may
+# have been deleted or moved by another process. Call objectPaths.getStats()
+# to get statistics about this cache, like its hit rate.
+objectPaths = LruCache(maxEntries=50000)
 
 # Function for creating a Zope object ------------------------------------------
 def createObject(folder, id, className, appName, wf=True, noSecurity=False,
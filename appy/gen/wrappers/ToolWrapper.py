@@ -4,6 +4,7 @@ import appy
 from appy import Object as O
 from appy.px import Px
 from appy.gen.mail import sendMail
+from appy.gen import utils as gutils
 from appy.gen.wrappers import AbstractWrapper
 from appy.shared.utils import executeCommand
 from appy.shared.ldap_connector import LdapConnector
@@ -439,6 +440,17 @@ class ToolWrapper(AbstractWrapper):
         '''Allow to retrieve an object from its unique p_id'''
         return self.o.getObject(id, appy=True, temp=temp)
 
+    def getObjects(self, ids):
+        '''Allow to retrieve, with a single catalog query, the objects whose
+           unique p_ids are given. The result contains None for every id for
+           which no object was found.'''
+        return self.o.getObjects(ids, appy=True)
+
+    def getObjectCacheStats(self):
+        '''Returns statistics (hits, misses, hit rate...) about the cache of
+           object paths used by m_getObject and m_getObjects.'''
+        return gutils.objectPaths.getStats()
+
     def getDiskFolder(self):
         '''Returns the disk folder where the Appy application is stored'''
         return self.o.config.diskFolder
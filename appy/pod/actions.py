@@ -65,6 +65,14 @@ class Action:
         # Several actions may co-exist for the same buffer, as a chain of Action
         # instances, defined via the following attribute.
         self.subAction = None
+        # Expressions split into their "normal" and "error" parts
+        # ~{s_expr: (s_normalExpr, s_errorExpr)}~ (see m_splitExpr) and code
+        # objects compiled from them (see appy.pod.evaluator.Evaluator.getCode).
+        self.splitted = {}
+        self.codes = {}
+        # The statement defining this action, as written in the pod template
+        # (pod only).
+        self.statement = None
 
     def setFrom(self, plus, expr):
         '''Associate to this action a "from" clause (pod only)'''
@@ -83,13 +91,17 @@ class Action:
         if self.buffer.env.raiseOnError:
             if not self.buffer.pod:
                 # Add in the error message the line nb where the errors occurs
-                # within the PX.
-                locator = self.buffer.env.parser.locator
-                # The column number may not be given
-                col = locator.getColumnNumber()
-                if col is None: col = ''
-                else: col = ', column %d' % col
-                errorMessage += ' (line %s%s)' % (locator.getLineNumber(), col)
+                # within the PX. There is no locator if the PX was loaded from
+                # a cache (see appy.px.cache.ParseCache).
+                parser = self.buffer.env.parser
+                locator = parser and getattr(parser, 'locator', None)
+                if locator:
+                    # The column number may not be given
+                    col = locator.getColumnNumber()
+                    if col is None: col = ''
+                    else: col = ', column %d' % col
+                    errorMessage += ' (line %s%s)' % \
+                                    (locator.getLineNumber(), col)
                 # Integrate the traceback (at least, its last lines)
                 errorMessage += '\n' + Traceback.get(6).decode('utf-8')
             if originalError:
@@ -104,19 +116,33 @@ class Action:
         PodError.dump(tempBuffer, errorMessage, withinElement=self.elem)
         tempBuffer.evaluate(result, context)
 
+    def splitExpr(self, expr):
+        '''Returns a tuple (normalExpr, errorExpr) from p_expr, that can be of
+           the form "someExpr|errorExpr". errorExpr is None if p_expr does not
+           contain any error expr.'''
+        r = self.splitted.get(expr)
+        if r is None:
+            if '|' not in expr:
+                r = expr, None
+            else:
+                r = tuple(expr.rsplit('|', 1))
+            self.splitted[expr] = r
+        return r
+
     def _evalExpr(self, expr, context):
         '''Evaluates p_expr with p_context. p_expr can contain an error expr,
            in the form "someExpr|errorExpr". If it is the case, if the "normal"
            expr raises an error, the "error" expr is evaluated instead.'''
-        eval = context['_eval_'].run
-        if '|' not in expr:
-            res = eval(expr, context)
+        eval = context['_eval_'].evaluate
+        codes = self.codes
+        expr, errorExpr = self.splitExpr(expr)
+        if errorExpr is None:
+            res = eval(expr, context, codes)
         else:
-            expr, errorExpr = expr.rsplit('|', 1)
             try:
-                res = eval(expr, context)
+                res = eval(expr, context, codes)
             except Exception:
-                res = eval(errorExpr, context)
+                res = eval(errorExpr, context, codes)
         return res
 
     def storeExprResult(self, r, context):
@@ -146,9 +172,26 @@ class Action:
             error = True
         return res, error
 
+    def getSource(self):
+        '''Returns the source of this action, as shown in profiling reports'''
+        r = self.statement or ('%s %s' % (self.__class__.__name__.lower(),
+                                          self.expr or ''))
+        if self.fromExpr: r = '%s from %s' % (r, self.fromExpr)
+        return r
+
     def execute(self, result, context):
         '''Executes this action given some p_context and add the result to
            p_result.'''
+        profiler = self.buffer.pod and self.buffer.env.profiler
+        if not profiler: return self._execute(result, context)
+        start = profiler.start(result)
+        try:
+            self._execute(result, context)
+        finally:
+            profiler.stop('statement', self.getSource(), result, start)
+
+    def _execute(self, result, context):
+        '''Executes this action (see m_execute)'''
         # Check that if minus is set, we have an element which can accept it
         if self.minus and isinstance(self.elem, Table) and \
            (not self.elem.tableInfo.isOneCell()):
@@ -196,7 +239,8 @@ class Action:
             fromRes = None
             error = False
             try:
-                fromRes = context['_eval_'].run(self.fromExpr, context)
+                fromRes = context['_eval_'].evaluate(self.fromExpr, context,
+                                                     self.codes)
             except Exception, e:
                 msg = FROM_EVAL_ERROR % (self.fromExpr,self.getExceptionLine(e))
                 self.manageError(result, context, msg, e)
@@ -553,8 +597,12 @@ class MetaIf(Action):
             # it might not be rendered. self.minus must not be interpreted. When
             # reifying several notes in the same paragraph, ensure they are
             # reified in order, by forcing to insert a note after another one.
-            self.buffer.insertSubBuffer(note, after='text:p',
-                                        afterClosing='office:annotation')
+            insertion = self.buffer.insertSubBuffer(note, after='text:p',
+                                              afterClosing='office:annotation')
+            # Remember this insertion: it will be undone once the rendering is
+            # over, allowing the buffer to be evaluated again with another
+            # context (see appy/pod/cache.py).
+            self.buffer.env.insertions.append(insertion)
             self.evaluateBuffer(result, context,
                                 forceSource='buffer', ignoreMinus=True)
 
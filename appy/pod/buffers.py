@@ -1,6 +1,6 @@
 # ~license~
 # ------------------------------------------------------------------------------
-import re, sys
+import re, sys, cStringIO
 from xml.sax.saxutils import quoteattr
 
 from appy.pod import PodError
@@ -59,50 +59,17 @@ BAD_META_CONDITION = 'Wrong meta-condition "%s". A meta-condition must be a ' \
 L_IF_KO  = 'No "if" action can be linked to this "else" action.'
 
 # ------------------------------------------------------------------------------
-class BufferIterator:
-    def __init__(self, buffer):
-        self.buffer = buffer
-        self.remainingSubBufferIndexes = buffer.subBuffers.keys()
-        self.remainingElemIndexes = buffer.elements.keys()
-        self.remainingSubBufferIndexes.sort()
-        self.remainingElemIndexes.sort()
-
-    def __iter__(self): return self
-    def __next__(self):
-        # Stop if there is no more elem nor sub-buffer
-        if not self.remainingSubBufferIndexes and not self.remainingElemIndexes:
-            raise StopIteration
-        nextSubBufferIndex = None
-        if self.remainingSubBufferIndexes:
-            nextSubBufferIndex = self.remainingSubBufferIndexes[0]
-        nextExprIndex = None
-        if self.remainingElemIndexes:
-            nextExprIndex = self.remainingElemIndexes[0]
-        # Compute min between nextSubBufferIndex and nextExprIndex
-        if (nextSubBufferIndex != None) and (nextExprIndex != None):
-            res = min(nextSubBufferIndex, nextExprIndex)
-        elif (nextSubBufferIndex == None) and (nextExprIndex != None):
-            res = nextExprIndex
-        elif (nextSubBufferIndex != None) and (nextExprIndex == None):
-            res = nextSubBufferIndex
-        # Update "remaining" lists
-        if res == nextSubBufferIndex:
-            self.remainingSubBufferIndexes = self.remainingSubBufferIndexes[1:]
-            resDict = self.buffer.subBuffers
-        elif res == nextExprIndex:
-            self.remainingElemIndexes = self.remainingElemIndexes[1:]
-            resDict = self.buffer.elements
-        return res, resDict[res]
-    next = __next__ # Python2-3 compliance
-
-# ------------------------------------------------------------------------------
-class Buffer:
+class Buffer(object):
     '''Abstract class representing any buffer used during rendering'''
     elementRex = re.compile('([\w-]+:[\w-]+)\s*(.*?)>', re.S)
 
     def __init__(self, env, parent):
         self.parent = parent
         self.subBuffers = {} # ~{i_bufferIndex: Buffer}~
+        # The ordered list of elements and sub-buffers, as computed by
+        # MemoryBuffer.getSchedule. It must be reset to None every time
+        # p_self.subBuffers or MemoryBuffer.elements are modified.
+        self.schedule = None
         self.env = env
         # Are we computing for pod (True) or px (False)
         self.pod = env.__class__.__name__ != 'PxEnvironment'
@@ -111,6 +78,7 @@ class Buffer:
         if not subBuffer:
             subBuffer = MemoryBuffer(self.env, self)
         self.subBuffers[self.getLength()] = subBuffer
+        self.schedule = None
         subBuffer.parent = self
         return subBuffer
 
@@ -119,6 +87,7 @@ class Buffer:
         subBufferIndexes.sort()
         lastIndex = subBufferIndexes.pop()
         del self.subBuffers[lastIndex]
+        self.schedule = None
 
     def write(self, something): pass # To be overridden
 
@@ -238,39 +207,155 @@ class Buffer:
 
 # ------------------------------------------------------------------------------
 class FileBuffer(Buffer):
-    def __init__(self, env, result):
+    def __init__(self, env, result, record=False):
         Buffer.__init__(self, env, None)
+        # p_result is the path to the file to write. If None, the content is
+        # written in memory: once the buffer is closed, it is available in
+        # p_self.value.
         self.result = result
-        self.content = file(result, 'w')
+        if result is None:
+            self.content = cStringIO.StringIO()
+        else:
+            self.content = file(result, 'w')
+        self.value = None
         self.content.write(xmlPrologue)
+        # If p_record is True, while the template is parsed, this buffer keeps
+        # track, in p_self.program, of everything it is asked to do: writing
+        # static chunks of content, or evaluating expressions, actions and
+        # memory buffers. Replaying this "program" (see m_replay) with another
+        # context produces another result without re-parsing the template.
+        self.program = None
+        if record: self.program = []
+        # Static chunks being written, not added yet to the program
+        self.chunks = []
+        # Recording is paused while dynamic content is being evaluated
+        self.recording = record
+        # If the result is rendered incrementally, the appy.pod.cache.Increments
+        # instance managing the chunks produced by the dynamic entries of the
+        # program.
+        self.increments = None
 
     # getLength is used to manage insertions into sub-buffers. But in the case
     # of a FileBuffer, we will only have 1 sub-buffer at a time, and we don't
     # care about where it will be inserted into the FileBuffer.
     def getLength(self): return 0
 
+    def tell(self):
+        '''Returns the number of bytes written so far'''
+        return self.content.tell()
+
     def write(self, something):
+        if self.recording: self.chunks.append(something)
         try:
             self.content.write(something.encode('utf-8'))
         except UnicodeDecodeError:
             self.content.write(something)
 
+    def record(self, entry):
+        '''Adds this dynamic p_entry to p_self.program, after the static chunks
+           having been written so far.'''
+        if self.chunks:
+            self.program.append(u''.join(self.chunks))
+            self.chunks = []
+        if entry is not None: self.program.append(entry)
+
+    def close(self):
+        '''Closes the file being written'''
+        if self.recording: self.record(None)
+        if self.result is None: self.value = self.content.getvalue()
+        self.content.close()
+
     def pushSubBuffer(self, subBuffer): pass
     def getRootBuffer(self): return self
 
     def addExpression(self, expression, elem=None, tiedHook=None):
+        expr = Expression(expression, self.pod)
+        if tiedHook: tiedHook.tiedExpression = expr
+        self.evaluateExpression(expr, expression, self.env.context)
+
+    def evaluateExpression(self, expr, expression, context):
+        '''Evaluates p_expr, whose source is p_expression, with this
+           p_context.'''
+        if self.recording:
+            entry = (expr, expression)
+            return self.evaluateRecorded(entry, entry, context)
+        profiler = self.env.profiler
+        if profiler: start = profiler.start(self)
+        try:
+            try:
+                res, escape = expr.evaluate(context)
+                if escape: self.dumpContent(res)
+                else: self.write(res)
+            except Exception, e:
+                if not self.env.raiseOnError:
+                    PodError.dump(self, EVAL_EXPR_ERROR % (expression, e),
+                                  dumpTb=False)
+                else:
+                    raise Exception(EVAL_EXPR_ERROR % (expression, e))
+        finally:
+            if profiler: profiler.stop('expression', expr.expr, self, start)
+
+    def evaluateBuffer(self, buffer, context, action=False):
+        '''Evaluates this memory p_buffer, or its tied action if p_action is
+           True, with this p_context.'''
+        entry = action and buffer.action or buffer
+        if self.recording:
+            # Record a copy of the p_buffer: the parser may reuse it
+            recorded = action and entry or buffer.copy()
+            return self.evaluateRecorded(entry, recorded, context)
+        self.evaluateEntry(entry, context)
+
+    def evaluateRecorded(self, entry, recorded, context):
+        '''Adds p_recorded to p_self.program and evaluates the dynamic p_entry
+           it corresponds to, with this p_context. Recording is paused while
+           p_entry is being evaluated.'''
+        self.record(recorded)
+        self.recording = False
         try:
-            expr = Expression(expression, self.pod)
-            if tiedHook: tiedHook.tiedExpression = expr
-            res, escape = expr.evaluate(self.env.context)
-            if escape: self.dumpContent(res)
-            else: self.write(res)
-        except Exception, e:
-            if not self.env.raiseOnError:
-                PodError.dump(self, EVAL_EXPR_ERROR % (expression, e),
-                              dumpTb=False)
+            if self.increments:
+                index = len(self.program) - 1
+                self.increments.evaluate(self, index, entry, context)
             else:
-                raise Exception(EVAL_EXPR_ERROR % (expression, e))
+                self.evaluateEntry(entry, context)
+        finally:
+            self.recording = True
+
+    def evaluateEntry(self, entry, context):
+        '''Evaluates this dynamic p_entry from a program (see m_replay) with
+           this p_context.'''
+        if isinstance(entry, tuple):
+            self.evaluateExpression(entry[0], entry[1], context)
+        elif isinstance(entry, actions.Action):
+            entry.execute(self, context)
+        else:
+            entry.evaluate(self, context)
+
+    def capture(self, entry, context):
+        '''Evaluates this dynamic p_entry with this p_context and returns, as a
+           string, what it has written in p_self.'''
+        content = self.content
+        self.content = cStringIO.StringIO()
+        try:
+            self.evaluateEntry(entry, context)
+            r = self.content.getvalue()
+        finally:
+            self.content = content
+        content.write(r)
+        return r
+
+    def replay(self, program, context):
+        '''Writes, in this buffer, the result of executing this p_program, as
+           recorded by another file buffer, with this p_context.'''
+        increments = self.increments
+        i = -1
+        for entry in program:
+            i += 1
+            if isinstance(entry, basestring):
+                self.write(entry)
+            elif increments:
+                increments.evaluate(self, i, entry, context)
+            else:
+                self.evaluateEntry(entry, context)
 
     def addAttributes(self):
         # Into a FileBuffer, it is not possible to insert Attributes. Every
@@ -298,19 +383,62 @@ class MemoryBuffer(Buffer):
 
     def __init__(self, env, parent):
         Buffer.__init__(self, env, parent)
-        self.content = u''
+        # The buffer content is stored as a list of chunks, that are joined
+        # only when the content is read (see property "content" below). This
+        # way, writing into the buffer does not imply creating, every time, a
+        # new (and potentially huge) string.
+        self.chunks = []
+        self.length = 0
         self.elements = {}
         self.action = None
 
+    def getContent(self):
+        '''Gets the buffer content as a single string'''
+        chunks = self.chunks
+        if len(chunks) == 1 and isinstance(chunks[0], unicode):
+            return chunks[0]
+        r = u''.join(chunks)
+        self.chunks = [r]
+        return r
+
+    def setContent(self, content):
+        '''Replaces the buffer content with this p_content'''
+        self.chunks = [content]
+        self.length = len(content)
+
+    content = property(getContent, setContent)
+
+    def getSchedule(self):
+        '''Returns the list of this buffer's elements and sub-buffers, as
+           (index, entry) tuples, ordered by index. The list is computed once
+           and reused until the buffer is modified.'''
+        r = self.schedule
+        if r is None:
+            # At the same index, a sub-buffer comes before an element
+            r = [(i, 0, sub) for i, sub in self.subBuffers.iteritems()]
+            r += [(i, 1, elem) for i, elem in self.elements.iteritems()]
+            r.sort()
+            r = self.schedule = [(i, entry) for i, type, entry in r]
+        return r
+
     def clone(self):
         '''Produces an empty buffer that is a clone of this one'''
         return MemoryBuffer(self.env, self.parent)
 
+    def copy(self):
+        '''Produces a (shallow) copy of this buffer'''
+        r = self.clone()
+        r.content = self.content
+        r.elements = self.elements
+        r.subBuffers = self.subBuffers
+        r.action = self.action
+        return r
+
     def addSubBuffer(self, subBuffer=None):
         sub = Buffer.addSubBuffer(self, subBuffer)
         # Dump a whitespace to avoid having several subbuffers referenced at the
         # same place within this buffer.
-        self.content += ' '
+        self.write(u' ')
         return sub
 
     def getInsertIndex(self, tag, opening):
@@ -369,16 +497,32 @@ class MemoryBuffer(Buffer):
         size = len(subBuffer.content)
         buf.content = buf.content[:i] + subBuffer.content + buf.content[i:]
         # Increment by 1 all subsequent elements and sub-buffers
+        buf.shiftIndexes(i, size)
+        # Return info allowing to undo the insertion (see m_removeInserted)
+        return buf, i, size
+
+    def shiftIndexes(self, start, delta):
+        '''Shifts, by p_delta, the indexes of all elements and sub-buffers whose
+           index is >= p_start.'''
         for subType in ('elements', 'subBuffers'):
-            subElements = getattr(buf, subType)
+            subElements = getattr(self, subType)
             if not subElements: continue
             indexes = subElements.keys()
-            indexes.sort(reverse=True)
+            indexes.sort(reverse=delta > 0)
             for j in indexes:
-                if j >= i:
+                if j >= start:
                     elem = subElements[j]
                     del subElements[j]
-                    subElements[j+size] = elem
+                    subElements[j+delta] = elem
+        self.schedule = None
+
+    @staticmethod
+    def removeInserted(insertion):
+        '''Undoes an insertion as performed by m_insertSubBuffer, that returned
+           this p_insertion.'''
+        buf, i, size = insertion
+        buf.content = buf.content[:i] + buf.content[i+size:]
+        buf.shiftIndexes(i + size, -size)
 
     def getRootBuffer(self):
         '''Returns the root buffer. For POD it is always a FileBuffer. For PX,
@@ -386,9 +530,11 @@ class MemoryBuffer(Buffer):
         if self.parent: return self.parent.getRootBuffer()
         return self
 
-    def getLength(self): return len(self.content)
+    def getLength(self): return self.length
 
-    def write(self, thing): self.content += thing
+    def write(self, thing):
+        self.chunks.append(thing)
+        self.length += len(thing)
 
     def getIndex(self, podElemName):
         res = -1
@@ -438,6 +584,7 @@ class MemoryBuffer(Buffer):
             if (foundElem == elem) and (index > elemIndex):
                 elemIndex = index
         del self.elements[elemIndex]
+        self.schedule = None
 
     def pushSubBuffer(self, subBuffer):
         '''Sets p_subBuffer at the very end of the buffer.'''
@@ -451,7 +598,8 @@ class MemoryBuffer(Buffer):
             # in the parent (if it is a temp buffer generated from a cut)
             del self.subBuffers[subIndex]
             self.subBuffers[self.getLength()] = subBuffer
-            self.content += u' '
+            self.schedule = None
+            self.write(u' ')
 
     def transferAllContent(self):
         '''Transfer all content to parent'''
@@ -459,7 +607,8 @@ class MemoryBuffer(Buffer):
             # First unreference all elements
             for index in self.getElementIndexes(expressions=False):
                 del self.elements[index]
-            self.evaluate(self.parent, self.env.context)
+            self.schedule = None
+            self.parent.evaluateBuffer(self, self.env.context)
         else:
             # Transfer content in itself
             oldParentLength = self.parent.getLength()
@@ -470,6 +619,7 @@ class MemoryBuffer(Buffer):
             # Transfer sub-buffers
             for index, buf in self.subBuffers.iteritems():
                 self.parent.subBuffers[oldParentLength + index] = buf
+            self.parent.schedule = None
         # Empty the buffer
         MemoryBuffer.__init__(self, self.env, self.parent)
         # Change buffer position wrt parent
@@ -479,6 +629,7 @@ class MemoryBuffer(Buffer):
         if pod:
             elem = PodElement.create(elem)
         self.elements[self.getLength()] = elem
+        self.schedule = None
         if isinstance(elem, Cell) or isinstance(elem, Table):
             elem.tableInfo = self.env.getTable()
             if isinstance(elem, Cell):
@@ -486,7 +637,7 @@ class MemoryBuffer(Buffer):
                 elem.colIndex = elem.tableInfo.curColIndex
         if elem == 'x':
             # See comment on similar statement in the method below.
-            self.content += u' '
+            self.write(u' ')
 
     def addExpression(self, expression, elem=None, tiedHook=None):
         '''Creates an Expression instance and add it in the buffer'''
@@ -505,22 +656,25 @@ class MemoryBuffer(Buffer):
                     expr.metaCondition = meta.strip('"\'"')
         if tiedHook: tiedHook.tiedExpression = expr
         self.elements[self.getLength()] = expr
+        self.schedule = None
         # To be sure that an expr and an elem can't be found at the same index
         # in the buffer.
-        self.content += u' '
+        self.write(u' ')
 
     def addAttributes(self):
         '''pod-only: adds an Attributes instance into this buffer'''
         attrs = Attributes(self.env)
         self.elements[self.getLength()] = attrs
-        self.content += u' '
+        self.schedule = None
+        self.write(u' ')
         return attrs
 
     def addAttribute(self, name, expr):
         '''px-only: adds an Attribute instance into this buffer'''
         attr = Attribute(name, expr)
         self.elements[self.getLength()] = attr
-        self.content += u' '
+        self.schedule = None
+        self.write(u' ')
         return attr
 
     def _getVariables(self, expr):
@@ -648,6 +802,7 @@ class MemoryBuffer(Buffer):
             # Create the main action
             self.action = self.createPodAction(actionType, statements,
               statementName, subExpr, podElem, minus)
+            self.action.statement = main
             # Parse the remaining statements, that can contain any number of
             # secondary actions and a from clause.
             fromClause = last = None
@@ -667,6 +822,7 @@ class MemoryBuffer(Buffer):
                     actionType, subExpr = info.groups()
                     last = self.createPodAction(actionType, statements, '',
                                              subExpr, podElem, None, main=False)
+                    last.statement = statement
                     self.action.addSubAction(last)
             # Link the "from" clause
             if fromClause:
@@ -714,7 +870,7 @@ class MemoryBuffer(Buffer):
         subBuffersToDelete = []
         elementsToDelete = []
         mustShift = False
-        for itemIndex, item in BufferIterator(self):
+        for itemIndex, item in self.getSchedule():
             if keepFirstPart:
                 if itemIndex >= index:
                     newIndex = itemIndex-index
@@ -749,6 +905,7 @@ class MemoryBuffer(Buffer):
             for subIndex, buf in self.subBuffers.iteritems():
                 subBuffers[subIndex-index] = buf
             self.subBuffers = subBuffers
+        self.schedule = None
         # Manage content
         if keepFirstPart:
             res.write(self.content[index:])
@@ -807,9 +964,10 @@ class MemoryBuffer(Buffer):
         # skipping potential attributes.
         inAttrValue = False # Are we parsing an attribute value ?
         endTagFound = False # Have we found the end of this tag ?
+        content = self.content
         while not endTagFound:
             pos += 1
-            nextChar = self.content[pos]
+            nextChar = content[pos]
             if (nextChar == '>') and not inAttrValue:
                 # Yes we have it
                 endTagFound = True
@@ -840,6 +998,7 @@ class MemoryBuffer(Buffer):
         pos = self.content.find('>', pos)
         for index in self.elements.keys():
             if index < pos: del self.elements[index]
+        self.schedule = None
 
     reTagContent = re.compile('<(?P<p>[\w-]+):(?P<f>[\w-]+)(.*?)>.*</(?P=p):' \
                               '(?P=f)>', re.S)
@@ -867,10 +1026,13 @@ class MemoryBuffer(Buffer):
                 currentIndex = slice[0]
             else:
                 currentIndex = self.getStartIndex(removeMainElems)
-            for index, evalEntry in BufferIterator(self):
-                result.write(self.content[currentIndex:index])
+            content = self.content
+            profiler = self.pod and self.env.profiler
+            for index, evalEntry in self.getSchedule():
+                result.write(content[currentIndex:index])
                 currentIndex = index + 1
                 if isinstance(evalEntry, Expression):
+                    if profiler: start = profiler.start(result)
                     try:
                         res, escape = evalEntry.evaluate(context)
                         if escape: result.dumpContent(res)
@@ -887,6 +1049,9 @@ class MemoryBuffer(Buffer):
                             traceback = Traceback.get(5).decode('utf-8')
                             raise actions.EvaluationError(e, EVAL_EXPR_ERROR % \
                                              (evalEntry.expr, '\n' + traceback))
+                    if profiler:
+                        profiler.stop('expression', evalEntry.expr, result,
+                                      start)
                 elif isinstance(evalEntry, Attributes) or \
                      isinstance(evalEntry, Attribute):
                     result.write(evalEntry.evaluate(context))
@@ -900,7 +1065,7 @@ class MemoryBuffer(Buffer):
             else:
                 stopIndex = self.getStopIndex(removeMainElems)
             if currentIndex < (stopIndex-1):
-                result.write(self.content[currentIndex:stopIndex])
+                result.write(content[currentIndex:stopIndex])
 
     def clean(self):
         '''Cleans the buffer content'''
@@ -0,0 +1,664 @@
+'''Process-wide caches of compiled pod templates, imported images and PDFs,
+   XHTML conversions and template styles'''
+
+# ~license~
+# ------------------------------------------------------------------------------
+import os, os.path, re, threading, hashlib
+
+from appy.shared.cache import LruCache
+from appy.shared.zip import dumpEntries
+from appy.pod.elements import Expression
+from appy.pod.buffers import MemoryBuffer
+from appy.pod.actions import Action, Variables
+
+# ------------------------------------------------------------------------------
+class CompiledTemplate:
+    '''A pod template whose content.xml and styles.xml have already been parsed.
+       Rendering it again only consists in evaluating its expressions and
+       actions with another context.'''
+
+    # When a template is rendered for the first time, its content.xml and
+    # styles.xml files are parsed and evaluated, as usual, but the renderer's
+    # file buffers record, at the same time, their "programs": the sequences of
+    # static chunks of ODF content and dynamic entries (expressions, actions and
+    # memory buffers) they have been asked to write or evaluate. The compiled
+    # template keeps these programs: any subsequent rendering simply replays
+    # them (see appy.pod.buffers.FileBuffer.replay).
+
+    # Because evaluating actions and expressions alters their state (ie, the
+    # last result of an expression), a compiled template can't be used by
+    # several renderers at the same time: it is "checked out" from the cache
+    # by a renderer, and put back in it once the rendering is done.
+
+    def __init__(self, key, info, entries):
+        # The key identifying the template, as computed by TemplateCache.getKey
+        self.key = key
+        # The content of the main template files (content.xml, styles.xml...)
+        # as returned by appy.shared.zip.unzip.
+        self.info = info
+        # All the files being part of the template ~[(s_name, s_content)]~,
+        # including pictures, meta.xml, META-INF/manifest.xml, etc.
+        self.entries = entries
+        # The programs for content.xml and styles.xml ~{s_name: [entry]}~
+        self.programs = {}
+        # The parser environments being referred to by the programs' buffers
+        self.envs = {}
+        # Is this compiled template ready to be replayed ?
+        self.ready = False
+
+    def fork(self):
+        '''Returns a new, not-ready-yet, compiled template, for the same
+           template.'''
+        return CompiledTemplate(self.key, self.info, self.entries)
+
+    def dump(self, folder):
+        '''Dumps the template files in this p_folder and returns
+           p_self.info.'''
+        dumpEntries(self.entries, folder)
+        return self.info
+
+    def record(self, name, parser):
+        '''This p_parser has just parsed the template file named p_name
+           (content or styles): remember the program its file buffer has
+           recorded.'''
+        env = parser.env
+        self.programs[name] = env.currentBuffer.getRootBuffer().program
+        self.envs[name] = env
+
+    def replay(self, name, parser):
+        '''Replays the program tied to file p_name (content or styles), by
+           writing its result into p_parser's file buffer.'''
+        env = self.envs[name]
+        new = parser.env
+        # Bind the recorded buffers and actions to the current rendering
+        env.context = new.context
+        env.parser = parser
+        env.raiseOnError = new.raiseOnError
+        env.profiler = new.profiler
+        # Initialise the new environment as if it had parsed the file
+        new.namespaces = env.namespaces
+        new.gotNamespaces = True
+        new.tags = env.tags
+        new.odsGraphics = env.odsGraphics
+        buffer = new.currentBuffer
+        try:
+            buffer.replay(self.programs[name], new.context)
+        finally:
+            buffer.close()
+
+    def release(self):
+        '''Unbinds recorded buffers and actions from the last rendering, in
+           order to let it be garbage-collected, and undo any change the
+           rendering has made to the buffers.'''
+        for env in self.envs.itervalues():
+            env.context = env.parser = env.currentBuffer = None
+            insertions = env.insertions
+            while insertions:
+                MemoryBuffer.removeInserted(insertions.pop())
+
+# ------------------------------------------------------------------------------
+class TemplateCache:
+    '''Cache of compiled templates, keyed by template and by renderer options
+       having an impact on template parsing.'''
+
+    # Renderer attributes having an impact on the way a template is parsed
+    parseAttributes = ('expressionsHolders', 'protection', 'tabbedCR',
+                       'raiseOnError')
+
+    def __init__(self, maxTemplates=50, maxCopies=4):
+        # Compiled templates ~{key: [CompiledTemplate]}~. For every template,
+        # there may be several idle copies: one per renderer that has rendered
+        # it concurrently with others. At most p_maxCopies copies are kept.
+        self.templates = LruCache(maxEntries=maxTemplates)
+        self.maxCopies = maxCopies
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+
+    def getKey(self, renderer):
+        '''Computes the key identifying the template being rendered by this
+           p_renderer.'''
+        template = renderer.template
+        if isinstance(template, basestring):
+            # A path to a file: identify it by its path and modification date
+            path = os.path.abspath(template)
+            stat = os.stat(path)
+            r = [path, stat.st_mtime, stat.st_size]
+        else:
+            # A file-like object: identify it by its content
+            template.seek(0)
+            r = [hashlib.md5(template.read()).hexdigest()]
+            template.seek(0)
+        for name in self.parseAttributes:
+            value = getattr(renderer, name)
+            if isinstance(value, list): value = tuple(value)
+            r.append(value)
+        evaluator = renderer.evaluator
+        r.append(evaluator and evaluator.__class__.__name__)
+        return tuple(r)
+
+    def get(self, key):
+        '''Checks out an idle compiled template for the template identified by
+           this p_key. Returns None if there is no such template.'''
+        with self.lock:
+            copies = self.templates.get(key)
+            if copies:
+                self.hits += 1
+                return copies.pop()
+            self.misses += 1
+        return
+
+    def put(self, compiled):
+        '''Puts back this p_compiled template in the cache, once a renderer has
+           finished using it.'''
+        compiled.release()
+        if not compiled.ready: return
+        with self.lock:
+            copies = self.templates.get(compiled.key)
+            if copies is None:
+                self.templates.set(compiled.key, [compiled])
+            elif len(copies) < self.maxCopies:
+                copies.append(compiled)
+
+    def clear(self):
+        '''Removes all compiled templates from the cache'''
+        with self.lock:
+            self.templates.clear()
+            self.hits = self.misses = 0
+
+    def getStats(self):
+        '''Returns a dict of statistics about this cache'''
+        with self.lock:
+            return {'templates': len(self.templates), 'hits': self.hits,
+                    'misses': self.misses}
+
+# The process-wide cache used by renderers for which attribute "cacheTemplate"
+# is True.
+templates = TemplateCache()
+
+# ------------------------------------------------------------------------------
+class Chunk:
+    '''The part of a pod result produced by a dynamic entry of the program of a
+       compiled template, with the changes its evaluation has made to the
+       context.'''
+
+    def __init__(self, content, variables, evals):
+        # The ODF content, as an encoded string
+        self.content = content
+        # The lasting variables defined by the entry ~{s_name: value}~
+        self.variables = variables
+        # The results of "if" expressions, stored in the context in order to be
+        # used by "else" actions ~{i_actionId: value}~.
+        self.evals = evals
+
+class Increments:
+    '''Chunks of a pod result, allowing to render it again incrementally'''
+
+    # The program of a compiled template (see CompiledTemplate) is a sequence
+    # of static chunks of ODF content and dynamic entries: top-level
+    # expressions, actions and memory buffers. When a renderer is given an
+    # Increments instance (see Renderer parameter "increments"), the ODF
+    # content produced by every dynamic entry is kept in it, as a Chunk. The
+    # same instance can then be given to another renderer producing the same
+    # document, after having called m_invalidate with the names of the context
+    # variables whose values have changed in the meantime: only the entries
+    # whose expressions mention one of these names are evaluated again; the
+    # chunks produced by the others are reused as is.
+
+    # The names mentioned by an entry are found by a static analysis of its
+    # expressions, including those of its sub-buffers and sub-actions: any
+    # identifier found in an expression is considered to be a name the entry
+    # depends on. This analysis is conservative, but expressions must only
+    # depend on the context: an expression whose result depends on something
+    # else (the current date, a database...) will not be evaluated again as
+    # long as the variables it mentions are not invalidated.
+
+    # The chunk produced by an entry having side effects on the result, like
+    # importing an image or a document, or generating styles (ie, an XHTML
+    # conversion), is not kept: such an entry is evaluated every time.
+
+    # An Increments instance must not be used by several renderers at the same
+    # time. Its chunks are only reused if the renderer uses the same compiled
+    # template as the previous one.
+
+    identifier = re.compile('[A-Za-z_]\w*')
+
+    def __init__(self):
+        # The compiled template for which the chunks have been produced
+        self.compiled = None
+        # The chunks ~{(s_file, i_index): Chunk}~, s_file being "content" or
+        # "styles" and i_index being the index of the dynamic entry in the
+        # program.
+        self.chunks = {}
+        # The names mentioned by the entries, and the names of the lasting
+        # variables they define ~{(s_file, i_index): (names, lasting)}~
+        self.names = {}
+        # The names of the variables having changed since the last rendering
+        self.changed = set()
+        # The file being currently rendered and the renderer rendering it
+        self.file = self.renderer = None
+        # Statistics about the last rendering
+        self.hits = self.misses = 0
+
+    def invalidate(self, *names):
+        '''Declares that the context variables having these p_names have
+           changed since the last rendering. Without p_names, the next
+           rendering will be complete.'''
+        if names:
+            self.changed.update(names)
+        else:
+            self.chunks = {}
+
+    def start(self, renderer):
+        '''Called by this p_renderer before rendering the result'''
+        if renderer.compiled is not self.compiled:
+            self.compiled = renderer.compiled
+            self.chunks = {}
+            self.names = {}
+        self.renderer = renderer
+        self.hits = self.misses = 0
+
+    def end(self):
+        '''Called by the renderer once the result has been rendered'''
+        self.changed = set()
+        self.file = self.renderer = None
+
+    def addNames(self, expr, names):
+        '''Adds, to p_names, the identifiers found in this p_expr'''
+        if expr: names.update(self.identifier.findall(expr))
+
+    def walk(self, entry, names, lasting):
+        '''Adds, to p_names, the names mentioned by this program p_entry, and,
+           to p_lasting, the names of the lasting variables it defines.'''
+        if isinstance(entry, tuple):
+            self.addNames(entry[1], names)
+        elif isinstance(entry, Action):
+            action = entry
+            while action:
+                self.addNames(action.expr, names)
+                self.addNames(action.fromExpr, names)
+                # An "else" action depends on the expression of its "if"
+                ifAction = getattr(action, 'ifAction', None)
+                if ifAction: self.addNames(ifAction.expr, names)
+                if isinstance(action, Variables):
+                    for vars, expr in action.variables:
+                        self.addNames(expr, names)
+                        if isinstance(vars, basestring): vars = (vars,)
+                        for name in vars:
+                            # Global variables are lasting, too
+                            if action.lasting or name.startswith('@'):
+                                lasting.add(name.lstrip('@'))
+                action = action.subAction
+            self.walk(entry.buffer, names, lasting)
+        else:
+            # A memory buffer
+            for elem in entry.elements.itervalues():
+                if isinstance(elem, Expression):
+                    for expr in (elem.expr, elem.errorExpr,
+                                 elem.metaCondition):
+                        self.addNames(expr, names)
+            for sub in entry.subBuffers.itervalues():
+                self.walk(sub.action or sub, names, lasting)
+
+    def getNames(self, key, entry):
+        '''Returns a tuple (names, lasting) for this program p_entry, whose
+           p_key is given (see m_walk).'''
+        r = self.names.get(key)
+        if r is None:
+            names = set()
+            lasting = set()
+            self.walk(entry, names, lasting)
+            r = self.names[key] = (names, lasting)
+        return r
+
+    def getEffects(self):
+        '''Returns a summary of the side effects the rendering has had so far
+           on the result: imported files, dynamic styles...'''
+        renderer = self.renderer
+        manager = renderer.stylesManager
+        dynamic = manager.dynamicStyles
+        r = [len(renderer.fileNames), renderer.forceOoCall,
+             len(manager.styles)]
+        for name in dynamic.hooks.iterkeys():
+            r.append(len(getattr(dynamic, name)))
+        for namespaces in dynamic.namespaces.itervalues():
+            r.append(len(namespaces))
+        return r
+
+    def evaluate(self, buffer, index, entry, context):
+        '''Writes, in file p_buffer, the chunk produced by this dynamic program
+           p_entry, whose p_index in the program is given: the chunk kept from
+           the previous rendering, or the result of evaluating p_entry with
+           this p_context.'''
+        key = (self.file, index)
+        names, lasting = self.getNames(key, entry)
+        changed = self.changed
+        chunk = self.chunks.get(key)
+        evalsKey = Action.storeExprKey
+        if chunk and not (names & changed):
+            # Reuse the chunk and reproduce its changes to the context
+            self.hits += 1
+            buffer.content.write(chunk.content)
+            context.update(chunk.variables)
+            if chunk.evals:
+                if evalsKey not in context: context[evalsKey] = {}
+                context[evalsKey].update(chunk.evals)
+            return
+        self.misses += 1
+        self.chunks.pop(key, None)
+        evals = context.get(evalsKey)
+        evals = evals and evals.copy() or {}
+        effects = self.getEffects()
+        content = buffer.capture(entry, context)
+        # The lasting variables defined by p_entry may have changed
+        changed.update(lasting)
+        if self.getEffects() != effects: return
+        # Keep the chunk
+        variables = {}
+        for name in lasting:
+            if name in context: variables[name] = context[name]
+        newEvals = {}
+        for id, value in context.get(evalsKey, {}).iteritems():
+            if (id not in evals) or (evals[id] is not value):
+                newEvals[id] = value
+        self.chunks[key] = Chunk(content, variables, newEvals)
+
+# ------------------------------------------------------------------------------
+class CachedImage:
+    '''An image imported by an appy.pod.doc_importers.ImageImporter, kept in
+       memory in order to be imported again without being retrieved and
+       processed again.'''
+
+    def __init__(self, format, content, etag=None, lastModified=None,
+                 variants=None):
+        # The image format (=file extension) and content, as retrieved from its
+        # source (a file, a HTTP server, a Zope blob...).
+        self.format = format
+        self.content = content
+        # For an image retrieved via HTTP, the values of HTTP headers "ETag" and
+        # "Last-Modified", allowing to check if the cached image is still valid.
+        self.etag = etag
+        self.lastModified = lastModified
+        # The versions of the image once processed (EXIF-based rotation,
+        # ImageMagick conversion, SVG to PNG conversion...), keyed by
+        # processing options: ~{key: (s_format, s_content, width, height)}~,
+        # width and height being expressed in cm.
+        self.variants = variants or {}
+
+    def getSize(self):
+        '''Returns the number of bytes taken by the image and its variants'''
+        r = len(self.content)
+        for variant in self.variants.itervalues(): r += len(variant[1])
+        return r
+
+    def addVariant(self, key, variant):
+        '''Returns a copy of p_self, with this additional p_variant. p_self
+           is not modified: the size of a cached image can't change.'''
+        variants = self.variants.copy()
+        variants[key] = variant
+        return CachedImage(self.format, self.content, self.etag,
+                           self.lastModified, variants)
+
+# The process-wide cache of images used by renderers for which attribute
+# "cacheImages" is True. Keys identify image sources (see
+# appy.pod.doc_importers.ImageImporter.getCacheKey). Modify its "maxEntries" and
+# "maxSize" (in bytes) attributes to change its budget.
+images = LruCache(maxEntries=500, maxSize=64*1024*1024,
+                  sizer=CachedImage.getSize)
+
+# ------------------------------------------------------------------------------
+class CachedPdf:
+    '''A PDF file imported by an appy.pod.doc_importers.PdfImporter, kept in
+       memory as the images produced by Ghostscript from its pages, in order to
+       be imported again without being rasterised again.'''
+
+    def __init__(self, format, pages):
+        # The format (=file extension) of the images, and their contents, in
+        # the order of the PDF pages.
+        self.format = format
+        self.pages = pages
+
+    def getSize(self):
+        '''Returns the number of bytes taken by the page images'''
+        return sum([len(page) for page in self.pages])
+
+# The process-wide cache of rasterised PDFs used by renderers for which
+# attribute "cacheImages" is True. Keys identify the PDF content and the
+# rasterisation options (see appy.pod.doc_importers.PdfImporter.getCacheKey).
+# Modify its "maxEntries" and "maxSize" (in bytes) attributes to change its
+# budget.
+pdfs = LruCache(maxEntries=50, maxSize=128*1024*1024, sizer=CachedPdf.getSize)
+# ------------------------------------------------------------------------------
+def getHashable(value):
+    '''Returns a hashable representation of p_value, that may be a dict, a
+       list or an instance, ie, a styles mapping.'''
+    if isinstance(value, dict):
+        return tuple([(k, getHashable(v)) for k, v in sorted(value.items())])
+    elif isinstance(value, (list, tuple)):
+        return tuple([getHashable(v) for v in value])
+    elif hasattr(value, 'name') and hasattr(value, 'family'):
+        # A appy.pod.styles_manager.Style instance
+        return repr(value)
+    elif hasattr(value, '__dict__'):
+        return (value.__class__.__name__, getHashable(value.__dict__))
+    return value
+
+class CachedXhtml:
+    '''A chunk of ODF produced from a chunk of XHTML by a
+       appy.pod.xhtml2odt.Xhtml2OdtConverter, with the dynamic styles it
+       requires.'''
+
+    def __init__(self, odf, styles, ppp):
+        # The ODF chunk
+        self.odf = odf
+        # The definitions of the dynamic styles the chunk refers to
+        # ~[(s_target, s_name, s_definition)]~, "target" being the name of the
+        # appy.pod.styles_manager.DynamicStyles attribute into which the style
+        # must be injected.
+        self.styles = styles
+        # Did the conversion enable the pod post-processor ?
+        self.ppp = ppp
+
+    def getSize(self):
+        '''Returns the number of bytes taken by the chunk and its styles'''
+        r = len(self.odf)
+        for target, name, definition in self.styles: r += len(definition)
+        return r
+
+class XhtmlCache:
+    '''Cache of ODF chunks produced from XHTML chunks, keyed by XHTML content
+       and by conversion parameters.'''
+
+    # The dynamic styles that a conversion may produce
+    targets = ('content', 'styles', 'styles_base')
+
+    # Extracts the name of a style from its definition
+    nameRex = re.compile(':name="([^"]*)"')
+
+    # Chunks containing images are not cached: images are imported in the
+    # result being currently produced.
+    imageRex = re.compile('<img[\s/>]', re.I)
+
+    def __init__(self, maxEntries=1000, maxSize=16*1024*1024):
+        self.chunks = LruCache(maxEntries=maxEntries, maxSize=maxSize,
+                               sizer=CachedXhtml.getSize)
+
+    def getFingerprint(self, renderer):
+        '''Computes a value identifying the template styles, the styles
+           mapping and the namespaces of p_renderer, having an impact on the
+           conversion.'''
+        content = renderer.contentXml
+        root = content[:content.find('>', content.find('<office:document'))]
+        md5 = hashlib.md5(renderer.stylesXml)
+        md5.update(root)
+        manager = renderer.stylesManager
+        return (renderer.templateType, md5.hexdigest(),
+                getHashable(manager.stylesMapping),
+                getHashable(renderer.stylesOutlineDeltas))
+
+    def getKey(self, renderer, s, params):
+        '''Computes the key identifying the conversion of XHTML chunk p_s with
+           these p_params by this p_renderer.'''
+        manager = renderer.stylesManager
+        if manager.fingerprint is None:
+            manager.fingerprint = self.getFingerprint(renderer)
+        if isinstance(s, unicode): s = s.encode('utf-8')
+        return (hashlib.md5(s).hexdigest(), manager.fingerprint,
+                getHashable(params))
+
+    def replay(self, renderer, key, cached):
+        '''Ensures the dynamic styles required by p_cached are defined in the
+           result being produced by p_renderer. Returns False if it is not
+           possible because of a name clash.'''
+        manager = renderer.stylesManager
+        dynamic = manager.dynamicStyles
+        replayed = dynamic.replayed
+        # The styles may already have been added to the current result
+        if key in replayed: return True
+        generated = manager.stylesGenerator.definitions
+        for target, name, definition in cached.styles:
+            if (name in generated) and (generated[name][1] != definition):
+                return False
+        for target, name, definition in cached.styles:
+            if name is not None:
+                if (name in replayed) or (name in generated): continue
+                replayed.add(name)
+            getattr(dynamic, target).append(definition)
+        replayed.add(key)
+        if cached.ppp: renderer.enablePpp()
+        return True
+
+    def record(self, renderer, key, convert):
+        '''Performs the conversion by calling p_convert, caches its result and
+           the dynamic styles it requires, and returns it.'''
+        manager = renderer.stylesManager
+        dynamic = manager.dynamicStyles
+        generator = manager.stylesGenerator
+        lengths = [(target, len(getattr(dynamic, target))) \
+                   for target in self.targets]
+        ppp = renderer.ppp
+        # Collect the names of the styles generated by previous conversions and
+        # reused by this one.
+        generator.reused = reused = []
+        try:
+            odf = convert()
+        finally:
+            generator.reused = None
+        # Collect the dynamic styles added by the conversion
+        styles = []
+        names = set()
+        for target, length in lengths:
+            for definition in getattr(dynamic, target)[length:]:
+                match = self.nameRex.search(definition)
+                name = match and match.group(1) or None
+                styles.append((target, name, definition))
+                names.add(name)
+        for name in reused:
+            if name in names: continue
+            target, definition = generator.definitions[name]
+            styles.append((target, name, definition))
+            names.add(name)
+        dynamic.replayed.add(key)
+        self.chunks.set(key, CachedXhtml(odf, styles, renderer.ppp and not ppp))
+        return odf
+
+    def render(self, renderer, s, params, convert):
+        '''Returns the ODF chunk corresponding to XHTML chunk p_s, converted
+           with these p_params by this p_renderer, from the cache or by calling
+           p_convert.'''
+        s = s or ''
+        if self.imageRex.search(s): return convert()
+        key = self.getKey(renderer, s, params)
+        cached = self.chunks.get(key)
+        if cached and self.replay(renderer, key, cached): return cached.odf
+        return self.record(renderer, key, convert)
+
+    def clear(self):
+        '''Removes all chunks from the cache'''
+        self.chunks.clear()
+
+    def getStats(self):
+        '''Returns a dict of statistics about this cache'''
+        return self.chunks.getStats()
+
+# The process-wide cache used by renderers for which attribute "cacheXhtml" is
+# True. Modify the "maxEntries" and "maxSize" (in bytes) attributes of its
+# "chunks" to change its budget.
+xhtml = XhtmlCache()
+
+# ------------------------------------------------------------------------------
+class ParsedStyles:
+    '''The analysis of the styles defined in a pod template, as performed by a
+       appy.pod.styles_manager.StylesManager, shared by all the styles managers
+       working with the same template.'''
+
+    # Once cached, a ParsedStyles instance is never modified, excepted its
+    # cache of validated styles mappings: styles managers access its styles
+    # via copy-on-write overlays (see appy.pod.styles_manager.StylesOverlay)
+    # and create their own page styles from its page styles definitions.
+
+    def __init__(self, manager):
+        # The template styles, as a appy.pod.styles_manager.Styles instance
+        self.styles = manager.styles
+        self.names = frozenset(self.styles.keys())
+        self.textStyles = manager.textStyles
+        self.paragraphStyles = manager.paragraphStyles
+        # The main page layout
+        self.pageLayout = manager.pageLayout
+        # Page styles are renamed by every styles manager: only their names and
+        # attributes are kept ~[(s_name, {s_attr: s_value})]~.
+        self.pageStyles = [(style.name, style.attrs.copy()) for style in \
+                           manager.pageStyles.styles.itervalues()]
+        # Styles mappings, as validated by m_checkStylesMapping on a styles
+        # manager ~{key: dict}~. Keys are computed by m_getMappingKey.
+        self.mappings = LruCache(maxEntries=100)
+
+    @staticmethod
+    def getMappingKey(stylesMapping):
+        '''Returns the key identifying this p_stylesMapping among
+           p_self.mappings, or None if it can't be cached. Only mappings whose
+           values are style names or outline levels are cached: others may
+           contain objects that are specific to the caller.'''
+        if not isinstance(stylesMapping, dict): return
+        for key, value in stylesMapping.iteritems():
+            if not isinstance(key, basestring) or \
+               not isinstance(value, (basestring, int)): return
+        return tuple(sorted(stylesMapping.items()))
+
+class StylesCache:
+    '''Cache of the analyses of template styles, keyed by the content of
+       styles.xml and by renderer options having an impact on this
+       analysis.'''
+
+    def __init__(self, maxTemplates=50):
+        self.analyses = LruCache(maxEntries=maxTemplates)
+
+    def getKey(self, renderer):
+        '''Computes the key identifying the styles of the template being
+           rendered by this p_renderer.'''
+        return (hashlib.md5(renderer.stylesXml).hexdigest(),
+                getHashable(renderer.stylesOutlineDeltas))
+
+    def get(self, key):
+        '''Returns the ParsedStyles instance stored at this p_key, or None'''
+        return self.analyses.get(key)
+
+    def put(self, key, manager):
+        '''Caches, at this p_key, the analysis of the template styles that this
+           styles p_manager has just performed, and returns it as a
+           ParsedStyles instance.'''
+        r = ParsedStyles(manager)
+        self.analyses.set(key, r)
+        return r
+
+    def clear(self):
+        '''Removes all analyses from the cache'''
+        self.analyses.clear()
+
+    def getStats(self):
+        '''Returns a dict of statistics about this cache'''
+        return self.analyses.getStats()
+
+# The process-wide cache used by renderers for which attribute "cacheStyles" is
+# True.
+styles = StylesCache()
+# ------------------------------------------------------------------------------
@@ -1,6 +1,6 @@
 # ~license~
 # ------------------------------------------------------------------------------
-import sys, os, os.path, re, time
+import sys, os, os.path, re, time, json, threading
 from optparse import OptionParser
 
 htmlFilters = {'odt': 'HTML (StarWriter)',
@@ -140,6 +140,105 @@ class LoIter:
             raise StopIteration
     next = __next__ # Python2-3 compliance
 
+# ------------------------------------------------------------------------------
+class Connection:
+    '''A connection to a LibreOffice (LO) server, that can be reused by
+       several conversions.'''
+
+    # Connecting to LO (getting the UNO context, resolving the remote component
+    # context and creating the LO desktop) is expensive: it may represent a
+    # significant part of a short conversion. Connections are thus kept, in
+    # this process, in dict "connections" ~{(s_server, i_port): Connection}~,
+    # and reused by any subsequent conversion involving the same LO server.
+    # Before being reused, a connection is checked: if LO has been restarted
+    # or the connection has been lost, a new one is established.
+    connections = {}
+    # Class-wide lock "lock" only protects the access to dicts "connections"
+    # and "locks". Checking or establishing a connection, that may block, is
+    # done outside it: a hung LO server must not block conversions involving
+    # other LO servers. Dict "locks" ~{(s_server, i_port): Lock}~ ensures that
+    # a single thread at a time reconnects to a given LO server.
+    lock = threading.Lock()
+    locks = {}
+
+    @classmethod
+    def get(class_, server, port, log=None):
+        '''Returns a live connection to the LO server listening on p_server and
+           p_port, creating it if it does not exist yet or if the existing one
+           is dead.'''
+        key = server, port
+        with class_.lock:
+            r = class_.connections.get(key)
+            keyLock = class_.locks.get(key)
+            if keyLock is None:
+                keyLock = class_.locks[key] = threading.Lock()
+        if r is not None and r.isAlive(): return r
+        with keyLock:
+            # Another thread may have reconnected in the meanwhile
+            with class_.lock:
+                current = class_.connections.get(key)
+            if current is not None and current is not r: return current
+            r = Connection(server, port, log)
+            with class_.lock:
+                class_.connections[key] = r
+        return r
+
+    @classmethod
+    def discard(class_, server, port):
+        '''Forgets the connection to the LO server listening on p_server and
+           p_port: the next call to m_get will establish a new one.'''
+        with class_.lock:
+            if (server, port) in class_.connections:
+                del class_.connections[(server, port)]
+
+    def __init__(self, server, port, log=None):
+        if os.name == 'nt':
+            import socket
+        import uno
+        from com.sun.star.connection import NoConnectException
+        self.server = server
+        self.port = port
+        # Connections can't be shared with child processes: remember the ID of
+        # the process having established it.
+        self.pid = os.getpid()
+        try:
+            # Get the uno component context from the PyUNO runtime
+            self.context = ctx = uno.getComponentContext()
+            # Create the UnoUrlResolver
+            create = ctx.ServiceManager.createInstanceWithContext
+            resolver = create('com.sun.star.bridge.UnoUrlResolver', ctx)
+            # Connect to LO running on p_port
+            docContext = resolver.resolve(
+              'uno:socket,host=%s,port=%d;urp;StarOffice.ComponentContext' % \
+              (server, port))
+            # Is seems that we can't define a timeout for this method. This
+            # would be useful because when a non-LO server already listens
+            # to p_port, this method blocks.
+            if log: log('Getting the UNO-LO instance...', cr=False)
+            self.oo = docContext.ServiceManager.createInstanceWithContext(
+                'com.sun.star.frame.Desktop', docContext)
+            if log: log(' done.')
+        except NoConnectException:
+            e = sys.exc_info()[1]
+            raise ConverterError(CONNECT_ERROR % (port, e))
+        # The LO version, lazily computed by m_getVersion
+        self.version = None
+
+    def isAlive(self):
+        '''Is this connection still usable ?'''
+        if self.pid != os.getpid(): return
+        try:
+            # Perform a cheap remote call. If LO has been stopped or restarted,
+            # the UNO bridge is disposed and an exception is raised.
+            self.oo.getFrames()
+            return True
+        except Exception:
+            return
+
+    def __repr__(self):
+        '''p_self's short string representation'''
+        return '<Connection %s:%d>' % (self.server, self.port)
+
 # ------------------------------------------------------------------------------
 class PPP:
     '''This class represents the POD post-processor (=PPP), a series of UNO
@@ -366,37 +465,20 @@ class Converter:
             return '3.0'
 
     def connect(self):
-        '''Connects to LibreOffice'''
-        if os.name == 'nt':
-            import socket
-        import uno
-        from com.sun.star.connection import NoConnectException
-        try:
-            # Get the uno component context from the PyUNO runtime
-            self.context = ctx = uno.getComponentContext()
-            # Get the LO version
-            self.version = self.getVersion()
-            # Create the UnoUrlResolver
+        '''Connects to LibreOffice, or reuses an existing connection to it'''
+        connection = Connection.get(self.server, self.port, self.log)
+        # Get the uno component context from the PyUNO runtime
+        self.context = ctx = connection.context
+        self.oo = connection.oo
+        # Get the LO version
+        if connection.version is None:
+            connection.version = self.getVersion()
+        self.version = connection.version
+        # If we must process table column widths, create a dispatch helper
+        if self.processColumns:
             create = ctx.ServiceManager.createInstanceWithContext
-            resolver = create('com.sun.star.bridge.UnoUrlResolver', ctx)
-            # Connect to LO running on self.port
-            docContext = resolver.resolve(
-              'uno:socket,host=%s,port=%d;urp;StarOffice.ComponentContext' % \
-              (self.server, self.port))
-            # Is seems that we can't define a timeout for this method. This
-            # would be useful because when a non-LO server already listens
-            # to self.port, this method blocks.
-            self.log('Getting the UNO-LO instance...', cr=False)
-            self.oo = docContext.ServiceManager.createInstanceWithContext(
-                'com.sun.star.frame.Desktop', docContext)
-            # If we must process table column widths, create a dispatch helper
-            if self.processColumns:
-                helper = create('com.sun.star.frame.DispatchHelper', ctx)
-                self.dispatchHelper = helper
-            self.log(' done.')
-        except NoConnectException:
-            e = sys.exc_info()[1]
-            raise ConverterError(CONNECT_ERROR % (self.port, e))
+            helper = create('com.sun.star.frame.DispatchHelper', ctx)
+            self.dispatchHelper = helper
 
     def getColumnModifiers(self):
         '''Returns the elements allowing to know if we must optimize or
@@ -678,9 +760,8 @@ class Converter:
                 controller.setActiveSheet(sheet)
                 self.storeDocument(resultUrl, doc, props)
 
-    def run(self):
-        '''Connects to LO, does the job and disconnects'''
-        if self.verbose: start = time.time()
+    def convert(self):
+        '''Does the job, via the current connection to LO'''
         self.connect()
         self.openDocument()
         # Call custom code to modify the document when relevant
@@ -689,11 +770,25 @@ class Converter:
         # Store the (converted) result
         self.convertDocument()
         self.doc.close(True)
+
+    def run(self):
+        '''Connects to LO (or reuses an existing connection) and does the job'''
+        if self.verbose: start = time.time()
+        from com.sun.star.lang import DisposedException
+        try:
+            self.convert()
+        except DisposedException:
+            # The connection has been lost during the conversion (ie, LO has
+            # been restarted). Retry once, with a new connection.
+            Connection.discard(self.server, self.port)
+            self.convert()
         if self.verbose:
             self.log('Done in %.2f second(s).' % (time.time() - start))
 
 # ------------------------------------------------------------------------------
 P_ARGS_KO  = 'Wrong number of arguments.'
+P_OPTS_KO  = 'Wrong options.'
+P_JOB_KO   = 'The conversion failed.'
 ERROR_CODE = 1
 bn         = '\n'
 
@@ -723,6 +818,12 @@ HELP_SCRIPT = 'You can specify here (the absolute path to) a Python script ' \
   'updated by LibreOffice. ***finalize*** will be called at the end of the '\
   'process, just before saving the result.'
 HELP_VERBOSE = 'Writes more information on stdout.'
+HELP_WORKER = 'Run the converter as a persistent worker: instead of ' \
+  'performing a single conversion, it reads conversion jobs on stdin, one ' \
+  'per line, as JSON-encoded lists of command-line arguments, and writes, ' \
+  'for every job, a line on stdout containing a JSON-encoded dict whose key ' \
+  '"error" holds the error message (empty if the job was successful). ' \
+  'Connections to LibreOffice are kept from one job to the next.'
 HELP_PPP = 'Enable the POD post-processor (PPP). The PPP is a series of UNO ' \
   'commands that react to PPP instructions encoded within object names and ' \
   'must be executed at the end of the process, when all other tasks have ' \
@@ -766,6 +867,7 @@ HELP_CSV = 'If the ouput format is CSV, you can define here conversion ' \
 
 # ------------------------------------------------------------------------------
 usage = '''usage: python3 converter.py fileToConvert output [options]
+       python3 converter.py --worker [options]
 
    "fileToConvert" is the absolute or relative pathname of the file you
    want to convert (or whose content like indexes need to be refreshed)
@@ -804,7 +906,8 @@ class ConverterScript:
             r[key] = value
         return r
 
-    def run(self):
+    def getParser(self):
+        '''Returns the parser for the command-line options'''
         optParser = OptionParser(usage=usage)
         add = optParser.add_option
         add('-e', '--server', dest='server', default=DEFAULT_SERVER,
@@ -833,12 +936,11 @@ class ConverterScript:
             metavar='STREAM', type='string', help=HELP_STREAM)
         add('-g', '--pageStart', dest='pageStart', default=1,
             metavar='PAGESTART', type='int', help=HELP_PAGE_START)
-        options, args = optParser.parse_args()
-        if len(args) != 2:
-            sys.stderr.write(P_ARGS_KO)
-            sys.stderr.write(bn)
-            optParser.print_help()
-            sys.exit(ERROR_CODE)
+        add('-w', '--worker', action='store_true', help=HELP_WORKER)
+        return optParser
+
+    def getConverter(self, options, args):
+        '''Creates a Converter from command-line p_options and p_args'''
         # Apply relevant type conversions to options
         optimize = options.optimalColumnWidths
         if optimize in ('True', 'False'): optimize = eval(optimize)
@@ -849,10 +951,52 @@ class ConverterScript:
         pdfOptions = self.getPdfOptions(options.pdf)
         stream = options.stream
         if stream in ('True', 'False'): stream = eval(stream)
-        converter = Converter(args[0], args[1], options.server, options.port,
+        return Converter(args[0], args[1], options.server, options.port,
           options.template, optimize, distribute, options.script, resolveFields,
           pdfOptions, options.csv, options.ppp, stream, options.pageStart,
           options.verbose)
+
+    def serve(self, optParser):
+        '''Runs the converter as a worker, reading conversion jobs on stdin'''
+        # Every job is a line containing the JSON-encoded list of command-line
+        # arguments one would pass to this script for performing it. For every
+        # job, a line is written on stdout, containing a JSON-encoded dict
+        # {"error": s_error}, s_error being the empty string if the job was
+        # successful. Connections to LO are kept between jobs (see class
+        # Connection). The worker stops when stdin is closed.
+        out = sys.stdout
+        # Anything a job may write on stdout (logs, help...) must not disturb
+        # the communication with the caller.
+        sys.stdout = sys.stderr
+        while True:
+            line = sys.stdin.readline()
+            if not line: break
+            error = ''
+            try:
+                options, args = optParser.parse_args(json.loads(line))
+                if len(args) != 2: raise ConverterError(P_ARGS_KO)
+                self.getConverter(options, args).run()
+            except SystemExit:
+                # Raised by the option parser on wrong options
+                error = P_OPTS_KO
+            except Exception:
+                error = str(sys.exc_info()[1]) or P_JOB_KO
+            out.write(json.dumps({'error': error}))
+            out.write(bn)
+            out.flush()
+
+    def run(self):
+        optParser = self.getParser()
+        options, args = optParser.parse_args()
+        if options.worker:
+            self.serve(optParser)
+            return
+        if len(args) != 2:
+            sys.stderr.write(P_ARGS_KO)
+            sys.stderr.write(bn)
+            optParser.print_help()
+            sys.exit(ERROR_CODE)
+        converter = self.getConverter(options, args)
         try:
             converter.run()
         except Converter.Error:
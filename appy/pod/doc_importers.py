@@ -1,6 +1,7 @@
 # ~license~
 # ------------------------------------------------------------------------------
-import os, os.path, re, stat, shutil, struct, urlparse, base64, imghdr
+import os, os.path, re, stat, shutil, struct, urlparse, base64, imghdr, hashlib
+import subprocess, multiprocessing
 
 import appy.pod
 from appy import commercial
@@ -8,7 +9,9 @@ from appy import Object as O
 from appy.shared.dav import Resource
 from appy.shared import mimeTypesExts
 from appy.pod import PodError, getUuid
+from appy.pod import cache as pcache
 from appy.shared import utils as sutils
+from appy.pod.odt_merger import OdtMerger
 from appy.pod.metadata import MetadataReader
 from appy.shared.css import CssStyles, px2cm
 from appy.shared.utils import getTempFileName
@@ -57,7 +60,7 @@ class DocImporter:
         self.linkNs = self.ns[OdfEnvironment.NS_XLINK]
         self.drawNs = self.ns[OdfEnvironment.NS_DRAW]
         self.svgNs = self.ns[OdfEnvironment.NS_SVG]
-        self.tempFolder = renderer.tempFolder
+        self.tempFolder = renderer.getFolder()
         self.importFolder = self.getImportFolder()
         # Create the import folder if it does not exist
         if not os.path.exists(self.importFolder): os.mkdir(self.importFolder)
@@ -134,10 +137,15 @@ class OdtImporter(DocImporter):
                    after=pageBreakTemplate % 'After',
                    beforeDuplex=pageBreakTemplate % 'BeforeDuplex')
 
-    def init(self, pageBreakBefore, pageBreakAfter):
+    def init(self, pageBreakBefore, pageBreakAfter, merge=False):
         '''OdtImporter-specific constructor'''
         self.pageBreakBefore = pageBreakBefore
         self.pageBreakAfter = pageBreakAfter
+        # Must the document be merged into the pod result by an OdtMerger,
+        # instead of being linked from a section that LO will resolve ?
+        self.merge = merge
+        # Has the document actually been merged ?
+        self.merged = False
 
     def addPageBreakAfter(self):
         '''After sub-document insertion, must we insert a page break ?'''
@@ -171,13 +179,20 @@ class OdtImporter(DocImporter):
         # Insert a page break before importing the doc if needed
         if self.pageBreakBefore:
             self.res += self.pageBreaks.before
-        # Import the external odt document
-        name = getUuid(removeDots=True, prefix='PodSect')
-        self.res += '<%s:section %s:name="%s">' \
-                    '<%s:section-source %s:href="file://%s" ' \
-                    '%s:filter-name="writer8"/></%s:section>' % (
-                        self.textNs, self.textNs, name, self.textNs,
-                        self.linkNs, self.importPath, self.textNs, self.textNs)
+        # Import the external odt document, by merging it or by linking it
+        odf = None
+        if self.merge:
+            odf = OdtMerger(self.importPath, self.renderer).run()
+        if odf is not None:
+            self.res += odf
+            self.merged = True
+        else:
+            name = getUuid(removeDots=True, prefix='PodSect')
+            self.res += '<%s:section %s:name="%s">' \
+                        '<%s:section-source %s:href="file://%s" ' \
+                        '%s:filter-name="writer8"/></%s:section>' % (
+                         self.textNs, self.textNs, name, self.textNs,
+                         self.linkNs, self.importPath, self.textNs, self.textNs)
         # Possibly insert (a) page break(s) after importing the doc if needed
         self.addPageBreakAfter()
         # Note that if there is no more document content after the last page
@@ -205,7 +220,7 @@ class PodImporter(DocImporter):
         return mustStream and 'in' or default
 
     def init(self, context, pageBreakBefore, pageBreakAfter,
-             managePageStyles, resolveFields, forceOoCall):
+             managePageStyles, resolveFields, forceOoCall, merge=False):
         '''PodImporter-specific constructor'''
         self.context = context
         self.pageBreakBefore = pageBreakBefore
@@ -214,6 +229,12 @@ class PodImporter(DocImporter):
         self.resolveFields = resolveFields
         # Must we communicate with LO via streams ?
         self.stream = self.mustStream()
+        # Must the sub-pod result be merged into the main result, instead of
+        # being linked from a section ? It is not possible if the sub-pod
+        # result is written on a distant LO machine.
+        self.merge = merge and (self.stream != 'in')
+        # Has the sub-pod result actually been merged ?
+        self.merged = False
         # Force LO call if:
         # (a) fields must be resolved ;
         # (b) if we are inserting sub-documents in "duplex" mode (or, also, with
@@ -267,12 +288,18 @@ class PodImporter(DocImporter):
         else:
             # Recycle this renderer and set him a new result
             renderer.reinit(resOdt, self.context)
+            if self.forceOoCall: renderer.forceOoCall = True
+        # Conversions performed by the sub-renderer are part of the same
+        # asynchronous job, if any.
+        renderer.job = r.job
         renderer.run()
         # The POD result is in "resOdt". Import it into the main POD result
         # using an OdtImporter.
         odtImporter = OdtImporter(None, resOdt, 'odt', self.renderer)
-        odtImporter.init(self.pageBreakBefore, self.pageBreakAfter)
-        return odtImporter.run()
+        odtImporter.init(self.pageBreakBefore, self.pageBreakAfter, self.merge)
+        r = odtImporter.run()
+        self.merged = odtImporter.merged
+        return r
 
 class PdfImporter(DocImporter):
     '''This class allows to import the content of a PDF file into a pod
@@ -282,45 +309,152 @@ class PdfImporter(DocImporter):
     gsDevices = {'jpeg': 'jpg', 'jpeggray': 'jpg',
                  'png16m': 'png', 'pnggray': 'png'}
 
+    # The device and resolution used for converting PDF pages into images
+    device = 'png16m'
+    dpi = 125
+    # Pages are rasterised in parallel by several gs processes, each one
+    # converting a range of pages. The number of processes is at most
+    # p_workers (None means: the number of CPU cores); every process converts
+    # at least p_minPages pages.
+    workers = None
+    minPages = 8
+
+    def getCacheKey(self):
+        '''Returns the key identifying, in the cache of rasterised PDFs, the PDF
+           to import, or None if it can't be cached.'''
+        if not self.renderer.cacheImages: return
+        md5 = hashlib.md5()
+        f = file(self.importPath, 'rb')
+        while True:
+            chunk = f.read(65536)
+            if not chunk: break
+            md5.update(chunk)
+        f.close()
+        return md5.hexdigest(), self.dpi, self.device
+
+    def getPagesCount(self):
+        '''Returns the number of pages of the PDF to import, as computed by gs,
+           or None if it can't be computed.'''
+        # gs runs in safe mode: only the PDF to import can be read
+        path = self.importPath
+        for char in '\\()': path = path.replace(char, '\\' + char)
+        cmd = ['gs', '-q', '-dNODISPLAY', '-dSAFER',
+               '--permit-file-read=%s' % self.importPath, '-c',
+               '(%s) (r) file runpdfbegin pdfpagecount = quit' % path]
+        try:
+            out, err = sutils.executeCommand(cmd)
+            return int(out.strip().split()[-1])
+        except (OSError, ValueError, IndexError):
+            pass
+
+    def getRanges(self, count):
+        '''Splits the p_count pages of the PDF to import into ranges, one for
+           every gs process. Returns a list of tuples (i_first, i_last), or
+           None if the PDF must be converted by a single process.'''
+        workers = self.workers or multiprocessing.cpu_count()
+        if (workers < 2) or not count: return
+        workers = min(workers, count / self.minPages)
+        if workers < 2: return
+        r = []
+        size, rest = divmod(count, workers)
+        first = 1
+        for i in range(workers):
+            last = first + size - 1
+            if i < rest: last += 1
+            r.append((first, last))
+            first = last + 1
+        return r
+
+    def rasterise(self, folder):
+        '''Converts, with Ghostscript, the pages of the PDF to import into
+           images stored in this p_folder. Returns the list of paths to these
+           images, in the order of the pages. Raises a PodError if some page
+           could not be converted.'''
+        ext = self.gsDevices[self.device]
+        base = ['gs', '-dSAFER', '-dNOPAUSE', '-dBATCH', '-q',
+                '-sDEVICE=%s' % self.device, '-r%d' % self.dpi,
+                '-dTextAlphaBits=4', '-dGraphicsAlphaBits=4']
+        # Within a range starting at page "first", gs numbers images from 1
+        count = self.getPagesCount()
+        ranges = self.getRanges(count) or [(None, None)]
+        processes = []
+        failed = False
+        out = file(os.devnull, 'w')
+        try:
+            for first, last in ranges:
+                cmd = base[:]
+                if first:
+                    cmd += ['-dFirstPage=%d' % first, '-dLastPage=%d' % last]
+                cmd += ['-sOutputFile=%s/%s_%%d.%s' % (folder, first or 1, ext),
+                        self.importPath]
+                processes.append(subprocess.Popen(cmd, stdout=out,
+                                                  stderr=out))
+        except OSError:
+            # gs is not installed
+            failed = True
+        # Wait for all the processes, even if one could not be started
+        for process in processes:
+            if process.wait() != 0: failed = True
+        out.close()
+        if failed: raise PodError(PDF_TO_IMG_ERROR)
+        # Collect the images
+        r = []
+        for first, last in ranges:
+            first = first or 1
+            i = 0
+            while True:
+                i += 1
+                if last and (first + i - 1 > last): break
+                path = '%s/%d_%d.%s' % (folder, first, i, ext)
+                if not os.path.exists(path):
+                    # Within a range, every page must have been converted
+                    if last: raise PodError(PDF_TO_IMG_ERROR)
+                    break
+                r.append(path)
+        # Ensure no page is missing
+        if not r or (count and (len(r) != count)):
+            raise PodError(PDF_TO_IMG_ERROR)
+        return r
+
+    def importPage(self, content, at, ext):
+        '''Imports, into the result, the image of a PDF page, given as a
+           p_content or as a temp file p_at, that is moved into the result.'''
+        importer = ImageImporter(content, at, ext, self.renderer, cache=False,
+                                 move=True)
+        importer.init('as-char', True, None, None, 'page', 'page', None, True,
+                      None)
+        self.res += importer.run()
+
     def run(self):
         # This feature is only available in the open source version
         if commercial: raise CommercialError()
-        imagePrefix = os.path.splitext(os.path.basename(self.importPath))[0]
+        # Get the page images from the cache when relevant
+        key = self.getCacheKey()
+        cached = key and pcache.pdfs.get(key)
+        if cached:
+            for page in cached.pages:
+                self.importPage(page, None, cached.format)
+            return self.res
         # Split the PDF into images with Ghostscript. Create a sub-folder in the
         # OS temp folder to store those images.
         imagesFolder = sutils.getOsTempFolder(sub=True)
-        device = 'png16m'
-        ext = PdfImporter.gsDevices[device]
-        dpi = '125'
-        cmd = ['gs', '-dSAFER', '-dNOPAUSE', '-dBATCH', '-sDEVICE=%s' % device,
-               '-r%s' % dpi, '-dTextAlphaBits=4', '-dGraphicsAlphaBits=4',
-               '-sOutputFile=%s/%s%%d.%s' % (imagesFolder, imagePrefix, ext),
-               self.importPath]
-        sutils.executeCommand(cmd)
-        # Check that at least one image was generated
-        succeeded = False
-        firstImage = '%s1.%s' % (imagePrefix, ext)
-        for fileName in os.listdir(imagesFolder):
-            if fileName == firstImage:
-                succeeded = True
-                break
-        if not succeeded: raise PodError(PDF_TO_IMG_ERROR)
-        # Insert images into the result
-        noMoreImages = False
-        i = 0
-        while not noMoreImages:
-            i += 1
-            nextImage = '%s/%s%d.%s' % (imagesFolder, imagePrefix, i, ext)
-            if os.path.exists(nextImage):
-                # Use internally an Image importer for doing this job
-                imgImporter = ImageImporter(None, nextImage, ext, self.renderer)
-                imgImporter.init('as-char', True, None, None, 'page', 'page',
-                                 None, True, None)
-                self.res += imgImporter.run()
-                os.remove(nextImage)
-            else:
-                noMoreImages = True
-        os.rmdir(imagesFolder)
+        try:
+            # A PodError is raised if some page is missing: the result is then
+            # not cached.
+            pages = self.rasterise(imagesFolder)
+            # Cache the page images when relevant
+            ext = self.gsDevices[self.device]
+            if key:
+                contents = []
+                for path in pages:
+                    f = file(path, 'rb')
+                    contents.append(f.read())
+                    f.close()
+                pcache.pdfs.set(key, pcache.CachedPdf(ext, contents))
+            # Move the images into the result
+            for path in pages: self.importPage(None, path, ext)
+        finally:
+            sutils.FolderDeleter.delete(imagesFolder)
         return self.res
 
     # Other useful gs commands -------------------------------------------------
@@ -362,11 +496,15 @@ class Image:
        and size.'''
     jpgTypes = ('jpg', 'jpeg')
 
-    def __init__(self, path, format, unit='cm'):
+    def __init__(self, path, format, unit='cm', size=None):
         self.path = path # The image absolute path on disk
         self.format = format or imghdr.what(path)
-        # Determine image size in pixels (again, by reading its first bytes)
-        self.width, self.height = self.getSizeIn(unit)
+        # Determine image size in pixels (again, by reading its first bytes),
+        # excepted if already known and given in p_size.
+        if size:
+            self.width, self.height = size
+        else:
+            self.width, self.height = self.getSizeIn(unit)
 
     def getSizeIn(self, unit='cm'):
         '''Reads the first bytes from the image on disk to get its size'''
@@ -425,6 +563,68 @@ class ImageImporter(DocImporter):
     # Regular expression for finding orientation within EXIF meta-data
     orientationRex = re.compile('exif:Orientation\s*=\s*(\d+)')
 
+    def __init__(self, content, at, format, renderer, cache=True, move=False):
+        # If the renderer's attribute "cacheImages" is True, images are kept in
+        # the process-wide cache of images (see appy.pod.cache.images): when
+        # imported again, they are neither retrieved nor processed again. An
+        # image is cached as retrieved from its source, together with its
+        # processed versions (EXIF-based rotation, ImageMagick conversion...).
+        self.useCache = cache and renderer.cacheImages
+        # The key of the image in the cache (see m_getCacheKey), and the cached
+        # image (a pcache.CachedImage instance) if found.
+        self.cacheKey = self.cached = None
+        # The cached image, as added to the cache by p_self
+        self.source = None
+        # The key of the image's processed version (see m_init) and a flag
+        # indicating if this version has been retrieved from the cache.
+        self.variantKey = None
+        self.processed = False
+        # If p_move is True, the file at p_at is a temp file that is moved into
+        # the result instead of being copied.
+        self.move = move
+        DocImporter.__init__(self, content, at, format, renderer)
+
+    def getCacheKey(self, at):
+        '''Returns the key identifying, in the cache, the image from this
+           p_at, or None if it can't be cached.'''
+        zopeImage = getattr(self, 'zopeImage', None)
+        if zopeImage:
+            # A Zope blob, identified by its OID and its last transaction
+            blob = zopeImage.getBlobWrapper().getBlob()
+            return 'blob', blob._p_oid, blob._p_serial
+        elif at.startswith('http'):
+            # Validity is checked via HTTP headers (see m_getCacheHeaders)
+            return 'http', at
+        elif at.startswith('data:'):
+            return 'data', hashlib.md5(at).hexdigest()
+        else:
+            # A file on disk, identified by its path, modification date and size
+            info = os.stat(at)
+            return 'file', os.path.abspath(at), info.st_mtime, info.st_size
+
+    def lookup(self, at):
+        '''Searches the image from this p_at in the cache. Returns True if it
+           was found.'''
+        if not self.useCache: return
+        key = self.cacheKey = self.getCacheKey(at)
+        cached = self.cached = pcache.images.get(key)
+        if not cached: return
+        self.format = cached.format
+        return True
+
+    def getCacheHeaders(self, at):
+        '''If the image at URL p_at is cached, returns the HTTP headers allowing
+           to retrieve it only if it was modified in the meantime.'''
+        if not self.useCache: return
+        cached = pcache.images.get(self.getCacheKey(at))
+        if not cached: return
+        r = {}
+        if cached.etag: r['If-None-Match'] = cached.etag
+        if cached.lastModified: r['If-Modified-Since'] = cached.lastModified
+        if r:
+            self.cached = cached
+            return r
+
     def getZopeImage(self, at):
         '''Gets the Zope Image via an image resolver'''
         resolver = self.renderer.imageResolver
@@ -466,14 +666,25 @@ class ImageImporter(DocImporter):
            existing file. We will dump a replacement image instead.'''
         at = DocImporter.checkAt(self, at, raiseOnError=False)
         if at.startswith('http'):
-            # Try to get the image
+            # Try to get the image. If it is cached, it is only retrieved if it
+            # was modified in the meantime.
+            headers = self.getCacheHeaders(at)
             try:
-                response = Resource(at).get(followRedirect=False)
+                response = Resource(at).get(headers=headers,
+                                            followRedirect=False)
             except (Resource.Error, AttributeError):
                 response = None # Can't get the distant image
+            if self.cached:
+                if response and response.code == 304:
+                    # The cached image is still valid
+                    self.cacheKey = self.getCacheKey(at)
+                    self.format = self.cached.format
+                    return at
+                self.cached = None
             if self.isImage(response):
                 # Remember the response
                 self.httpResponse = response
+                if self.useCache: self.cacheKey = self.getCacheKey(at)
                 return at
             # The HTTP GET did not work, maybe for security reasons (we probably
             # have no permission to get the file). But maybe the URL was a local
@@ -482,6 +693,7 @@ class ImageImporter(DocImporter):
             # retrieve the image.
             self.zopeImage = self.getZopeImage(at)
             if self.zopeImage:
+                self.lookup(at)
                 return at
             # We could not find the image
             self.format = 'jpg'
@@ -491,6 +703,7 @@ class ImageImporter(DocImporter):
             # the "src" attribute of a HTML "img" tag of the form:
             #              "data:<mimeType>;base64,<base64 content>"
             mimeType = at[5:at.index(';')]
+            if self.lookup(at): return at
             # The MIME type may be "image/*". In that case, set "img" as virtual
             # format; the real format will be detected once the file will be
             # dumped to disk.
@@ -510,6 +723,8 @@ class ImageImporter(DocImporter):
             if not os.path.isfile(at):
                 self.format = 'jpg'
                 at = self.imageNotFound
+            elif self.lookup(at):
+                pass
             elif self.format == 'image':
                 # Read its format by reading its first bytes
                 self.format = imghdr.what(str(at))
@@ -526,12 +741,20 @@ class ImageImporter(DocImporter):
         for imagePath, imageAt in self.fileNames.iteritems():
             if imageAt == at: # Yes
                 i = importPath.rfind(self.pictFolder) + 1
+                # The image file is reused as is: do not use the cache
+                self.cacheKey = self.cached = None
                 return importPath[:i] + imagePath
+        # If the image is cached, its content will be dumped by m_init, once
+        # the way to process it will be known.
+        if self.cached: return importPath
         # The image has not already been imported: copy it
         r = None
         if not at.startswith('http'):
             # A file on disk
-            shutil.copy(at, importPath)
+            if self.move:
+                shutil.move(at, importPath)
+            else:
+                shutil.copy(at, importPath)
             r = importPath
         else:
             # The image has (maybe) been retrieved from a HTTP GET
@@ -564,8 +787,60 @@ class ImageImporter(DocImporter):
         if r:
             # Ensure we can modify the image (with ImageMagick)
             os.chmod(r, stat.S_IREAD | stat.S_IWRITE)
+            if self.cacheKey: self.storeSource(r)
             return r
 
+    def storeSource(self, path):
+        '''Adds, in the cache, the image as retrieved from its source and
+           copied at this p_path.'''
+        etag = lastModified = None
+        response = getattr(self, 'httpResponse', None)
+        if response:
+            etag = response.headers.get('etag')
+            lastModified = response.headers.get('last-modified')
+            if not etag and not lastModified:
+                # The validity of the cached image could not be checked
+                self.cacheKey = None
+                return
+        f = file(path, 'rb')
+        content = f.read()
+        f.close()
+        self.source = pcache.CachedImage(self.format, content, etag,
+                                         lastModified)
+        pcache.images.set(self.cacheKey, self.source)
+
+    def dumpCached(self):
+        '''Dumps, at p_self.importPath, the cached image: its processed
+           version if found, the retrieved image else. Returns True if the
+           processed version was found.'''
+        cached = self.cached
+        variant = self.variantKey and cached.variants.get(self.variantKey)
+        if variant:
+            format, content, width, height = variant
+        else:
+            format, content = cached.format, cached.content
+        self.format = format
+        path = self.importPath = '%s.%s' % \
+                                 (os.path.splitext(self.importPath)[0], format)
+        f = file(path, 'wb')
+        f.write(content)
+        f.close()
+        if not variant: return
+        self.image = Image(path, format, size=(width, height))
+        self.processed = True
+        return True
+
+    def storeVariant(self):
+        '''Adds, in the cache, the processed version of the image'''
+        image = self.cached or self.source
+        if not image: return
+        f = file(self.importPath, 'rb')
+        content = f.read()
+        f.close()
+        variant = (self.format, content, self.image.width, self.image.height)
+        pcache.images.set(self.cacheKey,
+                          image.addVariant(self.variantKey, variant))
+
     def manageExif(self):
         '''Read, with ImageMagick, EXIF metadata in the image, and apply a
            rotation (still with ImageMagick) if required.'''
@@ -607,6 +882,12 @@ class ImageImporter(DocImporter):
             if w and h:
                 self.sizeUnit = w.unit
                 self.size = (w.value, h.value)
+        # Get the image from the cache when relevant. Its processed version is
+        # identified by the processing options. If these options are defined
+        # by a function, the processed version can't be cached.
+        if self.cacheKey and not callable(convertOptions):
+            self.variantKey = (self.renderer.rotateImages, convertOptions)
+        if self.cached and self.dumpCached(): return
         # Manage EXIF tags when relevant
         if self.renderer.rotateImages: self.manageExif()
         # Call ImageMagick to perform a custom conversion if required
@@ -715,6 +996,8 @@ class ImageImporter(DocImporter):
             self.importPath = newImportPath
             imagePath = os.path.splitext(imagePath)[0] + '.png'
             self.format = 'png'
+        # Cache the processed image when relevant
+        if self.variantKey and not self.processed: self.storeVariant()
         # Compute image alignment if CSS attr "float" is specified
         floatValue = getattr(self.cssAttrs, 'float', None)
         if floatValue:
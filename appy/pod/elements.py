@@ -143,6 +143,9 @@ class Expression(PodElement):
         self.metaCondition = None
         # Te meta-condition is "wrapped" around single or double quotes
         self.metaWrap = None
+        # The code objects compiled from the expressions hereabove (see
+        # appy.pod.evaluator.Evaluator.getCode).
+        self.codes = {}
 
     def getUnevaluatedExpression(self):
         '''Gets the expression in its unevaluated form'''
@@ -158,14 +161,15 @@ class Expression(PodElement):
     def _eval(self, context):
         '''Evaluates self.expr with p_context. If self.errorExpr is defined,
            evaluate it if self.expr raises an error.'''
-        eval = context['_eval_'].run
+        eval = context['_eval_'].evaluate
+        codes = self.codes
         if self.errorExpr:
             try:
-                res = eval(self.expr, context)
+                res = eval(self.expr, context, codes)
             except Exception:
-                res = eval(self.errorExpr, context)
+                res = eval(self.errorExpr, context, codes)
         else:
-            res = eval(self.expr, context)
+            res = eval(self.expr, context, codes)
         return res
 
     def _evalMetaCondition(self, context):
@@ -174,7 +178,7 @@ class Expression(PodElement):
         expr = self.metaCondition
         if expr is None: return True
         # Evaluate the meta-condition
-        return context['_eval_'].run(expr, context)
+        return context['_eval_'].evaluate(expr, context, self.codes)
 
     def evaluate(self, context):
         '''Evaluates the Python expression (self.expr) with a given
@@ -293,10 +297,12 @@ class Attribute(PodElement):
         self.name = name
         # The expression that will compute the attribute value
         self.expr = expr.strip()
+        # The code object compiled from p_self.expr
+        self.codes = {}
 
     def evaluate(self, context):
         # If p_self.expr evaluates to False, do not dump the attribute at all
-        if context['_eval_'].run(self.expr, context):
+        if context['_eval_'].evaluate(self.expr, context, self.codes):
             return ' %s="%s"' % (self.name, self.name)
         return ''
 # ------------------------------------------------------------------------------
@@ -5,7 +5,7 @@
    parts.'''
 
 # ------------------------------------------------------------------------------
-import re
+import re, inspect
 
 # ------------------------------------------------------------------------------
 # As explained in the pod Renderer's constructor, various evaluators can be
@@ -30,6 +30,66 @@ import re
 class Evaluator:
     '''Wrapper around the built-in Python function "eval"'''
 
+    # Before being evaluated, an expression is compiled to a code object. Code
+    # objects are cached on the pod/px elements (expressions, actions...) being
+    # the sources of these expressions, in dicts of the form
+    #
+    #                 ~{s_expression: (s_compileKey, code)}~
+    #
+    # Because a given element may be evaluated by various evaluators (ie, a PX
+    # may be called by different renderers), a cached code object may only be
+    # used by an evaluator having the same compile key as the one having
+    # compiled it: the compile key is made of the evaluator's class and of the
+    # settings, in attribute "compileSettings", influencing its compilation.
+    compileSettings = ''
+
+    # A code object is evaluated by m_runCode, while m_run evaluates an
+    # expression given as a string. An evaluator class overriding m_run but
+    # not m_runCode (ie, a custom evaluator checking expressions before
+    # evaluating them) gets expressions as strings, uncompiled. Dict
+    # "compiling" stores, for every evaluator class, if it compiles
+    # expressions ~{class: b_compiling}~.
+    compiling = {}
+
+    def getCompileKey(self):
+        '''Returns the key identifying the code objects compiled by p_self'''
+        r = getattr(self, '_compileKey', None)
+        if r is None:
+            class_ = self.__class__
+            r = self._compileKey = '%s.%s:%s' % \
+                (class_.__module__, class_.__name__, self.compileSettings)
+        return r
+
+    def compiles(self):
+        '''Must expressions be compiled before being evaluated by p_self ?'''
+        class_ = self.__class__
+        r = Evaluator.compiling.get(class_)
+        if r is None:
+            # Find the classes defining m_run and m_runCode
+            runClass = codeClass = None
+            for base in inspect.getmro(class_):
+                if not runClass and ('run' in base.__dict__):
+                    runClass = base
+                if not codeClass and ('runCode' in base.__dict__):
+                    codeClass = base
+            r = Evaluator.compiling[class_] = issubclass(codeClass, runClass)
+        return r
+
+    def compile(self, expression):
+        '''Compiles p_expression and returns the corresponding code object'''
+        # Like function "eval" does for a string, ignore leading whitespace
+        return compile(expression.strip(), '<string>', 'eval')
+
+    def getCode(self, expression, codes):
+        '''Gets, from dict p_codes, the code object corresponding to this
+           p_expression, or compiles it and caches it in p_codes.'''
+        key = self.getCompileKey()
+        code = codes.get(expression)
+        if code and code[0] == key: return code[1]
+        r = self.compile(expression)
+        codes[expression] = key, r
+        return r
+
     def run(self, expression, context):
         '''Evaluates p_expression in this p_context'''
         # Evaluate p_expression
@@ -39,6 +99,17 @@ class Evaluator:
         # context['__builtins__'] is similar to the homonym entry in dict
         # globals().
 
+    def runCode(self, code, context):
+        '''Evaluates this p_code object, as produced by m_compile, in this
+           p_context.'''
+        return eval(code, context)
+
+    def evaluate(self, expression, context, codes):
+        '''Evaluates p_expression in this p_context, compiling it only if the
+           corresponding code object is not found in dict p_codes.'''
+        if not self.compiles(): return self.run(expression, context)
+        return self.runCode(self.getCode(expression, codes), context)
+
     def updateContext(self, context):
         '''The standard evaluator does not need to update the p_context'''
 
@@ -89,15 +160,29 @@ class Compromiser(Evaluator):
         # Must methods whose names are surrounded by double underscores be
         # banned ?
         self.ban__ = ban__
-
-    def run(self, expr, context):
-        '''Evaluates this p_expr(ession) in this p_context'''
+        # Code objects compiled by compromisers having other settings can't be
+        # reused by this one.
+        self.compileSettings = '%s:%s' % (self.banned.pattern, ban__)
+
+    def compile(self, expr):
+        '''Checks that p_expr does not contain any disallowed element and
+           compiles it. Because code objects are cached, these checks are
+           performed only once per expression.'''
         if self.banned.search(expr):
             C = Compromiser
             raise C.Disallowed(C.DIS_MSG % expr)
         if self.ban__ and self.underscored.search(expr):
             C = Compromiser
             raise C.Disallowed(C.DU_MSG % expr)
-        # If we are here, p_expr can safely be evaluated
-        return Evaluator.run(self, expr, context)
+        # If we are here, p_expr can safely be compiled
+        return Evaluator.compile(self, expr)
+
+    def run(self, expr, context):
+        '''Evaluates this p_expr(ession) in this p_context'''
+        return self.runCode(self.compile(expr), context)
+
+    def runCode(self, code, context):
+        '''Evaluates this p_code object in this p_context. Having been produced
+           by m_compile, it is safe.'''
+        return Evaluator.runCode(self, code, context)
 # ------------------------------------------------------------------------------
@@ -124,9 +124,12 @@ class Graphic:
         parts = spec.strip().split('-')
         if len(parts) == 3:
             start, end, self.var = parts
-            self.props = None
+            self.propsVar = None
         else:
-            start, end, self.var, self.props = parts
+            start, end, self.var, self.propsVar = parts
+        # The GraphicProperties object, as resolved from p_self.propsVar (see
+        # m_resolveProps).
+        self.props = None
         #
         # Prefix p_self.start and p_self.end with the current sheet name, if not
         # already done.
@@ -208,9 +211,10 @@ class Graphic:
         return r
 
     def resolveProps(self, context):
-        '''Converts p_self.props, being the name of a pod variable potentially
-           containing a GraphicProperties object, into this object.'''
-        props = self.props
+        '''Converts p_self.propsVar, being the name of a pod variable
+           potentially containing a GraphicProperties object, into this object,
+           stored in p_self.props.'''
+        props = self.propsVar
         if props is None:
             # Use a defaut GraphicProperties object
             self.props = GraphicProperties()
@@ -270,7 +274,8 @@ class Graphic:
             # Patch p_contentXml
             contentXml = graphic.patchContent(contentXml)
             # Patch the graphic-specific sub-content.xml
-            fileName = os.path.join(renderer.unzipFolder, path, 'content.xml')
+            fileName = os.path.join(renderer.getFolder(unzipped=True), path,
+                                    'content.xml')
             f = open(fileName)
             gContent = f.read()
             f.close()
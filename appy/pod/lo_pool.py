@@ -1,12 +1,12 @@
 # ~license~
 
 # ------------------------------------------------------------------------------
-import os.path, threading
+import os, os.path, time, errno, threading, subprocess, json
 
 import appy.pod
 from appy.pod import PodError
 from appy.pod.converter import Converter
-from appy.shared.utils import executeCommand, getOsTempFolder
+from appy.shared.utils import getOsTempFolder, Traceback
 
 # ------------------------------------------------------------------------------
 LO_PORT_KO = 'Wrong LibreOffice port "%s". Make sure it is an integer.'
@@ -23,10 +23,257 @@ NO_PY_PATH = 'Extension of result file is "%s". In order to perform ' \
 PY_PATH_KO = '"%s" is not a file. You must here specify the absolute path of ' \
              'a Python interpreter (.../python, .../python.sh, .../python.exe' \
              ', .../python.bat...).'
+LO_BUSY    = 'No LibreOffice server became available within %s second(s).'
+WORKER_KO  = 'The converter worker stopped unexpectedly. %s'
+JOB_KO     = 'Asynchronous job failed. %s'
+JOB_CANCEL = 'The asynchronous job was cancelled.'
+JOB_EXPIRE = 'The asynchronous job did not complete within %s second(s).'
+JOB_WAIT   = 'The asynchronous job is not over after %s second(s).'
+JOB_OVER   = 'The asynchronous job is over: the conversion was not performed.'
+CALLB_KO   = 'Error in the callback of an asynchronous job. %s'
 INCOMP_OD  = 'Warning: your OpenDocument file may not be complete (ie, ' \
              'imported documents may not be present). This is because we ' \
              'could not connect to LibreOffice in server mode: %s'
 
+# ------------------------------------------------------------------------------
+class Worker:
+    '''A persistent converter process, running a UNO-enabled Python
+       interpreter, to which conversion jobs are sent over a pipe.'''
+
+    # When the Python interpreter running Appy does not know UNO, conversions
+    # are delegated to appy/pod/converter.py, run by a UNO-enabled Python
+    # interpreter. Rather than launching one such process per conversion
+    # (paying, every time, the interpreter startup and the connection to LO),
+    # the script is launched once in "worker" mode (option -w): it then reads
+    # jobs on its stdin and keeps its connection to LO from one job to the
+    # next.
+
+    def __init__(self, python):
+        # The path to the UNO-enabled Python interpreter
+        self.python = python
+        self.script = os.path.join(os.path.dirname(appy.pod.__file__),
+                                   'converter.py')
+        # Workers can't be shared with child processes: remember the ID of the
+        # process having launched it.
+        self.pid = os.getpid()
+        self.process = None
+        self.start()
+
+    def start(self):
+        '''Launches the worker process'''
+        self.process = subprocess.Popen([self.python, self.script, '-w'],
+          stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True)
+
+    def stop(self):
+        '''Stops the worker process. Closing its stdin ends it.'''
+        process = self.process
+        if process is None: return
+        self.process = None
+        try:
+            process.stdin.close()
+            process.wait()
+        except (IOError, OSError):
+            pass
+
+    def kill(self):
+        '''Kills the worker process, ie, because the conversion it performs
+           takes too long. The thread waiting for its answer then gets an
+           error.'''
+        process = self.process
+        if process is None: return
+        try:
+            process.kill()
+        except OSError:
+            pass
+
+    def isAlive(self):
+        '''Is the worker process still usable ?'''
+        return self.pid == os.getpid() and self.process is not None and \
+               self.process.poll() is None
+
+    def send(self, args):
+        '''Sends the job defined by these command-line p_args to the worker
+           and r_eturns the error message it has produced (the empty string if
+           the job was successful).'''
+        process = self.process
+        process.stdin.write(json.dumps(args) + '\n')
+        process.stdin.flush()
+        line = process.stdout.readline()
+        if not line: raise IOError(WORKER_KO % '')
+        return json.loads(line)['error']
+
+    def __call__(self, args):
+        '''Executes the job defined by these command-line p_args'''
+        # If the worker process has died (ie, it has been killed), restart it
+        if not self.isAlive():
+            self.stop()
+            self.start()
+        try:
+            return self.send(args)
+        except (IOError, OSError, ValueError), e:
+            # The communication with the worker failed: the worker is stopped,
+            # and will be restarted at the next job.
+            self.stop()
+            raise PodError(WORKER_KO % str(e))
+
+    def __repr__(self):
+        '''p_self's short string representation'''
+        return '<Worker %s>' % self.python
+
+# ------------------------------------------------------------------------------
+class Job:
+    '''An asynchronous job (a conversion or the rendering of a complete pod
+       result), executed in its own thread.'''
+
+    # A Job is a "future": the thread having submitted it (ie, a Zope worker
+    # thread) is not blocked while the job is executed. It can later wait for
+    # the job's result via m_get, ask to be called back when the job is over
+    # (see m_addCallback), or cancel it (see m_cancel).
+    #
+    # If a timeout is defined, the job fails as soon as it is reached, whatever
+    # the job is doing. If the job is then waiting for a converter worker (see
+    # class Worker), the worker is killed: its LibreOffice (LO) server becomes
+    # available for other jobs and the thread executing the job stops. If LO is
+    # called in-process (the Python interpreter running Appy is UNO-enabled),
+    # the thread can't be interrupted: it is abandoned, but threads waiting for
+    # the job's result are released anyway.
+
+    # The job's possible statuses. "pending" and "running" are transient;
+    # others are final.
+    transientStatuses = ('pending', 'running')
+
+    def __init__(self, fun, args=(), timeout=None, callback=None):
+        # The function to execute, with these p_args
+        self.fun = fun
+        self.args = args
+        # The maximum number of seconds for the job to complete, or None
+        self.timeout = timeout
+        # The job status: "pending", "running", "done", "failed" or "cancelled"
+        self.status = 'pending'
+        # The value returned by p_self.fun if the job is "done", or the
+        # PodError explaining why it is "failed" or "cancelled".
+        self.value = None
+        self.error = None
+        # Functions to call when the job is over. Every function receives the
+        # job as unique arg.
+        self.callbacks = []
+        if callback: self.callbacks.append(callback)
+        # The converter worker (see class Worker) currently used by the job
+        self.worker = None
+        # The condition onto which threads wait for the job to be over
+        self.condition = threading.Condition()
+        # The timer making the job fail when its timeout is reached
+        self.timer = None
+
+    def start(self):
+        '''Starts executing the job in a new thread'''
+        thread = threading.Thread(target=self.execute)
+        thread.daemon = True
+        if self.timeout is not None:
+            self.timer = threading.Timer(self.timeout, self.expire)
+            self.timer.daemon = True
+            self.timer.start()
+        thread.start()
+        return self
+
+    def execute(self):
+        '''Executes the job. Runs in the job's thread.'''
+        with self.condition:
+            if self.status != 'pending': return
+            self.status = 'running'
+        try:
+            value = self.fun(*self.args)
+        except PodError, pe:
+            self.finish('failed', error=pe)
+        except Exception:
+            self.finish('failed', error=PodError(JOB_KO % Traceback.get()))
+        else:
+            self.finish('done', value=value)
+
+    def finish(self, status, value=None, error=None):
+        '''Sets the final p_status of the job and calls the callbacks. Returns
+           False if the job was already over.'''
+        with self.condition:
+            if self.status not in self.transientStatuses: return False
+            self.status = status
+            self.value = value
+            self.error = error
+            callbacks = self.callbacks
+            self.callbacks = []
+            if self.timer: self.timer.cancel()
+            self.condition.notifyAll()
+        for callback in callbacks: self.call(callback)
+        return True
+
+    def abort(self, status, error):
+        '''Ends the job with this p_status and p_error, while it is still
+           pending or running. Returns False if the job was already over.'''
+        if not self.finish(status, error=error): return False
+        # Kill the converter worker being potentially used by the job. The
+        # job's thread will stop as soon as it gets the error.
+        with self.condition:
+            worker = self.worker
+        if worker: worker.kill()
+        return True
+
+    def cancel(self):
+        '''Cancels the job. Returns False if it was already over.'''
+        return self.abort('cancelled', PodError(JOB_CANCEL))
+
+    def expire(self):
+        '''Called by p_self.timer when the job's timeout is reached'''
+        self.abort('failed', PodError(JOB_EXPIRE % self.timeout))
+
+    def setWorker(self, worker):
+        '''Registers the converter p_worker the job is about to use, or, if
+           p_worker is None, unregisters the worker it has used. Returns False
+           if the job is over: the worker must then not be used.'''
+        with self.condition:
+            self.worker = worker
+            return self.status == 'running'
+
+    def ready(self):
+        '''Is the job over ?'''
+        return self.status not in self.transientStatuses
+
+    def get(self, wait=None):
+        '''Waits for the job to be over and returns its value, or raises the
+           PodError having made it fail or cancelled it. If p_wait is not None,
+           it is the maximum number of seconds to wait: beyond it, a PodError is
+           raised, but the job goes on.'''
+        end = (wait is not None) and (time.time() + wait) or None
+        with self.condition:
+            while self.status in self.transientStatuses:
+                if end is None:
+                    self.condition.wait()
+                else:
+                    remaining = end - time.time()
+                    if remaining <= 0: raise PodError(JOB_WAIT % wait)
+                    self.condition.wait(remaining)
+        if self.error: raise self.error
+        return self.value
+
+    def addCallback(self, callback):
+        '''Adds a function to call, with the job as unique arg, when the job is
+           over. If it is already over, p_callback is called immediately.'''
+        with self.condition:
+            if self.status in self.transientStatuses:
+                self.callbacks.append(callback)
+                return
+        self.call(callback)
+
+    def call(self, callback):
+        '''Calls this p_callback. Errors are dumped but not raised: they must
+           not prevent other callbacks from being called.'''
+        try:
+            callback(self)
+        except Exception:
+            print(CALLB_KO % Traceback.get())
+
+    def __repr__(self):
+        '''p_self's short string representation'''
+        return '<Job %s>' % self.status
+
 # ------------------------------------------------------------------------------
 class LO:
     '''Represents a LibreOffice (LO) server with which Appy communicates via its
@@ -37,6 +284,19 @@ class LO:
         self.pool = pool
         # The port on which the LO server listens
         self.port = port
+        # Idle converter workers (see class Worker), in use if the Python
+        # interpreter running Appy is not UNO-enabled. Every worker performs
+        # one conversion at a time: there may be several ones if several
+        # threads convert documents via this LO server at the same time.
+        self.workers = []
+        self.workersLock = threading.Lock()
+        # The number of conversions currently performed by this LO server for
+        # this process, the total number of conversions it has performed and
+        # the date of the last one. These attributes are managed by the pool,
+        # and only modified while holding its condition.
+        self.inFlight = 0
+        self.jobs = 0
+        self.last = 0
 
     def getCsvOptions(self, renderer, format):
         '''Get CSV options if the output p_format is CSV'''
@@ -46,8 +306,10 @@ class LO:
             r = None
         return r
 
-    def __call__(self, renderer, resultName, result, format):
-        '''Call LO by using the Appy converter object'''
+    def __call__(self, renderer, resultName, result, format, job=None):
+        '''Call LO by using the Appy converter object. If the call is part of
+           an asynchronous p_job (see class Job), the job is informed about the
+           converter worker being used, in order to be able to kill it.'''
         r = None
         # Get CSV options if a CSV file must be produced
         csvOptions = self.getCsvOptions(renderer, format)
@@ -73,11 +335,8 @@ class LO:
                     raise PodError(NO_PY_PATH % format)
                 if not os.path.isfile(pyPath):
                     raise PodError(PY_PATH_KO % pyPath)
-                convScript = '%s/converter.py' % \
-                             os.path.dirname(appy.pod.__file__)
-                cmd = [pyPath, convScript, resultName, result,
-                       '-e', server, '-p', str(self.port)]
-                add = cmd.append
+                args = [resultName, result, '-e', server, '-p', str(self.port)]
+                add = args.append
                 if ren.stylesTemplate:
                     add('-t'); add(ren.stylesTemplate)
                 if ren.optimalColumnWidths:
@@ -97,7 +356,7 @@ class LO:
                     add('-a'); add(str(ren.stream))
                 if ren.pageStart > 1:
                     add('-g'); add(str(ren.pageStart))
-                out, r = executeCommand(cmd)
+                r = self.convert(pyPath, args, job)
         except PodError, pe:
             # When trying to call LO in server mode for producing ODT or ODS
             # (=forceOoCall=True), if an error occurs we have nevertheless
@@ -109,16 +368,58 @@ class LO:
                 raise pe
         return r
 
+    def getWorker(self, python):
+        '''Gets an idle converter worker, or launches a new one'''
+        pid = os.getpid()
+        with self.workersLock:
+            workers = self.workers
+            while workers:
+                worker = workers.pop()
+                # Ignore workers inherited from a parent process
+                if worker.pid == pid: return worker
+        return Worker(python)
+
+    def convert(self, python, args, job=None):
+        '''Executes, via a converter worker running this UNO-enabled p_python
+           interpreter, the conversion defined by these command-line p_args.
+           Returns the error message produced by the conversion, if any.'''
+        worker = self.getWorker(python)
+        if job:
+            if not job.setWorker(worker):
+                # The job was cancelled or has expired in the meanwhile
+                with self.workersLock:
+                    self.workers.append(worker)
+                raise PodError(JOB_OVER)
+            try:
+                r = worker(args)
+            finally:
+                job.setWorker(None)
+        else:
+            r = worker(args)
+        # Put the worker back among idle ones
+        with self.workersLock:
+            self.workers.append(worker)
+        return r
+
+    def stopWorkers(self):
+        '''Stops all idle converter workers'''
+        with self.workersLock:
+            workers = self.workers
+            while workers: workers.pop().stop()
+
     def getLockFileName(self):
         '''Get the absolute path to the lock file, in the pool folder,
            corresponding to the current thread using this LO instance.'''
-        name = '%s.%d' % (threading._get_ident(), self.port)
-        return os.path.join(self.pool.folder, name)
+        # Thread IDs are only unique within a process: the process ID is part
+        # of the name, too (several processes, ie, those from a
+        # appy.pod.render_pool.RenderPool, may share the same LO servers).
+        name = '%d.%s.%d' % (os.getpid(), threading._get_ident(), self.port)
+        return os.path.join(self.pool.getFolder(), name)
 
     def lock(self):
-        '''When multiple LOs are in use, write a file in the pool folder,
-           indicating that this LO instance is used by the currently running
-           thread.'''
+        '''When LO servers are shared between processes, write a file in the
+           pool folder, indicating that this LO instance is used by the
+           currently running thread.'''
         try:
             f = open(self.getLockFileName(), 'w')
             f.close()
@@ -126,9 +427,9 @@ class LO:
             pass
 
     def unlock(self):
-        '''When multiple LOs are in use, remove, from the pool folder, the file
-           indicating that this LO instance was used by the currently running
-           thread.'''
+        '''When LO servers are shared between processes, remove, from the pool
+           folder, the file indicating that this LO instance was used by the
+           currently running thread.'''
         try:
             os.remove(self.getLockFileName())
         except (IOError, OSError):
@@ -144,11 +445,44 @@ class LoPool:
        (LO) servers.'''
 
     # Even if a single LO server is used, a LoPool instance is created,
-    # containing a single LO instance.
+    # containing a single LO instance. Pools are process-wide: all renderers
+    # using the same LO servers share the same pool (see dict "pools" below).
+
+    # Every time a conversion must be performed, the pool chooses the least
+    # busy LO server, based on in-memory counters of the conversions being
+    # currently performed by every server. The following attributes allow to
+    # configure the pool's behaviour, process-wide, ie:
+    #
+    #                         LoPool.maxJobs = 2
+    #
+    # ~~~
+    # If "maxJobs" is None, any number of conversions can be performed at the
+    # same time by a LO server. Else, it is the maximum number of simultaneous
+    # conversions per LO server: when all servers are saturated, a thread
+    # needing a conversion waits for a server to become available.
+    maxJobs = None
+    # When waiting, a thread waits at most this number of seconds. Beyond this
+    # delay, a PodError is raised. If None, the thread waits forever.
+    timeout = None
+    # Set "shared" to True if the LO servers are shared with other processes
+    # (ie, several instances of the same application). In that case, every
+    # thread using a LO server writes a file in a folder on disk, allowing
+    # other processes to know how busy this LO server is (see m_getFolder).
+    # The pool workers of a appy.pod.render_pool.RenderPool set it to True.
+    shared = False
+    # In shared mode, LO servers may be released by other processes, that
+    # can't wake up threads waiting in this one: a waiting thread re-reads the
+    # pool folder every "pollInterval" seconds.
+    pollInterval = 0.5
+
+    # The process-wide pools ~{(s_python, s_server, t_ports): LoPool}~
+    pools = {}
+    poolsLock = threading.Lock()
 
     @classmethod
     def get(class_, python, server, port):
-        '''Create and return a LoPool instance, based on passed attributes'''
+        '''Get or create the LoPool instance corresponding to passed
+           attributes.'''
         # Do not create the pool if no port is specified
         if port is None: return
         # Ensure p_port is correct
@@ -156,9 +490,17 @@ class LoPool:
             for p in port:
                 if not isinstance(p, int):
                     raise Exception(LO_PORT_KO % str(p))
+            ports = tuple(port)
         elif not isinstance(port, int):
             raise Exception(LO_PORT_KO % str(port))
-        return LoPool(python, server, port)
+        else:
+            ports = (port,)
+        key = python, server, ports
+        with class_.poolsLock:
+            r = class_.pools.get(key)
+            if r is None:
+                r = class_.pools[key] = LoPool(python, server, ports)
+        return r
 
     def __init__(self, python, server, port):
         # The path to the Python interpreter being UNO-compliant (only required
@@ -170,19 +512,31 @@ class LoPool:
         # the same machine.
         self.server = server
         # Create as many LO instances as there are ports defined in p_port
-        if isinstance(port, int):
-            self.los = LO(self, port)
-        else:
-            los = self.los = {}
-            for p in port:
-                los[p] = LO(self, p)
-            # Define the pool folder
-            self.folder = self.getFolder()
+        if isinstance(port, int): port = (port,)
+        self.ports = port
+        los = self.los = {}
+        for p in port:
+            los[p] = LO(self, p)
+        # The folder where lock files are written when LO servers are shared
+        # with other processes.
+        self.folder = None
+        # The condition protecting LO instances' counters, onto which threads
+        # wait for a LO server to become available.
+        self.condition = threading.Condition()
+        # Metrics. "waiting" is the number of threads currently waiting for a
+        # LO server (the queue depth), "maxWaiting" is its highest value ever.
+        # "waitTime" is the total time, in seconds, spent by threads waiting for
+        # a LO server, "maxWaitTime" being the longest wait. "timeouts" counts
+        # the threads that gave up waiting.
+        self.waiting = self.maxWaiting = self.timeouts = 0
+        self.waitTime = self.maxWaitTime = 0.0
+        self.acquired = 0
 
     def getFolder(self):
         '''Return the pool folder on this machine. Create it if it does not
            exist yet/'''
-        # If several LO servers are in use, a temp folder must be created, named
+        # If LO servers are shared between processes, a temp folder must be
+        # created, named
         #
         #                     <OS temp folder>/appy/lo
         #
@@ -190,79 +544,163 @@ class LoPool:
         # appy.pod to communicate with a LO instance, it will create a file
         # named
         #
-        #         <OS temp folder>/appy/lo/<thread_id>.<lo_port>
+        #    <OS temp folder>/appy/lo/<process_id>.<thread_id>.<lo_port>
         #
-        # The file contains the port of the LO instance being contacted.
-        #
-        # Everytime a thread needs to communicate with LO, it will search for a
-        # LO instance not being busy, by reading these thread-specific files. If
-        # it finds one, it will choose it. Else, it will choose the oldest
-        # contacted LO.
-        r = os.path.join(getOsTempFolder(), 'appy', 'lo')
-        if not os.path.isdir(r):
-            # Create it
-            os.makedirs(r)
+        # Everytime a thread needs to communicate with LO, it will count the
+        # files from other processes, in order to take into account their
+        # conversions when searching for the least busy LO instance.
+        r = self.folder
+        if r is None:
+            r = os.path.join(getOsTempFolder(), 'appy', 'lo')
+            if not os.path.isdir(r):
+                # Create it
+                os.makedirs(r)
+            self.folder = r
         return r
 
     def readBusy(self):
-        '''Return info about the currently running LO servers'''
-        # Returns a tuple (busy, oldest), where:
-        # ----------------------------------------------------------------------
-        # busy   | is a dict ~{i_port: s_threadId}~, indicating which thread is
-        #        | currently communicating with which LO ;
-        # ----------------------------------------------------------------------
-        # oldest | is the LO instance corresponding to the oldest contacted LO.
-        # ----------------------------------------------------------------------
-        # Read files from the pool folder
-        folder = self.folder
-        names = os.listdir(folder)
-        if not names: return None, None
+        '''Return a dict ~{i_port: i_count}~ indicating how many threads from
+           other processes are currently communicating with every LO.'''
         r = {}
-        oldest = oldestDate = None
+        pid = str(os.getpid())
         los = self.los
-        for name in names:
+        folder = self.getFolder()
+        # Cache of the processes whose liveness has already been checked
+        alive = {}
+        for name in os.listdir(folder):
             # Ignore irrelevant files
             parts = name.split('.')
-            if len(parts) != 2: continue
-            # Unwrap the thread ID and LO port
-            id, port = parts
+            if len(parts) != 3: continue
+            # Ignore files from this process: the in-memory counters already
+            # take them into account.
+            if parts[0] == pid: continue
+            # Unwrap the LO port
             try:
-                port = int(port)
+                port = int(parts[2])
             except Exception:
                 continue
             # Ignore this LO instance if not among "our" LO instances
             if port not in los: continue
-            # Add an entry in "r"
-            r[port] = id
-            # Update "oldest"
-            mtime = os.stat(os.path.join(folder, name)).st_mtime
-            if oldest is None or mtime < oldestDate:
-                oldest = los[port]
-                oldestDate = mtime
-        return r, oldest
+            # Remove the files left by processes that have died while using a
+            # LO server: they would make it look busy forever.
+            other = parts[0]
+            if other not in alive: alive[other] = self.isAlive(other)
+            if not alive[other]:
+                try:
+                    os.remove(os.path.join(folder, name))
+                except OSError:
+                    pass
+                continue
+            r[port] = r.get(port, 0) + 1
+        return r
+
+    def isAlive(self, pid):
+        '''Is the process having this p_pid (as a string) still running ?'''
+        # On Windows, os.kill would terminate the process: assume it is alive
+        if os.name == 'nt': return True
+        try:
+            os.kill(int(pid), 0)
+        except ValueError:
+            return False
+        except OSError, err:
+            # EPERM: the process exists but belongs to another user
+            return err.errno == errno.EPERM
+        return True
 
     def chooseLO(self):
         '''Choose and return the LO instance that will manage the current
-           request.'''
-        # The result is a tuple (LO, b_multiple). The boolean value indicates if
-        # there are at least 2 LO instances defined in p_self.los.
-        # ~~~
+           request, or None if all LO instances are saturated. Must be called
+           while holding p_self.condition.'''
+        los = self.los
         # Return the unique LO instance
-        if isinstance(self.los, LO): return self.los, False
-        # Choose among several LO instances. Read info about busy LO instances.
-        busy, oldest = self.readBusy()
-        for port, lo in self.los.iteritems():
-            if not busy or port not in busy:
-                # I have a free LO instance
-                return lo, True
-        # All the LOs are busy. Return the oldest contacted one.
-        return oldest, True
-
-    def __call__(self, renderer, resultName, format=None, outputName=None):
+        if len(los) == 1 and self.maxJobs is None:
+            return los[self.ports[0]]
+        busy = self.shared and self.readBusy() or None
+        r = least = None
+        for lo in los.itervalues():
+            count = lo.inFlight
+            if busy: count += busy.get(lo.port, 0)
+            # Ignore saturated LO instances
+            if self.maxJobs is not None and count >= self.maxJobs: continue
+            # Choose the least busy LO or, if several LOs are equally busy, the
+            # least recently used one.
+            if r is None or count < least or \
+               (count == least and lo.last < r.last):
+                r = lo
+                least = count
+        return r
+
+    def acquire(self):
+        '''Waits until a LO instance is available, reserves it and returns
+           it.'''
+        start = time.time()
+        timeout = self.timeout
+        condition = self.condition
+        with condition:
+            lo = self.chooseLO()
+            if lo is None:
+                # All the LOs are saturated: wait
+                self.waiting += 1
+                self.maxWaiting = max(self.maxWaiting, self.waiting)
+                try:
+                    # In shared mode, other processes' lock files are re-read
+                    # periodically: their releases do not notify p_condition.
+                    poll = self.shared and self.pollInterval or None
+                    while lo is None:
+                        if timeout is None:
+                            delay = poll
+                        else:
+                            remaining = start + timeout - time.time()
+                            if remaining <= 0:
+                                self.timeouts += 1
+                                raise PodError(LO_BUSY % timeout)
+                            delay = poll and min(poll, remaining) or remaining
+                        condition.wait(delay)
+                        lo = self.chooseLO()
+                finally:
+                    self.waiting -= 1
+                waited = time.time() - start
+                self.waitTime += waited
+                self.maxWaitTime = max(self.maxWaitTime, waited)
+            lo.inFlight += 1
+            lo.last = start
+            self.acquired += 1
+        if self.shared: lo.lock()
+        return lo
+
+    def release(self, lo):
+        '''Frees this p_lo instance, reserved via m_acquire'''
+        if self.shared: lo.unlock()
+        with self.condition:
+            lo.inFlight -= 1
+            lo.jobs += 1
+            self.condition.notify()
+
+    def getStats(self):
+        '''Returns a dict of statistics about this pool'''
+        with self.condition:
+            los = {}
+            for port, lo in self.los.iteritems():
+                los[port] = {'inFlight': lo.inFlight, 'jobs': lo.jobs}
+            acquired = self.acquired
+            return {'los': los, 'waiting': self.waiting,
+                    'maxWaiting': self.maxWaiting, 'timeouts': self.timeouts,
+                    'waitTime': self.waitTime, 'maxWaitTime': self.maxWaitTime,
+                    'meanWaitTime': acquired and self.waitTime/acquired or 0.0}
+
+    def stopWorkers(self):
+        '''Stops the idle converter workers of all our LO servers'''
+        for lo in self.los.itervalues():
+            lo.stopWorkers()
+
+    def __call__(self, renderer, resultName, format=None, outputName=None,
+                 job=None):
         '''Call one of our LO servers to convert or update, in this p_format,
            the ODF pod result whose path is in p_resultName. Return LO's output
            on stderr, which contains an error message if an error occurred and
-           is empty else.'''
+           is empty else. If the call is part of an asynchronous p_job (see
+           class Job), it can be interrupted by the job's timeout or
+           cancellation.'''
 
         # If p_outputName is:
         # ----------------------------------------------------------------------
@@ -274,22 +712,50 @@ class LoPool:
         #          | be ignored: the output format will depend on p_outputName's
         #          | file extension.
         # ----------------------------------------------------------------------
-        r = ''
         # Determine the "result" to ask to LibreOffice
         if outputName:
             result = outputName
             format = os.path.splitext(result)[-1][1:]
         else:
             result = format
-        # Get the LO instance that will do the job
-        lo, multiple = self.chooseLO()
-        # Lock this instance when appropriate
-        if multiple: lo.lock()
+        # Get, and reserve, the LO instance that will do the job
+        lo = self.acquire()
         # Call LO and return its output on stderr
         try:
-            r = lo(renderer, resultName, result, format)
+            # Do not call LO if the job is over while waiting for it
+            if job and job.ready(): raise PodError(JOB_OVER)
+            r = lo(renderer, resultName, result, format, job)
         finally:
-            # Unlock it when appropriate
-            if multiple: lo.unlock()
+            self.release(lo)
         return r
+
+    def convert(self, renderer, resultName, format, outputName, job):
+        '''Performs the conversion of an asynchronous p_job (see m_submit) and
+           returns the path to the converted file.'''
+        output = self(renderer, resultName, format, outputName, job)
+        if not os.path.exists(outputName): raise PodError(CONV_ERR % output)
+        return outputName
+
+    def submit(self, renderer, resultName, format=None, outputName=None,
+               timeout=None, callback=None):
+        '''Asynchronous version of m___call__: the conversion is performed in
+           its own thread, while the calling thread goes on. r_eturns a Job
+           instance, whose method "get" returns the path to the converted file,
+           or raises a PodError if the conversion failed, was cancelled or did
+           not complete within p_timeout seconds. If a p_callback is given, it
+           is called with the job as unique arg as soon as the job is over.'''
+        # Many conversions can be submitted at once: they are spread among our
+        # LO servers, according to the rules described at the start of this
+        # class (see attributes "maxJobs" and "timeout").
+        if not outputName:
+            # Compute the name of the converted file like LO would do (see
+            # appy.pod.converter.Converter.getResultUrl).
+            base, ext = os.path.splitext(resultName)
+            if ext[1:] == format:
+                outputName = '%s.res.%s' % (base, format)
+            else:
+                outputName = '%s.%s' % (base, format)
+        job = Job(self.convert, timeout=timeout, callback=callback)
+        job.args = (renderer, resultName, format, outputName, job)
+        return job.start()
 # ------------------------------------------------------------------------------
@@ -0,0 +1,280 @@
+'''Merges ODT sub-documents into a pod result without calling LibreOffice'''
+
+# ~license~
+
+# By default, a document imported via a statement like "do ... from pod" is
+# inserted into the pod result as a section linking to the sub-document (see
+# appy.pod.doc_importers.OdtImporter): LibreOffice (LO) must then be called to
+# resolve the link. An OdtMerger inlines the body of the sub-document into the
+# pod result instead, and transfers everything this body needs: automatic
+# styles, common styles, page styles, fonts, pictures and namespace
+# declarations. The pod result can then be produced without calling LO.
+
+# ------------------------------------------------------------------------------
+import os, os.path, re, zipfile
+
+# ------------------------------------------------------------------------------
+def getSection(content, tag):
+    '''Returns the content of the first element named p_tag (ie,
+       "office:styles") found in ODF p_content, or an empty string if there
+       is no such element.'''
+    match = re.search('<%s[\s/>]' % tag, content)
+    if not match: return ''
+    end = content.find('>', match.start())
+    if content[end-1] == '/': return ''
+    return content[end+1:content.find('</%s>' % tag, end)]
+
+def getNamespaces(content):
+    '''Returns the namespaces declared on the root tag of ODF p_content, as a
+       dict ~{s_prefix: s_uri}~.'''
+    match = OdtMerger.rootTag.search(content)
+    if not match: return {}
+    return dict(OdtMerger.namespace.findall(match.group(0)))
+
+# ------------------------------------------------------------------------------
+class MergeTarget:
+    '''Information about the pod result into which sub-documents are merged,
+       shared by all the OdtMerger instances working for the same result.'''
+
+    def __init__(self, renderer):
+        contentXml = renderer.contentXml.decode('utf-8')
+        stylesXml = renderer.stylesXml.decode('utf-8')
+        # The names of the fonts declared in content.xml and the names of the
+        # styles (common, automatic and page styles), fonts and drawing
+        # elements (gradients, markers...) defined in styles.xml. Names of
+        # elements transferred from sub-documents are added to these sets.
+        fonts = getSection(contentXml, 'office:font-face-decls')
+        self.names = {'content': set(OdtMerger.fontFace.findall(fonts)),
+                      'styles': set(OdtMerger.anyName.findall(stylesXml))}
+        # The namespaces declared in content.xml and styles.xml, including
+        # those added from sub-documents ~{s_name: {s_prefix: s_uri}}~
+        self.namespaces = {'content': getNamespaces(contentXml),
+                           'styles': getNamespaces(stylesXml)}
+        # The number of sub-documents merged so far
+        self.count = 0
+
+# ------------------------------------------------------------------------------
+class OdtMerger:
+    '''Merges the body of an ODT document into the result of a pod renderer'''
+
+    # The root tag of content.xml or styles.xml, and the namespaces it declares
+    rootTag = re.compile('<office:document[^>]*>')
+    namespace = re.compile('\sxmlns:([\w.\-]+)="([^"]*)"')
+
+    # Style definitions and references to styles. Any attribute whose name ends
+    # with "style-name" (text:style-name, style:parent-style-name,
+    # style:data-style-name, text:list-style-name...) refers to a style.
+    styleName = re.compile('\sstyle:name="([^"]*)"')
+    anyName = re.compile('\s(?:style|draw):name="([^"]*)"')
+    styleRef = re.compile('(\s(?:style:name|[\w\-]+:[\w\-]*style-name|' \
+                          'style:page-layout-name))="([^"]*)"')
+
+    # Attributes defining or referring to element IDs, that must be unique
+    idRef = re.compile('(\s(?:xml:id|text:continue-list))="([^"]*)"')
+
+    # References to pictures
+    pictureRef = re.compile('(\sxlink:href)="(Pictures/[^"]*)"')
+
+    # Named elements being direct children of "office:styles", "office:font-
+    # face-decls" and "office:master-styles".
+    commonStyle = re.compile('<(style:style|text:list-style|number:\w+-style|' \
+      'draw:[\w\-]+)\s[^>]*?(?:style|draw):name="([^"]*)"[^>]*?' \
+      '(?:/>|>.*?</\\1>)', re.S)
+    fontFace = re.compile('<style:font-face\s[^>]*?style:name="([^"]*)"' \
+                          '[^>]*?(?:/>|>.*?</style:font-face>)', re.S)
+    masterPage = re.compile('<style:master-page\s[^>]*?style:name="([^"]*)"' \
+                            '[^>]*?(?:/>|>.*?</style:master-page>)', re.S)
+
+    # Uses of page styles
+    pageStyleUse = re.compile('\sstyle:master-page-name="([^"]*)"')
+    nextPageStyle = re.compile('\sstyle:next-style-name="([^"]*)"')
+
+    # Declarations found at the start of the document body, that must not be
+    # repeated in the pod result.
+    bodyDecls = re.compile('<(office:forms|text:[\w\-]+-decls)(?=[\s/>])' \
+                           '[^>]*?(?:/>|>.*?</\\1>)', re.S)
+
+    def __init__(self, path, renderer):
+        # The path to the ODT sub-document
+        self.path = path
+        # The renderer producing the pod result
+        self.renderer = renderer
+        self.dynamic = dynamic = renderer.stylesManager.dynamicStyles
+        if dynamic.target is None: dynamic.target = MergeTarget(renderer)
+        self.target = target = dynamic.target
+        target.count += 1
+        # Automatic styles and IDs from the sub-document are prefixed in order
+        # to avoid name clashes with the pod result or other sub-documents.
+        self.prefix = 'PodM%d_' % target.count
+        # The names of the automatic styles currently being renamed
+        self.names = None
+        # Pictures from the sub-document ~{s_oldPath: s_newPath}~
+        self.pictures = {}
+
+    def getStyleRef(self, match):
+        '''Produces the new definition of, or reference to, a style'''
+        name = match.group(2)
+        if name not in self.names: return match.group(0)
+        return '%s="%s%s"' % (match.group(1), self.prefix, name)
+
+    def getIdRef(self, match):
+        '''Produces the new definition of, or reference to, an ID'''
+        return '%s="%s%s"' % (match.group(1), self.prefix, match.group(2))
+
+    def getPictureRef(self, match):
+        '''Produces the new reference to a picture'''
+        path = match.group(2)
+        return '%s="%s"' % (match.group(1), self.pictures.get(path, path))
+
+    def renameIn(self, odf, names):
+        '''Renames, in p_odf, automatic styles whose p_names are given, IDs and
+           pictures.'''
+        self.names = names
+        odf = self.styleRef.sub(self.getStyleRef, odf)
+        odf = self.idRef.sub(self.getIdRef, odf)
+        if self.pictures:
+            odf = self.pictureRef.sub(self.getPictureRef, odf)
+        return odf
+
+    def getNewNamespaces(self, name, content):
+        '''Returns the namespaces declared in sub-document file p_name (content
+           or styles), whose p_content is given, that are not declared yet in
+           the pod result. Returns None if some prefix is bound to different
+           namespaces in both documents.'''
+        known = self.target.namespaces[name]
+        r = {}
+        for prefix, uri in getNamespaces(content).iteritems():
+            if prefix not in known:
+                r[prefix] = uri
+            elif known[prefix] != uri:
+                return
+        return r
+
+    def copyPictures(self, zipFile, names):
+        '''Copies pictures having these p_names from p_zipFile to the pod
+           result.'''
+        renderer = self.renderer
+        folder = os.path.join(renderer.getFolder(unzipped=True), 'Pictures')
+        if not os.path.isdir(folder): os.mkdir(folder)
+        for name in names:
+            content = zipFile.read(name)
+            base = name[9:].replace('/', '_')
+            path = os.path.join(folder, base)
+            if os.path.exists(path):
+                f = file(path, 'rb')
+                same = f.read() == content
+                f.close()
+                if same:
+                    # The pod result already contains this picture
+                    self.pictures[name] = 'Pictures/%s' % base
+                    continue
+                base = '%s%s' % (self.prefix, base)
+                path = os.path.join(folder, base)
+            f = file(path, 'wb')
+            f.write(content)
+            f.close()
+            newName = 'Pictures/%s' % base
+            # Declare the picture in the manifest of the pod result
+            renderer.fileNames[newName] = '%s/%s' % (self.path, name)
+            self.pictures[name] = newName
+
+    def addFonts(self, name, content):
+        '''Adds, to the pod result file p_name (content or styles), the fonts
+           declared in the homonym sub-document file whose p_content is
+           given, and not being declared yet.'''
+        known = self.target.names[name]
+        decls = getSection(content, 'office:font-face-decls')
+        for match in self.fontFace.finditer(decls):
+            font = match.group(1)
+            if font in known: continue
+            self.dynamic.add('%s_fonts' % name, match.group(0))
+            known.add(font)
+
+    def addCommonStyles(self, styles):
+        '''Adds, to the pod result, the common styles defined in the
+           sub-document's styles.xml, whose content is in p_styles, and not
+           being defined yet. Homonym styles from the pod result prevail.'''
+        known = self.target.names['styles']
+        for match in self.commonStyle.finditer(getSection(styles,
+                                                          'office:styles')):
+            name = match.group(2)
+            if name in known: continue
+            self.dynamic.add('styles_base', match.group(0))
+            known.add(name)
+
+    def addPageStyles(self, styles, used):
+        '''Adds, to the pod result, the page styles defined in the
+           sub-document's styles.xml, whose content is in p_styles, whose names
+           are among p_used and not being defined yet, with the automatic
+           styles they need (page layouts, header and footer styles).'''
+        pages = {}
+        for match in self.masterPage.finditer(getSection(styles,
+                                                       'office:master-styles')):
+            pages[match.group(1)] = match.group(0)
+        known = self.target.names['styles']
+        todo = list(used)
+        added = []
+        while todo:
+            name = todo.pop()
+            if (name in known) or (name not in pages): continue
+            known.add(name)
+            page = pages[name]
+            added.append(page)
+            # A page style may define the page style to use on the next page
+            next = self.nextPageStyle.search(page[:page.find('>')])
+            if next: todo.append(next.group(1))
+        if not added: return
+        autos = getSection(styles, 'office:automatic-styles')
+        names = set(self.styleName.findall(autos))
+        dynamic = self.dynamic
+        dynamic.add('styles', self.renameIn(autos, names))
+        for page in added:
+            dynamic.add('styles_master', self.renameIn(page, names))
+
+    def run(self):
+        '''Merges the sub-document into the pod result: styles, fonts and
+           pictures are added to it, and the ODF code corresponding to the
+           body of the sub-document is returned. None is returned if the
+           sub-document can't be merged: in that case, the pod result is left
+           untouched.'''
+        zipFile = zipfile.ZipFile(self.path)
+        try:
+            names = zipFile.namelist()
+            # Embedded objects are not supported. SVG pictures are not either,
+            # because pod declares imported SVG pictures as PNG pictures in the
+            # manifest.
+            for name in names:
+                if name.startswith('Object') or name.endswith('.svg'): return
+            content = zipFile.read('content.xml').decode('utf-8')
+            styles = zipFile.read('styles.xml').decode('utf-8')
+            namespaces = {}
+            for name, xml in (('content', content), ('styles', styles)):
+                namespaces[name] = self.getNewNamespaces(name, xml)
+                if namespaces[name] is None: return
+            # From now on, the sub-document will be merged
+            pictures = [name for name in names \
+                        if name.startswith('Pictures/') and \
+                           not name.endswith('/')]
+            if pictures: self.copyPictures(zipFile, pictures)
+        finally:
+            zipFile.close()
+        # Declare the namespaces being specific to the sub-document
+        dynamic = self.dynamic
+        for name, new in namespaces.iteritems():
+            self.target.namespaces[name].update(new)
+            dynamic.namespaces[name].update(new)
+        # Add fonts and common styles
+        self.addFonts('content', content)
+        self.addFonts('styles', styles)
+        self.addCommonStyles(styles)
+        # Add automatic styles from content.xml
+        autos = getSection(content, 'office:automatic-styles')
+        names = set(self.styleName.findall(autos))
+        dynamic.add('content', self.renameIn(autos, names))
+        # Add the page styles used by these automatic styles
+        used = self.pageStyleUse.findall(autos)
+        if used: self.addPageStyles(styles, used)
+        # Return the body of the sub-document
+        body = self.bodyDecls.sub('', getSection(content, 'office:text'))
+        return self.renameIn(body, names)
+# ------------------------------------------------------------------------------
@@ -111,6 +111,11 @@ class PodEnvironment(OdfEnvironment):
         self.raiseOnError = None # Will be initialized by PodParser.__init__
         # The expressions holders in use
         self.expressionsHolders = expressionsHolders
+        # The appy.pod.profiler.Profiler in use, if the result is profiled
+        self.profiler = None
+        # Insertions performed into buffers while evaluating them (see
+        # appy.pod.actions.MetaIf) ~[(MemoryBuffer, i_index, i_size)]~
+        self.insertions = []
 
     def getTable(self):
         '''Gets the currently parsed table'''
@@ -245,7 +250,7 @@ class PodParser(OdfParser):
         env.raiseOnError = caller.raiseOnError
 
     def endDocument(self):
-        self.env.currentBuffer.content.close()
+        self.env.currentBuffer.close()
 
     def startElement(self, elem, attrs):
         e = OdfParser.startElement(self, elem, attrs)
@@ -367,8 +372,8 @@ class PodParser(OdfParser):
                                 if isinstance(parent, FileBuffer):
                                     # Execute buffer action and delete the
                                     # buffer.
-                                    e.currentBuffer.action.execute(parent,
-                                                                   e.context)
+                                    parent.evaluateBuffer(e.currentBuffer,
+                                      e.context, action=True)
                                     parent.removeLastSubBuffer()
                                 e.currentBuffer = parent
                             e.mode = e.ADD_IN_SUBBUFFER
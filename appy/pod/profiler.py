@@ -0,0 +1,150 @@
+'''Profiling of pod results: time spent in statements, expressions and
+   rendering phases'''
+
+# ~license~
+
+# When a Renderer is created with parameter "profile", a Profiler records, for
+# every statement and expression of the pod template, the number of times it
+# was evaluated, the cumulative time spent in it and the number of bytes it
+# has written in the result. Times are inclusive: the time spent in a "for"
+# statement includes the time spent in the expressions and statements it
+# contains. The profiler also times the rendering phases: the production of
+# content.xml and styles.xml, the zip of the result and the calls to
+# LibreOffice. Once the result is rendered, a report is produced, as text and
+# as JSON.
+
+# ------------------------------------------------------------------------------
+import time, json
+
+# ------------------------------------------------------------------------------
+class Entry:
+    '''Statistics about a statement, an expression or a rendering phase'''
+
+    def __init__(self, type, file, text):
+        # The entry type: "statement", "expression" or "phase"
+        self.type = type
+        # The template file where the statement or expression is defined
+        # ("content" or "styles"), or None for a phase.
+        self.file = file
+        # The source of the statement or expression, or the name of the phase
+        self.text = text
+        # The number of evaluations, the cumulative time spent in it (in
+        # seconds) and the number of bytes written in the result.
+        self.calls = 0
+        self.time = 0.0
+        self.bytes = 0
+
+    def asDict(self):
+        '''Returns p_self as a dict, for the JSON report'''
+        return {'type': self.type, 'file': self.file, 'text': self.text,
+                'calls': self.calls, 'time': self.time, 'bytes': self.bytes}
+
+# ------------------------------------------------------------------------------
+class Profiler:
+    '''Records statistics about the rendering of a pod result'''
+
+    # Statements and expressions being too long are truncated in the text
+    # report.
+    maxTextLength = 70
+
+    def __init__(self, template):
+        # The template, as a path or a file-like object
+        if not isinstance(template, basestring): template = repr(template)
+        self.template = template
+        # Statements and expressions ~{(s_type, s_file, s_text): Entry}~
+        self.entries = {}
+        # Rendering phases, in the order of their first start
+        self.phases = []
+        # The template file being currently rendered ("content" or "styles")
+        self.file = None
+        # The time at which the profiler was created
+        self.created = time.time()
+
+    def getEntry(self, type, text):
+        '''Gets, or creates if it does not exist, the entry of this p_type
+           corresponding to this p_text, within the current file.'''
+        key = (type, self.file, text)
+        r = self.entries.get(key)
+        if r is None:
+            r = self.entries[key] = Entry(type, self.file, text)
+        return r
+
+    def getSize(self, buffer):
+        '''Returns the number of bytes written so far in this p_buffer, if it
+           is the root file buffer, or 0 else.'''
+        tell = getattr(buffer, 'tell', None)
+        return (tell and tell()) or 0
+
+    def start(self, buffer):
+        '''Called before evaluating a statement or expression writing its
+           result in this p_buffer. Returns the info to give to m_stop.'''
+        return time.time(), self.getSize(buffer)
+
+    def stop(self, type, text, buffer, start):
+        '''Called after having evaluated a statement or expression of this
+           p_type, whose source is in p_text, that has written its result in
+           this p_buffer, p_start being the result of m_start.'''
+        entry = self.getEntry(type, text)
+        entry.calls += 1
+        entry.time += time.time() - start[0]
+        entry.bytes += self.getSize(buffer) - start[1]
+
+    def addPhase(self, name, start):
+        '''Adds, to phase named p_name, the time elapsed since p_start'''
+        for entry in self.phases:
+            if entry.text == name: break
+        else:
+            entry = Entry('phase', None, name)
+            self.phases.append(entry)
+        entry.calls += 1
+        entry.time += time.time() - start
+
+    def getEntries(self):
+        '''Returns the statement and expression entries, sorted by decreasing
+           cumulative time.'''
+        r = self.entries.values()
+        r.sort(key=lambda entry: entry.time, reverse=True)
+        return r
+
+    def getTextReport(self):
+        '''Returns the profiling report as text'''
+        r = ['Pod profile for %s (%.3f second(s))' % \
+             (self.template, time.time() - self.created), '',
+             '%-48s %8s %12s' % ('Phase', 'Calls', 'Time (s)')]
+        for entry in self.phases:
+            r.append('%-48s %8d %12.4f' % (entry.text, entry.calls,
+                                             entry.time))
+        r.append('')
+        r.append('%-48s %8s %12s %12s' % ('Statement or expression', 'Calls',
+                                          'Time (s)', 'Bytes'))
+        max = self.maxTextLength
+        for entry in self.getEntries():
+            text = ' '.join(entry.text.split())
+            if len(text) > max: text = text[:max-3] + '...'
+            r.append('[%s] %s %s' % (entry.file, entry.type, text))
+            r.append('%-48s %8d %12.4f %12d' % ('', entry.calls, entry.time,
+                                                  entry.bytes))
+        return '\n'.join(r)
+
+    def getJsonReport(self):
+        '''Returns the profiling report as JSON'''
+        return json.dumps({'template': self.template,
+          'time': time.time() - self.created,
+          'phases': [entry.asDict() for entry in self.phases],
+          'entries': [entry.asDict() for entry in self.getEntries()]},
+          indent=1)
+
+    def dump(self, path=None):
+        '''Prints the text report or, if p_path is given, writes the text and
+           JSON reports, respectively, in files "<p_path>.txt" and
+           "<p_path>.json".'''
+        if not path:
+            print(self.getTextReport())
+            return
+        for ext, report in (('txt', self.getTextReport()),
+                            ('json', self.getJsonReport())):
+            if isinstance(report, unicode): report = report.encode('utf-8')
+            f = file('%s.%s' % (path, ext), 'w')
+            f.write(report)
+            f.close()
+# ------------------------------------------------------------------------------
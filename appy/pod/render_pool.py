@@ -0,0 +1,168 @@
+'''Renders pod results in parallel, in a pool of processes'''
+
+# ~license~
+
+# Rendering a pod template is CPU-bound Python code: within a single process,
+# several threads rendering pod results can't use more than one CPU core. A
+# RenderPool spreads rendering jobs among several worker processes, allowing
+# to use all the cores of the machine.
+
+# Because objects being part of a pod context (database objects, requests...)
+# can't generally be transmitted to another process, a job does not define a
+# context, but a "context factory": a function, called in the worker process,
+# that will produce the context. This function must be importable by the worker
+# process: it can be given as a module-level function or as a string of the
+# form "package.module.function".
+
+# ------------------------------------------------------------------------------
+import os, os.path, sys, multiprocessing
+
+from appy.pod import PodError
+from appy.pod.renderer import Renderer
+from appy.pod.lo_pool import LoPool
+from appy.pod import cache as pcache
+from appy.shared.utils import Traceback, getOsTempFolder, FolderDeleter
+
+# ------------------------------------------------------------------------------
+FACT_KO = 'Context factory "%s" could not be found.'
+JOB_KO  = 'Error while rendering "%s" from template "%s".\n%s'
+WARM_KO = 'Template "%s" could not be warmed.\n%s\n'
+
+# Renderer parameters having an impact on the way a template is parsed, that
+# must thus be used for pre-warming workers.
+warmAttributes = pcache.TemplateCache.parseAttributes + ('evaluator',)
+
+# ------------------------------------------------------------------------------
+def getFactory(factory):
+    '''Returns the function corresponding to this context p_factory, that
+       can be a function or its full name.'''
+    if callable(factory): return factory
+    moduleName, name = factory.rsplit('.', 1)
+    try:
+        module = __import__(moduleName, {}, {}, [name])
+        return getattr(module, name)
+    except (ImportError, AttributeError):
+        raise PodError(FACT_KO % factory)
+
+def warm(templates, params):
+    '''Parses these p_templates in the current (worker) process, in order to
+       fill the process-wide cache of compiled templates before the first jobs
+       are received.'''
+    # Workers share the same LibreOffice servers: their LO pools must take into
+    # account conversions performed by other workers. Pools inherited from the
+    # parent process are forgotten.
+    LoPool.shared = True
+    LoPool.pools = {}
+    # Only parameters having an impact on template parsing are used. Templates
+    # are rendered with an empty context: errors are dumped in the results,
+    # that are thrown away.
+    params = dict([(k, v) for k, v in params.iteritems() \
+                   if k in warmAttributes])
+    params['cacheTemplate'] = True
+    folder = getOsTempFolder(sub=True)
+    i = 0
+    for template in templates:
+        i += 1
+        ext = os.path.splitext(template)[1] or '.odt'
+        result = os.path.join(folder, 'warm%d%s' % (i, ext))
+        try:
+            renderer = Renderer(template, {}, result, **params)
+            # The renderer forces p_raiseOnError for ODS templates: with an
+            # empty context, the first expression would raise an error,
+            # preventing the template from being compiled. Errors must be
+            # dumped instead. Recorded environments get the p_raiseOnError
+            # value of every real rendering replaying them.
+            renderer.raiseOnError = False
+            for parser in (renderer.contentParser, renderer.stylesParser):
+                parser.env.raiseOnError = False
+            renderer.run()
+        except Exception:
+            # Warming is a mere optimization: the template will be parsed by
+            # the first job using it.
+            sys.stderr.write(WARM_KO % (template, Traceback.get()))
+    FolderDeleter.delete(folder)
+
+def render(template, factory, args, result, params):
+    '''Renders p_result from p_template, with a context produced by calling
+       this context p_factory with these p_args. Runs in a worker process.'''
+    try:
+        context = getFactory(factory)(*args)
+        Renderer(template, context, result, **params).run()
+    except Exception:
+        # Exceptions must be transmitted to the calling process: convert it to
+        # a PodError whose message contains the traceback, the original
+        # exception being potentially not picklable.
+        raise PodError(JOB_KO % (result, template, Traceback.get()))
+    return result
+
+# ------------------------------------------------------------------------------
+class RenderPool:
+    '''A pool of processes rendering pod results'''
+
+    def __init__(self, processes=None, templates=(), maxJobs=None, **params):
+        # The number of worker processes. If None, it corresponds to the number
+        # of CPU cores.
+        self.processes = processes or multiprocessing.cpu_count()
+        # Renderer parameters being common to all jobs. For example, for
+        # converting results with several LibreOffice (LO) servers, specify
+        # their ports as a list in parameter "ooPort": every worker will then
+        # choose the least busy LO server (see appy.pod.lo_pool.LoPool).
+        # Template caching is enabled by default.
+        if 'cacheTemplate' not in params: params['cacheTemplate'] = True
+        self.params = params
+        # Every worker will parse these p_templates (paths to pod templates) at
+        # startup, in order to be able to render them as soon as it receives a
+        # job. If p_maxJobs is not None, every worker process will be replaced
+        # with a new one after having executed this number of jobs.
+        self.pool = multiprocessing.Pool(self.processes, warm,
+                                         (templates, params), maxJobs)
+
+    def submit(self, template, factory, result, args=(), **params):
+        '''Asks a worker to render p_result from this p_template, with a context
+           being produced by calling this context p_factory with these p_args.
+           Returns a "future", as a multiprocessing.pool.AsyncResult instance,
+           whose method "get" returns the path to the result, or raises a
+           PodError if the job failed.'''
+        # Any parameter in p_params overrides its homonym in p_self.params
+        if params:
+            allParams = self.params.copy()
+            allParams.update(params)
+        else:
+            allParams = self.params
+        # The result must be given to workers as an absolute path
+        result = os.path.abspath(result)
+        return self.pool.apply_async(render, (template, factory, args, result,
+                                              allParams))
+
+    def renderAll(self, jobs):
+        '''Renders all these p_jobs in parallel. Every job is a tuple
+           (template, factory, result) or (template, factory, result, args).
+           This is a generator yielding, in the order of p_jobs, a tuple
+           (s_result, error) for every job, error being None or the PodError
+           that prevented this result from being produced.'''
+        futures = []
+        for job in jobs:
+            futures.append((job[2], self.submit(*job)))
+        for result, future in futures:
+            try:
+                future.get()
+                error = None
+            except PodError, pe:
+                error = pe
+            yield result, error
+
+    def close(self):
+        '''Prevents any more job from being submitted and waits for workers to
+           complete the pending ones.'''
+        self.pool.close()
+        self.pool.join()
+
+    def terminate(self):
+        '''Stops the workers immediately, without completing pending jobs'''
+        self.pool.terminate()
+        self.pool.join()
+
+    def __repr__(self):
+        '''p_self's short string representation'''
+        return '<RenderPool processes=%d>' % self.processes
+# ------------------------------------------------------------------------------
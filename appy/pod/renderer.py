@@ -2,14 +2,16 @@
 
 # ------------------------------------------------------------------------------
 from UserDict import UserDict
-import zipfile, shutil, xml.sax, os, os.path, re, mimetypes, time
+import zipfile, shutil, xml.sax, os, os.path, re, mimetypes, time, cStringIO
 
 import appy.pod
 from appy.pod import PodError
-from appy.pod.lo_pool import LoPool
+from appy.pod import cache as pcache
+from appy.pod.lo_pool import LoPool, Job
 from appy.pod.graphic import Graphic
-from appy.shared.zip import unzip, zip
+from appy.shared.zip import unzip, zip, zipEntries, dumpEntries
 from appy.pod.buffers import FileBuffer
+from appy.pod.profiler import Profiler
 from appy.pod.evaluator import Evaluator
 from appy.shared.xml_parser import Escape
 from appy.pod import styles_manager as sm
@@ -18,7 +20,7 @@ from appy.pod import doc_importers as imps
 from appy.shared.xml_parser import XmlElement
 from appy.shared import mimeTypes, mimeTypesExts
 from appy.pod.xhtml2odt import Xhtml2OdtConverter
-from appy.shared.utils import FolderDeleter, FileWrapper
+from appy.shared.utils import FolderDeleter, FileWrapper, getOsTempFolder
 from appy.pod.pod_parser import PodParser, PodEnvironment, OdInsert
 
 # ------------------------------------------------------------------------------
@@ -110,7 +112,10 @@ class Renderer:
       evaluator=None, managePageStyles=None, resolveFields=False,
       expressionsHolders=defaultExpressionsHolders, metadata=True,
       pdfOptions='ExportNotes=True', csvOptions=None, deleteTempFolder=True,
-      protection=False, pageStart=1, tabbedCR=False, fonts=None, loPool=None):
+      protection=False, pageStart=1, tabbedCR=False, fonts=None, loPool=None,
+      cacheTemplate=False, cacheImages=False, cacheXhtml=False,
+      mergePods=False, xhtmlBackend='sax', cacheStyles=False,
+      streamContent=False, profile=False, increments=None):
         '''Base on a document template (whose path is in p_template), which is
            an ODT or ODS file containing special expressions and statements
            written in Python, this renderer generates an ODT file (whose path is
@@ -125,6 +130,13 @@ class Renderer:
         # contents, etc) and sections containing links to external files (which
         # is the case, for example, if you use the default function "document").
 
+        # p_result may also be a file-like object opened for writing, ie, a
+        # StringIO instance or a HTTP response. In that case, the result will be
+        # of the same type as the template (odt or ods) and will be zipped
+        # directly into it. The template is not unzipped on disk: a temp folder
+        # is only created if really needed (ie, for importing images or
+        # documents, or for calling LO if p_forceOoCall is True).
+
         # If the Python interpreter which runs the current script is not
         # UNO-enabled, this script will run, in another process, a UNO-enabled
         # Python interpreter (whose path is p_pythonWithUnoPath) which will call
@@ -324,6 +336,90 @@ class Renderer:
         # like:
         #                      fc-list :lang=en family
 
+        # If p_cacheTemplate is True, the parsed template will be kept in a
+        # process-wide cache (see appy/pod/cache.py). Any subsequent rendering
+        # of the same template (being the same file, not modified in the
+        # meantime, or a file-like object with the same content) will not
+        # unzip and parse it again: it will simply evaluate its expressions and
+        # statements with the new context.
+
+        # If p_cacheImages is True, images imported via "do ... from document"
+        # statements or "image" expressions will be kept in a process-wide
+        # cache (see appy/pod/cache.py): when an image is imported again, it is
+        # neither retrieved nor processed (with ImageMagick) again. Images are
+        # identified by their path and modification date (files), their URL
+        # (images retrieved via HTTP, whose validity is checked with HTTP
+        # headers "ETag" and "Last-Modified") or their Zope blob. The images
+        # produced by Ghostscript from the pages of an imported PDF file are
+        # cached, too: the same PDF content is only rasterised once.
+
+        # If p_cacheXhtml is True, the ODF chunks produced from XHTML chunks
+        # (via "do ... from xhtml" statements or "xhtml" expressions) will be
+        # kept in a process-wide cache (see appy/pod/cache.py), with the
+        # dynamic styles they require. Converting again the same XHTML chunk,
+        # with the same parameters, styles mapping and template styles, will
+        # simply return the cached ODF chunk. Chunks containing images are not
+        # cached.
+
+        # By default, a sub-pod imported via a statement like "do ... from pod"
+        # is inserted as a section linking to the sub-pod result, and LO is
+        # called to resolve the link. If p_mergePods is True, the sub-pod
+        # result is merged into the result in pure Python instead (see
+        # appy/pod/odt_merger.py): its body is inlined, and its styles, page
+        # styles, fonts and pictures are transferred. An ODT result made of
+        # sub-pods may then be produced without calling LO at all.
+
+        # p_xhtmlBackend determines the XML parser used for converting XHTML
+        # chunks to ODF. With the default "sax" backend, Python code is called
+        # by the SAX parser for every element and chunk of text. With the
+        # "etree" backend, chunks are parsed by the C-accelerated ElementTree
+        # parser, and, when keep-with-next must be applied, the parsed tree is
+        # annotated and converted in a single pass. Both backends produce the
+        # same ODF code. The "etree" backend silently uses the SAX parser for
+        # chunks it does not support, like chunks declaring namespaces.
+
+        # If p_cacheStyles is True, the analysis of the styles defined in the
+        # template (styles, page styles and layouts, validated styles mappings)
+        # will be kept in a process-wide cache (see appy/pod/cache.py) and
+        # shared by all renderers working with the same template styles: the
+        # template's styles.xml will not be analysed again. Styles generated
+        # while producing a result are kept apart from the shared analysis.
+
+        # If p_streamContent is True, the resulting content.xml is not built in
+        # memory: it is written, as it is produced, in a file within the temp
+        # folder. Rows produced by a "for" statement are thus flushed to disk
+        # one after the other. When finalizing the result, only the part of
+        # content.xml preceding the document body is loaded and patched (with
+        # styles, fonts and namespaces); the body is then copied in chunks, and
+        # zipped from disk. Use it for producing very large spreadsheets or
+        # documents: memory usage does not depend on the size of the body
+        # anymore. Spreadsheets containing pod-controlled graphics are the
+        # exception: their content.xml is entirely loaded in order to be
+        # patched.
+
+        # If p_profile is not False, the rendering of the result is profiled
+        # (see appy/pod/profiler.py): for every statement and expression of the
+        # template, the number of evaluations, the cumulative evaluation time
+        # and the number of bytes written in the result are recorded, as well
+        # as the time spent in every rendering phase (production of
+        # content.xml and styles.xml, zip, calls to LibreOffice). At the end of
+        # m_run, if p_profile is True, a text report is printed on stdout. If
+        # p_profile is a path to a file, without extension, the text and JSON
+        # reports are written in files "<p_profile>.txt" and
+        # "<p_profile>.json". After rendering, the profiler is available in
+        # attribute "profiler".
+
+        # If you regenerate the same document several times, after changes
+        # that only affect some of the context variables, you may render it
+        # incrementally by giving, in p_increments, an instance of
+        # appy.pod.cache.Increments, the same for every rendering of this
+        # document. Before every new rendering, call its method "invalidate"
+        # with the names of the context variables having changed: the
+        # top-level statements and expressions of the template that do not
+        # mention these names will not be evaluated again: the ODF content
+        # they have produced the previous time will be reused. Incremental
+        # rendering implies caching the template (see p_cacheTemplate).
+
         # Please leave p_loPool attribute to None. A LO pool is a data structure
         # being internal to pod, allowing to communicate with LO. This is only
         # used by pod itself, when a main Renderer instance needs to create a
@@ -331,20 +427,30 @@ class Renderer:
 
         self.template = template
         self.templateType = self.getTemplateType(template)
-        self.result = result
-        self.resultType  = os.path.splitext(result)[1].strip('.')
+        self.setResult(result)
         self.contentXml  = None # Content (string) of content.xml
         self.stylesXml   = None # Content (string) of styles.xml
         self.manifestXml = None # Content (string) of manifest.xml
         self.metaXml     = None # Content (string) of meta.xml
         self.tempFolder  = None
+        self.unzipFolder = None
+        # When p_result is a file-like object, the template files, as collected
+        # by appy.shared.zip.unzip in its "entries" parameter.
+        self.entries = None
         self.env = None
         self.loPool = loPool or LoPool.get(pythonWithUnoPath, ooServer, ooPort)
+        # When the result is rendered asynchronously (see m_runAsync), the
+        # appy.pod.lo_pool.Job instance rendering it.
+        self.job = None
         self.stream = stream
         # p_forceOoCall may be forced to True
         self.forceOoCall = forceOoCall or bool(optimalColumnWidths) or \
           bool(distributeColumns) or bool(script) or bool(resolveFields) or \
           (pageStart > 1)
+        # p_forceOoCall may also be forced to True while rendering, ie, if a
+        # sub-document must be imported: remember the initial value, to
+        # restore when recycling p_self (see m_reinit).
+        self.initialForceOoCall = self.forceOoCall
         # Must the POD post-processor (ppp) be enabled ?
         self.ppp = False
         self.finalizeFunction = self.formatFinalizeFunction(finalizeFunction)
@@ -380,8 +486,19 @@ class Renderer:
         # which is imported several times).
         self.fileNames = {}
         self.prepareFolders()
-        # Unzip the p_template
-        info = unzip(template, self.unzipFolder, odf=True)
+        # Unzip the p_template, or get it from the cache of compiled templates
+        self.cacheTemplate = cacheTemplate or (increments is not None)
+        self.increments = increments
+        self.cacheImages = cacheImages
+        self.cacheXhtml = cacheXhtml
+        self.mergePods = mergePods
+        self.xhtmlBackend = xhtmlBackend
+        self.cacheStyles = cacheStyles
+        self.streamContent = streamContent
+        self.profile = profile
+        self.initProfiler()
+        self.compiled = None # Will hold a pcache.CompiledTemplate if relevant
+        info = self.unzipTemplate()
         self.contentXml = info['content.xml']
         self.stylesXml = info['styles.xml']
         # Manage the styles defined into the ODT template
@@ -400,22 +517,39 @@ class Renderer:
         # Store the p_html parameter
         self.html = html
 
-    def reinit(self, result, context):
+    def reinit(self, result, context, keepStyles=False):
         '''Re-initialise this renderer (p_self) for recycling him and produce
-           another p_result with another p_context.'''
-        self.result = result
+           another p_result with another p_context. If p_keepStyles is True,
+           the analysis of the template styles made by the styles manager is
+           reused instead of being performed again.'''
+        self.setResult(result)
+        if self.result: self.checkResult()
         self.originalContext = context
+        # Forget about LO calls forced while producing the previous result
+        self.forceOoCall = self.initialForceOoCall
+        self.ppp = False
+        # Get a compiled version of the template, if available
+        if self.compiled:
+            compiled = self.compiled
+            self.compiled = pcache.templates.get(compiled.key) or \
+                            compiled.fork()
         # Re-create POD parsers
+        self.initProfiler()
         self.createParsers(context)
         # Reinitialise attributes being specific to a given result
-        smap = self.stylesManager.stylesMapping
-        self.stylesManager = sm.StylesManager(self)
-        self.stylesManager.stylesMapping = smap
+        if keepStyles:
+            self.stylesManager.reinit()
+        else:
+            smap = self.stylesManager.stylesMapping
+            self.stylesManager = sm.StylesManager(self)
+            self.stylesManager.stylesMapping = smap
 
     # Attributes to clone to a sub-renderer when using m_clone hereafter
     cloneAttributes = ('html', 'raiseOnError', 'imageResolver', 'rotateImages',
       'stylesTemplate', 'optimalColumnWidths', 'distributeColumns',
-      'expressionsHolders', 'protection', 'tabbedCR', 'fonts', 'evaluator')
+      'expressionsHolders', 'protection', 'tabbedCR', 'fonts', 'evaluator',
+      'cacheTemplate', 'cacheImages', 'cacheXhtml', 'mergePods',
+      'xhtmlBackend', 'cacheStyles', 'streamContent')
 
     def clone(self, template, context, result, **params):
         '''Creates another Renderer instance, similar to p_self, but for
@@ -479,8 +613,19 @@ class Renderer:
            user, while p_inserts depends on the ODT file we must parse.'''
         context = self.getCompleteContext(context)
         env = PodEnvironment(context, inserts, self.expressionsHolders)
-        fileBuffer = FileBuffer(env, os.path.join(self.tempFolder, odtFile))
+        # If the template is being compiled, the file buffer must record its
+        # program.
+        compiled = self.compiled
+        record = bool(compiled) and not compiled.ready
+        # The result is written in memory (see m_finalize). If
+        # p_self.streamContent is True, content.xml is written on disk instead.
+        result = None
+        if self.streamContent and (odtFile == 'content.xml'):
+            result = os.path.join(self.getFolder(), odtFile)
+        fileBuffer = FileBuffer(env, result, record=record)
         env.currentBuffer = fileBuffer
+        env.profiler = self.profiler
+        fileBuffer.increments = self.increments
         return PodParser(env, self)
 
     def createParsers(self, context):
@@ -506,10 +651,15 @@ class Renderer:
         # If p_html is not None, it overrides renderer's homonym parameter.
         stylesMapping = self.stylesManager.checkStylesMapping(stylesMapping)
         if html is None: html = self.html
-        return Xhtml2OdtConverter(s, encoding, self.stylesManager,
-                                  stylesMapping, keepWithNext, keepImagesRatio,
-                                  imagesMaxWidth, imagesMaxHeight, self, html,
-                                  unwrap).run()
+        convert = lambda: Xhtml2OdtConverter(s, encoding, self.stylesManager,
+                          stylesMapping, keepWithNext, keepImagesRatio,
+                          imagesMaxWidth, imagesMaxHeight, self, html,
+                          unwrap).run()
+        if not self.cacheXhtml: return convert()
+        # Get the ODF chunk from the cache of XHTML conversions
+        params = (encoding, stylesMapping, keepWithNext, keepImagesRatio,
+                  imagesMaxWidth, imagesMaxHeight, html, unwrap)
+        return pcache.xhtml.render(self, s, params, convert)
 
     def renderText(self, s, prefix=None, tags=None, firstCss=None,
                    otherCss=None, lastCss=None, stylesMapping={}):
@@ -712,7 +862,7 @@ class Renderer:
     def importPod(self, content=None, at=None, format='odt', context=None,
           pageBreakBefore=False, pageBreakAfter=False,
           managePageStyles='rename', renamePageStyles=None, resolveFields=False,
-          forceOoCall=INHERIT):
+          forceOoCall=INHERIT, merge=None):
         '''Implements the POD statement "do... from pod"'''
         # Similar to m_importDocument, but allows to import the result of
         # executing the POD template specified in p_content or p_at, and include
@@ -732,6 +882,14 @@ class Renderer:
         # renderer ran by a imps.PodImporter will inherit from this attribute,
         # excepted if parameter p_forceOoCall is different from INHERIT.
 
+        # If p_merge is True, the sub-pod result is merged into the result
+        # without calling LO (see appy/pod/odt_merger.py). It is not possible
+        # if LO runs on a distant machine (p_self.stream being "in"), or if the
+        # sub-pod contains elements the merger does not support (ie, embedded
+        # objects): in that case, a section linking to the sub-pod result is
+        # inserted, as usual. If p_merge is None, it is inherited from
+        # p_self.mergePods.
+
         # Is there a pod template defined ?
         if not content and not at:
             raise PodError(DOC_KO)
@@ -740,7 +898,10 @@ class Renderer:
         if content.__class__.__name__ == 'File':
             content = FileWrapper(content)
         imp = imps.PodImporter(content, at, format, self)
-        self.forceOoCall = True
+        if merge is None: merge = self.mergePods
+        # Unless the sub-pod result is merged into the result, LO will be
+        # called for resolving the section linking to it.
+        if not merge: self.forceOoCall = True
         # Define the context to use: either the current context of the current
         # POD renderer, or p_context if given.
         if context:
@@ -751,8 +912,10 @@ class Renderer:
         if renamePageStyles is not None:
             managePageStyles = (renamePageStyles == True) and 'rename' or None
         imp.init(ctx, pageBreakBefore, pageBreakAfter,
-                 managePageStyles, resolveFields, forceOoCall)
-        return imp.run()
+                 managePageStyles, resolveFields, forceOoCall, merge)
+        r = imp.run()
+        if not imp.merged: self.forceOoCall = True
+        return r
 
     def importCell(self, content, style='Default'):
         '''Creates a chunk of ODF code ready to be dumped as table cell'''
@@ -785,9 +948,20 @@ class Renderer:
     def insertPageBreak(self): return self._insertBreak('page')
     def insertColumnBreak(self): return self._insertBreak('column')
 
-    def prepareFolders(self):
-        '''Ensure p_self.result is correct and create, when relevant, the temp
-           folder for preparing it.'''
+    def setResult(self, result):
+        '''Defines the p_result to produce: the path to a file or a file-like
+           object.'''
+        if isinstance(result, basestring):
+            self.result = result
+            self.resultFile = None
+            self.resultType = os.path.splitext(result)[1].strip('.')
+        else:
+            self.result = None
+            self.resultFile = result
+            self.resultType = self.templateType
+
+    def checkResult(self):
+        '''Ensure p_self.result is correct'''
         # Ensure p_self.result is an absolute path
         self.result = os.path.abspath(self.result)
         # Raise an error if the result already exists and we can't overwrite it
@@ -798,6 +972,14 @@ class Renderer:
             raise PodError(R_EXISTS % self.result)
         # Remove the result if it exists
         if exists: os.remove(self.result)
+
+    def prepareFolders(self):
+        '''Ensure p_self.result is correct and create, when relevant, the temp
+           folder for preparing it.'''
+        # If the result is a file-like object, folders will only be created if
+        # needed (see m_getFolder).
+        if self.resultFile: return
+        self.checkResult()
         # Create a temp folder for storing temporary files
         self.tempFolder = '%s.%f' % (self.result, time.time())
         try:
@@ -809,10 +991,82 @@ class Renderer:
         self.unzipFolder = os.path.join(self.tempFolder, 'unzip')
         os.mkdir(self.unzipFolder)
 
+    def getFolder(self, unzipped=False):
+        '''Returns the temp folder or, if p_unzipped is True, the unzip folder.
+           When the result is a file-like object, these folders are created
+           the first time this method is called, and the template files are
+           dumped in the unzip folder.'''
+        if self.tempFolder is None:
+            self.tempFolder = getOsTempFolder(sub=True)
+            self.unzipFolder = os.path.join(self.tempFolder, 'unzip')
+            os.mkdir(self.unzipFolder)
+            dumpEntries(self.entries, self.unzipFolder)
+        return unzipped and self.unzipFolder or self.tempFolder
+
+    def unzipTemplate(self):
+        '''Unzips p_self.template into p_self.unzipFolder and returns a dict
+           containing the content of its main files (see
+           appy.shared.zip.unzip). If the result is a file-like object, the
+           template files are kept in memory, in p_self.entries.'''
+        folder = self.unzipFolder
+        if not self.cacheTemplate:
+            if folder:
+                return unzip(self.template, folder, odf=True)
+            self.entries = []
+            return unzip(self.template, None, odf=True, entries=self.entries)
+        # Get a compiled version of the template from the cache
+        key = pcache.templates.getKey(self)
+        compiled = pcache.templates.get(key)
+        if compiled:
+            self.compiled = compiled
+            if folder: return compiled.dump(folder)
+            self.entries = compiled.entries
+            return compiled.info
+        # Unzip the template and prepare its compilation
+        entries = []
+        info = unzip(self.template, folder, odf=True, entries=entries)
+        if not folder: self.entries = entries
+        self.compiled = pcache.CompiledTemplate(key, info, entries)
+        return info
+
+    def readTemplateFile(self, name):
+        '''Returns the content of the template file named p_name, ie,
+           "meta.xml" or "META-INF/manifest.xml".'''
+        if self.entries is not None:
+            for entryName, content in self.entries:
+                if entryName == name: return content
+        f = file(os.path.join(self.unzipFolder, *name.split('/')))
+        r = f.read()
+        f.close()
+        return r
+
+    def initProfiler(self):
+        '''Creates a profiler for the next result, if it must be profiled'''
+        self.profiler = self.profile and Profiler(self.template) or None
+
+    def parse(self, name):
+        '''Creates the resulting content.xml or styles.xml, depending on
+           p_name, by parsing the template file or replaying its compiled
+           version.'''
+        parser = self.currentParser = getattr(self, '%sParser' % name)
+        if self.increments: self.increments.file = name
+        profiler = self.profiler
+        if profiler:
+            profiler.file = name
+            start = time.time()
+        compiled = self.compiled
+        if compiled and compiled.ready:
+            compiled.replay(name, parser)
+        else:
+            parser.parse(getattr(self, '%sXml' % name))
+            if compiled: compiled.record(name, parser)
+        if profiler: profiler.addPhase('%s.xml' % name, start)
+
     def patchMetadata(self):
         '''Declares, in META-INF/manifest.xml, images or files included via the
            "do... from document" statements if any, and patch meta.xml (field
-           "title").'''
+           "title"). Patched files are not written in p_self.unzipFolder: they
+           are stored in p_self.zipContents.'''
         # Patch META-INF/manifest.xml
         j = os.path.join
         if self.fileNames:
@@ -823,61 +1077,148 @@ class Renderer:
                 mimeType = mimetypes.guess_type(fileName)[0]
                 toInsert += ' <manifest:file-entry manifest:media-type="%s" ' \
                             'manifest:full-path="%s"/>\n' % (mimeType, fileName)
-            manifestName = j(self.unzipFolder, 'META-INF', 'manifest.xml')
             # Read the the content of this file, if not already in
             # self.manifestXml.
             if not self.manifestXml:
-                f = file(manifestName)
-                self.manifestXml = f.read()
-                f.close()
+                self.manifestXml = self.readTemplateFile('META-INF/manifest.xml')
             hook = '</manifest:manifest>'
             content = self.manifestXml.replace(hook, toInsert + hook)
-            # Write the new manifest content
-            f = file(manifestName, 'w')
-            f.write(content)
-            f.close()
+            self.zipContents['META-INF/manifest.xml'] = content
         # Patch meta.xml
         metadata = self.metadata
         if metadata:
-            metaName = j(self.unzipFolder, 'meta.xml')
             # Read the content of this file, if not already in self.metaXml
             if not self.metaXml:
-                f = open(metaName)
-                self.metaXml = f.read()
-                f.close()
+                self.metaXml = self.readTemplateFile('meta.xml')
             # Remove the existing title, if it exists
             content = self.metaRex.sub('', self.metaXml)
             # Add a new title, based on the result name
             if isinstance(metadata, basestring):
                 title = metadata
             else:
-                title = os.path.splitext(os.path.basename(self.result))[0]
+                path = self.result or getattr(self.resultFile, 'name', None)
+                if not isinstance(path, basestring): path = self.template
+                if not isinstance(path, basestring): path = 'result'
+                title = os.path.splitext(os.path.basename(path))[0]
             hook = self.metaHook
             title = '<dc:title>%s</dc:title>%s' % (title, hook)
             content = content.replace(hook, title)
-            f = open(metaName, 'w')
-            f.write(content)
-            f.close()
+            self.zipContents['meta.xml'] = content
 
     # Public interface
     def run(self):
         '''Renders the result'''
+        compiled = self.compiled
+        # Files of the result being patched in memory ~{s_name: s_content}~
+        self.zipContents = {}
+        increments = self.increments
+        if increments: increments.start(self)
         try:
-            # Remember which parser is running
-            self.currentParser = self.contentParser
-            # Create the resulting content.xml
-            self.currentParser.parse(self.contentXml)
-            self.currentParser = self.stylesParser
-            # Create the resulting styles.xml
-            self.currentParser.parse(self.stylesXml)
+            # Create the resulting content.xml and styles.xml
+            self.parse('content')
+            self.parse('styles')
+            if increments: increments.end()
             # Patch metadata
             self.patchMetadata()
             # Re-zip the result
+            start = time.time()
             self.finalize()
+            profiler = self.profiler
+            if profiler:
+                profiler.addPhase('finalize', start)
+                if self.profile is True: profiler.dump()
+                else: profiler.dump(self.profile)
+            # Put the compiled template (back) in the cache
+            if compiled:
+                compiled.ready = True
+                pcache.templates.put(compiled)
         finally:
-            if self.deleteTempFolder:
+            if self.deleteTempFolder and self.tempFolder:
                 FolderDeleter.delete(self.tempFolder)
 
+    def runAsync(self, timeout=None, callback=None):
+        '''Renders the result in its own thread, without blocking the calling
+           thread. r_eturns an appy.pod.lo_pool.Job instance, whose method "get"
+           returns the result (a file path or file-like object), or raises a
+           PodError if rendering failed, was cancelled or did not complete
+           within p_timeout seconds. If a p_callback is given, it is called
+           with the job as unique arg as soon as the job is over.'''
+        # If the timeout is reached or the job is cancelled while LibreOffice
+        # converts the result, the conversion is interrupted (see class
+        # appy.pod.lo_pool.Job).
+        self.job = Job(self.runJob, timeout=timeout, callback=callback)
+        return self.job.start()
+
+    def runJob(self):
+        '''Renders the result within an asynchronous job (see m_runAsync)'''
+        self.run()
+        return self.resultFile or self.result
+
+    def removeImportedFiles(self):
+        '''Removes, from p_self.unzipFolder, the files (ie, images) that were
+           imported into the last result, and restores the manifest of the
+           template, in order to produce another result with p_self.'''
+        if not self.fileNames: return
+        j = os.path.join
+        for fileName in self.fileNames.iterkeys():
+            paths = [fileName]
+            if fileName.endswith('.svg'):
+                paths.append(os.path.splitext(fileName)[0] + '.png')
+            for path in paths:
+                path = j(self.unzipFolder, path)
+                if os.path.isfile(path): os.remove(path)
+        self.fileNames = {}
+        # m_patchMetadata has stored the original manifest in
+        # p_self.manifestXml.
+        if not self.manifestXml: return
+        f = file(j(self.unzipFolder, 'META-INF', 'manifest.xml'), 'w')
+        f.write(self.manifestXml)
+        f.close()
+
+    @classmethod
+    def renderMany(class_, template, contexts, resultPattern, **params):
+        '''Renders this p_template once for every context from p_contexts. This
+           is a generator, yielding, for every context, a tuple
+           (s_result, error), error being None or the exception that prevented
+           this result from being produced.'''
+        # p_resultPattern determines the path to every result. It can be:
+        # - a string containing a "%d" (or "%s"), that will be replaced with
+        #   the number of the current context (starting at 1), ie,
+        #   "/tmp/letters/letter%d.pdf";
+        # - a function accepting 2 args (the number and the current context)
+        #   and returning the result path.
+        # Other p_params are passed to the Renderer constructor.
+
+        # A single renderer is created and recycled for producing all results:
+        # the template is unzipped and parsed only once, its static parts (ie,
+        # pictures, manifest, meta) are reused from one result to the next, and
+        # so is the analysis of the template styles. The renderer's temp folder
+        # is deleted at the end of the batch.
+        params['deleteTempFolder'] = False
+        if 'cacheTemplate' not in params: params['cacheTemplate'] = True
+        renderer = None
+        i = 0
+        try:
+            for context in contexts:
+                i += 1
+                if callable(resultPattern):
+                    result = resultPattern(i, context)
+                else:
+                    result = resultPattern % i
+                error = None
+                try:
+                    if renderer is None:
+                        renderer = class_(template, context, result, **params)
+                    else:
+                        renderer.removeImportedFiles()
+                        renderer.reinit(result, context, keepStyles=True)
+                    renderer.run()
+                except Exception, e:
+                    error = e
+                yield result, error
+        finally:
+            if renderer: FolderDeleter.delete(renderer.tempFolder)
+
     def getStyles(self):
         '''Returns a dict of the styles that are defined into the template'''
         return self.stylesManager.styles
@@ -897,7 +1238,7 @@ class Renderer:
         except PodError, po:
             self.contentParser.env.currentBuffer.content.close()
             self.stylesParser.env.currentBuffer.content.close()
-            if os.path.exists(self.tempFolder):
+            if self.tempFolder and os.path.exists(self.tempFolder):
                 FolderDeleter.delete(self.tempFolder)
             raise po
 
@@ -923,7 +1264,56 @@ class Renderer:
         '''Call LibreOffice in server mode to convert or update the result'''
         if self.loPool is None:
             raise PodError(NO_LO_POOL % resultType)
-        return self.loPool(self, resultName, format, outputName)
+        job = self.job
+        if not self.profiler:
+            return self.loPool(self, resultName, format, outputName, job)
+        start = time.time()
+        try:
+            return self.loPool(self, resultName, format, outputName, job)
+        finally:
+            self.profiler.addPhase('LibreOffice', start)
+
+    # Size of the chunks read from a streamed content.xml
+    streamChunkSize = 65536
+
+    def readStreamed(self, buffer):
+        '''Reads the content.xml file that p_buffer has written on disk. Returns
+           a tuple (head, body): "head" is the part of the file, up to the start
+           tag of the document body, that must be patched; "body" is the file,
+           opened and positioned at the end of the head. If the whole file must
+           be patched, "head" is the complete file content and "body" is
+           None.'''
+        f = file(buffer.result, 'rb')
+        if buffer.env.odsGraphics:
+            # Pod-controlled graphics are patched within the body
+            r = f.read()
+            f.close()
+            return r, None
+        r = ''
+        while True:
+            chunk = f.read(self.streamChunkSize)
+            if not chunk: break
+            r += chunk
+            start = r.find('<office:body')
+            if start == -1: continue
+            end = r.find('>', start)
+            if end != -1:
+                r = r[:end+1]
+                break
+        f.seek(len(r))
+        return r, f
+
+    def writeStreamed(self, buffer, head, body):
+        '''Writes, in p_self.unzipFolder, the final content.xml, made of its
+           patched p_head and the rest of the file that p_buffer has written
+           on disk, opened in p_body.'''
+        path = os.path.join(self.getFolder(unzipped=True), 'content.xml')
+        f = file(path, 'wb')
+        f.write(head)
+        shutil.copyfileobj(body, f, self.streamChunkSize)
+        f.close()
+        body.close()
+        os.remove(buffer.result)
 
     def finalize(self):
         '''Re-zip the result and potentially call LibreOffice if target format
@@ -935,61 +1325,107 @@ class Renderer:
         mps = self.managePageStyles
         if mps != None:
             pageStyles = self.stylesManager.pageStyles.init(mps, self.template)
-        # Patch styles.xml and content.xml
+        # Patch styles.xml and content.xml. Their content, as produced by the
+        # parsers' file buffers, is in memory: it is patched and zipped from
+        # there, without being written in p_self.unzipFolder. A streamed
+        # content.xml is patched and written in p_self.unzipFolder, from which
+        # it is zipped.
         dynamic = self.stylesManager.dynamicStyles
+        contents = self.zipContents
         for name in ('styles', 'content'):
-            # Copy the [content|styles].xml file from the temp to the zip folder
-            fn = '%s.xml' % name
-            shutil.copy(j(self.tempFolder, fn), j(self.unzipFolder, fn))
-            # Get the file content
-            fn = os.path.join(self.unzipFolder, fn)
-            f = file(fn)
-            content = f.read()
-            f.close()
+            buffer = getattr(self, '%sParser' % name).env.currentBuffer
+            content = buffer.value
+            # A streamed content.xml is on disk: only its head is patched
+            body = None
+            if content is None:
+                content, body = self.readStreamed(buffer)
             # Inject self.fonts, when present, in styles.xml
             isStylesXml = name == 'styles'
             if isStylesXml and self.fonts:
                 content = sm.FontsInjector(self.fonts).injectIn(content)
             # Inject dynamic styles
-            if isStylesXml: content = dynamic.injectIn('styles_base', content)
+            if isStylesXml:
+                content = dynamic.injectIn('styles_base', content)
+                content = dynamic.injectIn('styles_master', content)
+            content = dynamic.injectIn('%s_fonts' % name, content)
             content = dynamic.injectIn(name, content)
+            content = dynamic.injectNamespaces(name, content)
             # Rename the page styles
             if pageStyles:
                 content = pageStyles.renameIn(name, content)
             # Patch pod graphics, when relevant
             if not isStylesXml:
                 content = Graphic.patch(self, content)
-            # Write the updated content to the file
-            f = file(fn, 'w')
-            f.write(content)
-            f.close()
+            if body:
+                self.writeStreamed(buffer, content, body)
+            else:
+                contents['%s.xml' % name] = content
         # Call the user-defined "finalize" function(s) when present
         if self.finalizeFunction:
+            # These functions work on p_self.unzipFolder: in-memory files must
+            # be written in it.
+            folder = self.getFolder(unzipped=True)
+            for name, content in contents.iteritems():
+                f = file(j(folder, name), 'w')
+                f.write(content)
+                f.close()
+            contents = None
             try:
-                for fun in self.finalizeFunction: fun(self.unzipFolder, self)
+                for fun in self.finalizeFunction: fun(folder, self)
             except Exception, e:
                 print(FIN_ERR % str(e))
         # Re-zip the result, first as an OpenDocument file of the same type as
         # the POD template (odt, ods...)
-        resultName = os.path.join(self.tempFolder,
-                                  'result.%s' % self.templateType)
         resultType = self.resultType
-        zip(resultName, self.unzipFolder, odf=True)
+        start = time.time()
         if resultType in self.templateTypes and not self.forceOoCall:
-            # Simply move the ODT result to the result
-            os.rename(resultName, self.result)
+            # The result can be directly zipped in p_self.result(File)
+            if self.resultFile:
+                self.zipTo(self.resultFile, contents)
+            else:
+                zip(self.result, self.unzipFolder, odf=True, contents=contents)
+            if self.profiler: self.profiler.addPhase('zip', start)
+            return
+        tempFolder = self.getFolder()
+        resultName = os.path.join(tempFolder, 'result.%s' % self.templateType)
+        zip(resultName, self.unzipFolder, odf=True, contents=contents)
+        if self.profiler: self.profiler.addPhase('zip', start)
+        if resultType not in FILE_TYPES:
+            raise PodError(FMT_KO % (self.result, FILE_TYPES.keys()))
+        # Call LibreOffice to perform the conversion or document update. If the
+        # result is a file-like object, LO writes it in the temp folder first.
+        result = self.result or \
+                 os.path.join(tempFolder, 'result.res.%s' % resultType)
+        output = self.callLibreOffice(resultName, outputName=result)
+        # I (should) have the result in "result"
+        if not os.path.exists(result):
+            if resultType in self.templateTypes:
+                # In this case LO in server mode could not be called (to
+                # update indexes, sections, etc) but I can still return the
+                # "raw" pod result that exists in "resultName".
+                os.rename(resultName, result)
+            else:
+                raise PodError(CONV_ERR % output)
+        if self.resultFile:
+            f = file(result, 'rb')
+            self.resultFile.write(f.read())
+            f.close()
+
+    def zipTo(self, f, contents):
+        '''Zips the result into file-like object p_f, p_contents being the
+           result files being in memory (see m_finalize).'''
+        # A zip file can only be written in a seekable file: if p_f is not
+        # (ie, a HTTP response), the zip is built in memory and then written
+        # in p_f.
+        try:
+            f.tell()
+            target = f
+        except (AttributeError, IOError):
+            target = cStringIO.StringIO()
+        if self.tempFolder is None:
+            # The template files are still in memory
+            zipEntries(target, self.entries, contents)
         else:
-            if resultType not in FILE_TYPES:
-                raise PodError(FMT_KO % (self.result, FILE_TYPES.keys()))
-            # Call LibreOffice to perform the conversion or document update
-            output = self.callLibreOffice(resultName, outputName=self.result)
-            # I (should) have the result in self.result
-            if not os.path.exists(self.result):
-                if resultType in self.templateTypes:
-                    # In this case LO in server mode could not be called (to
-                    # update indexes, sections, etc) but I can still return the
-                    # "raw" pod result that exists in "resultName".
-                    os.rename(resultName, self.result)
-                else:
-                    raise PodError(CONV_ERR % output)
+            zip(target, self.unzipFolder, odf=True, contents=contents)
+        if target is not f: f.write(target.getvalue())
 # ------------------------------------------------------------------------------
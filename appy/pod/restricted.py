@@ -84,11 +84,20 @@ class Evaluator(BaseEvaluator):
                 if val:
                     context[key] = val
 
+    def compile(self, expr):
+        '''Compiles p_expr via RestrictedPython'''
+        return rp.compile_restricted(expr.strip(), '<string>', 'eval')
+
     def run(self, expr, context):
         '''Evaluates this p_expr(ession) in this p_context'''
+        return self.runCode(self.compile(expr), context)
+
+    def runCode(self, code, context):
+        '''Evaluates this p_code object, compiled by RestrictedPython, in this
+           p_context.'''
         # m_updateContext has already been applied to this p_context. p_context
         # is ready, excepted if p_self.attr must be injected in it.
         if self.attr:
             context['_getattr_'] = self.attr
-        return eval(rp.compile_restricted(expr, '<string>', 'eval'), context)
+        return eval(code, context)
 # ------------------------------------------------------------------------------
@@ -9,6 +9,7 @@ from appy import commercial
 from appy.shared.errors import CommercialError
 from appy.shared.utils import getElementAt, formatNumber
 from appy.pod.odf_parser import OdfEnvironment, OdfParser
+from appy.pod import cache as pcache
 from appy.shared.css import parseStyleAttribute, CssStyles, CssValue, px2cm
 
 # Possible states for the styles parser
@@ -557,12 +558,16 @@ class PageStyles:
 
     def getNewStyleDefinition(self, match):
         '''Produce the new style definition'''
-        style = self.styles[match.group(1)]
-        return style.reifyStartTag()
+        # Page styles coming from merged sub-documents are left untouched
+        name = match.group(1)
+        if name not in self.styles: return match.group(0)
+        return self.styles[name].reifyStartTag()
 
     def getNewStyleUse(self, match):
         '''Produce the new style use'''
-        style = self.styles[match.group(2)]
+        name = match.group(2)
+        if name not in self.styles: return match.group(0)
+        style = self.styles[name]
         # Determine the start number for sub-pages
         if self.first:
             start = self.startNumber
@@ -697,6 +702,46 @@ class Styles(UserDict):
                     res.append(style)
         return res
 
+class StylesOverlay(Styles):
+    '''Copy-on-write view on a Styles instance being shared by several styles
+       managers (see appy.pod.cache.ParsedStyles): the shared styles are copied
+       the first time a style is added or removed.'''
+
+    def __init__(self, base):
+        # Do not call the base constructor: p_base's dict is used as is
+        self.data = base.data
+        self.shared = True
+
+    def own(self):
+        '''Ensures p_self does not share its dict anymore'''
+        if self.shared:
+            self.data = self.data.copy()
+            self.shared = False
+
+    def __setitem__(self, key, value):
+        self.own()
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        self.own()
+        del self.data[key]
+
+    def clear(self):
+        self.data = {}
+        self.shared = False
+
+    def update(self, *args, **kwargs):
+        self.own()
+        Styles.update(self, *args, **kwargs)
+
+    def pop(self, key, *args):
+        self.own()
+        return Styles.pop(self, key, *args)
+
+    def popitem(self):
+        self.own()
+        return Styles.popitem(self)
+
 # ------------------------------------------------------------------------------
 class FontsInjector:
     '''Allows to inject a font within all styles in a ODF document'''
@@ -998,18 +1043,42 @@ class DynamicStyles:
     # the "automatic-styles" section of styles.xml (ie, styles used in the
     # header and the footer) or in its "styles" section (ie, bullet styles).
 
+    # Sub-documents merged into the pod result by an
+    # appy.pod.odt_merger.OdtMerger may also bring page styles, fonts and
+    # namespace declarations.
+
     # The styles must be injected just before these "hooks"
-    hooks = {'content':     '</office:automatic-styles>',
-             'styles_base': '</office:styles>',
-             'styles':      '</office:automatic-styles>'}
+    hooks = {'content':       '</office:automatic-styles>',
+             'content_fonts': '</office:font-face-decls>',
+             'styles_base':   '</office:styles>',
+             'styles':        '</office:automatic-styles>',
+             'styles_fonts':  '</office:font-face-decls>',
+             'styles_master': '</office:master-styles>'}
 
     def __init__(self):
         # Styles to be injected in the "automatic-styles" tag within content.xml
         self.content = []
+        # Fonts to be injected in the "font-face-decls" tag within content.xml
+        self.content_fonts = []
         # Styles to be injected in the "automatic-styles" tag within styles.xml
         self.styles = []
         # Styles to be injected in the "styles" tag within styles.xml
         self.styles_base = []
+        # Fonts to be injected in the "font-face-decls" tag within styles.xml
+        self.styles_fonts = []
+        # Page styles to be injected in the "master-styles" tag within
+        # styles.xml.
+        self.styles_master = []
+        # Namespaces to declare on the root tag of content.xml and styles.xml
+        # ~{s_name: {s_prefix: s_uri}}~
+        self.namespaces = {'content': {}, 'styles': {}}
+        # Information about the pod result, used when merging sub-documents
+        # (an appy.pod.odt_merger.MergeTarget instance).
+        self.target = None
+        # The keys of the XHTML conversions whose styles have been added, and
+        # the names of these styles, when conversions are cached (see
+        # appy.pod.cache.XhtmlCache).
+        self.replayed = set()
 
     def addListStyles(self):
         '''Add bullet-related styles in attr "styles_base"'''
@@ -1034,6 +1103,18 @@ class DynamicStyles:
         styles = '%s%s' % (''.join(styles), hook)
         return content.replace(hook, styles)
 
+    def injectNamespaces(self, name, content):
+        '''Declares, on the root tag of p_content being the string content of
+           content.xml or styles.xml (depending on p_name), the namespaces
+           collected in p_self.namespaces.'''
+        namespaces = self.namespaces[name]
+        if not namespaces: return content
+        decls = ''.join([' xmlns:%s="%s"' % (prefix, uri) \
+                         for prefix, uri in namespaces.iteritems()])
+        # Insert the declarations just after the name of the root tag
+        i = content.find(' ', content.find('<office:document'))
+        return '%s%s%s' % (content[:i], decls.encode('utf-8'), content[i:])
+
 # ------------------------------------------------------------------------------
 class StylesGenerator:
     '''Analyse, for a given XHTML tag, its attributes (including CSS attributes
@@ -1077,15 +1158,25 @@ class StylesGenerator:
         # The names of the styles that were already generated, keyed by some
         # hash value.
         self.generated = {}
+        # The definitions of the generated styles, keyed by style name
+        # ~{s_name: (s_target, s_definition)}~
+        self.definitions = {}
+        # When an XHTML conversion is being cached, the names of the already
+        # generated styles it reuses are collected here (see
+        # appy.pod.cache.XhtmlCache).
+        self.reused = None
         self.stylesManager = stylesManager
         # Allows to convert CSS to ODF attributes
         self.css2odf = Css2odf()
         # Are we generating an ODT or ODS file ?
         self.isOds = stylesManager.renderer.templateType == 'ods'
 
-    def addStyle(self, style, target):
+    def addStyle(self, style, target, name=None):
         '''Adds the style definition dynamic styles'''
-        self.stylesManager.dynamicStyles.add(target, style)
+        dynamic = self.stylesManager.dynamicStyles
+        dynamic.add(target, style)
+        if name:
+            self.definitions[name] = (target, getattr(dynamic, target)[-1])
 
     def addStyleInstance(self, name):
         '''Add the style named p_name to the style manager's defined styles, as
@@ -1155,7 +1246,9 @@ class StylesGenerator:
         # its name.
         hash = self.getStyleHash(xhtmlElem, odfAttrs, baseStyle)
         if hash in self.generated:
-            return False, self.generated[hash]
+            r = self.generated[hash]
+            if self.reused is not None: self.reused.append(r)
+            return False, r
         # A new style must be generated
         r = self.generateStyleName()
         self.generated[hash] = r
@@ -1217,7 +1310,8 @@ class StylesGenerator:
         # "fo-font-size" will be ignored if the style is dumped in content.xml.
         # Inversely, in an ODS file, it is preferable to dump everything in
         # content.xml.
-        self.addStyle(style, self.isOds and 'content' or 'styles_base')
+        self.addStyle(style, self.isOds and 'content' or 'styles_base',
+                      styleName)
         # If p_add is True, also add the style to styleManager's defined styles
         # (as a Style instance). Else, it won't be found when it will need to be
         # applied on an inner paragraph.
@@ -1256,7 +1350,7 @@ class StylesGenerator:
               (styleName, self.getStyleFamily(xhtmlElem),
                baseStyle.getOdfParentAttributes(names),
                ' '.join(self.flattenOdfAttributes(cellAttrs)))
-            self.addStyle(style, 'content')
+            self.addStyle(style, 'content', styleName)
             return styleName
     get_th = get_td
 
@@ -1329,24 +1423,74 @@ class StylesManager:
         self.pageLayout = None
         # Global styles mapping
         self.stylesMapping = None
+        # A value identifying the template styles and the styles mapping,
+        # computed by appy.pod.cache.XhtmlCache when caching XHTML conversions.
+        self.fingerprint = None
+        # If the renderer caches template styles, the analysis of the template
+        # styles is shared with other styles managers, as a
+        # appy.pod.cache.ParsedStyles instance.
+        self.parsed = None
+        key = None
+        if renderer.cacheStyles:
+            key = pcache.styles.getKey(renderer)
+            self.parsed = pcache.styles.get(key)
+        if self.parsed is None:
+            self.parseStyles()
+            if key: self.parsed = pcache.styles.put(key, self)
+        if self.parsed:
+            self.useParsed(self.parsed)
+        # The custom styles generator
+        self.stylesGenerator = StylesGenerator(self)
+        # Dynamically-generated styles
+        self.dynamicStyles = DynamicStyles()
+
+    def parseStyles(self):
+        '''Parses the template styles.xml and analyses its styles'''
         self.stylesParser = StylesParser(StylesEnvironment(), self)
         self.stylesParser.parse(self.stylesString)
-        # Now self.styles contains the styles.
+        # Now self.styles contains the styles. Remember the names of those
+        # being defined in the template (see m_reinit).
+        self.templateStyles = set(self.styles.keys())
         # Text styles from self.styles
         self.textStyles = self.styles.getStyles('text')
         # Paragraph styles from self.styles
         self.paragraphStyles = self.styles.getStyles('paragraph')
-        # The custom styles generator
-        self.stylesGenerator = StylesGenerator(self)
-        # Dynamically-generated styles
-        self.dynamicStyles = DynamicStyles()
         # Apply outline deltas, if specified
-        if renderer.stylesOutlineDeltas:
+        deltas = self.renderer.stylesOutlineDeltas
+        if deltas:
             styles = self.styles
-            for name, delta in renderer.stylesOutlineDeltas.iteritems():
+            for name, delta in deltas.iteritems():
                 if name in styles:
                     styles[name].outlineDelta = delta
 
+    def useParsed(self, parsed):
+        '''Uses the analysis of the template styles as cached in p_parsed, a
+           appy.pod.cache.ParsedStyles instance.'''
+        # Styles generated while producing the result are added to an overlay,
+        # leaving the cached styles untouched.
+        self.styles = StylesOverlay(parsed.styles)
+        self.templateStyles = parsed.names
+        self.textStyles = parsed.textStyles
+        self.paragraphStyles = parsed.paragraphStyles
+        self.pageLayout = parsed.pageLayout
+        self.pageStyles = pageStyles = PageStyles()
+        for name, attrs in parsed.pageStyles:
+            pageStyles.add(PageStyle(name, attrs))
+
+    def reinit(self):
+        '''Prepares this styles manager for producing another result from the
+           same template, without parsing styles.xml again: the analysis of
+           the template styles is kept, but styles generated while producing
+           the previous result are forgotten.'''
+        if self.parsed:
+            self.styles = StylesOverlay(self.parsed.styles)
+        else:
+            styles = self.styles
+            for name in styles.keys():
+                if name not in self.templateStyles: del styles[name]
+        self.stylesGenerator = StylesGenerator(self)
+        self.dynamicStyles = DynamicStyles()
+
     def checkStylesAdequation(self, htmlStyle, odtStyle):
         '''Checks that p_odtStyle may be used for style p_htmlStyle'''
         if (htmlStyle in XHTML_PARA_TAGS) and (odtStyle in self.textStyles):
@@ -1464,6 +1608,13 @@ class StylesManager:
         # ----------------------------------------------------------------------
         # (iv)  | [x]Properties instance if cases (5) or (6).
         # ----------------------------------------------------------------------
+        # The same mapping may already have been validated by another styles
+        # manager sharing the same template styles.
+        parsed = self.parsed
+        key = parsed and parsed.getMappingKey(stylesMapping)
+        if key is not None:
+            res = parsed.mappings.get(key)
+            if res is not None: return res
         res = {}
         if not isinstance(stylesMapping, dict) and \
            not isinstance(stylesMapping, UserDict):
@@ -1520,6 +1671,7 @@ class StylesManager:
                 # [x]Properties instance.
                 odtTarget = odtStyleName
             self.addStyleEntry(res, xhtmlStyleName, odtTarget, cssAttrs)
+        if key is not None: parsed.mappings.set(key, res)
         return res
 
     def styleMatch(self, xhtmlElem, matchingAttrs):
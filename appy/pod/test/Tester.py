@@ -7,6 +7,8 @@ from appy.shared.utils import FolderDeleter
 from appy.shared.xml_parser import Escape
 from appy.pod.odf_parser import OdfEnvironment, OdfParser
 from appy.pod.renderer import Renderer
+from appy.pod.render_pool import RenderPool
+from appy.pod import cache as pcache
 from appy.pod.styles_manager import \
      TableProperties, BulletedProperties, NumberedProperties
 
@@ -14,12 +16,26 @@ from appy.pod.styles_manager import \
 TEMPLATE_NOT_FOUND = 'Template file "%s" was not found.'
 CONTEXT_NOT_FOUND = 'Context file "%s" was not found.'
 EXPECTED_RESULT_NOT_FOUND = 'Expected result "%s" was not found.'
+CHECK_KO = 'Check "%s" is not true.'
 
 # ------------------------------------------------------------------------------
 def sjoin(folder, name):
     '''Shorthand for os.path.joining unicode strings.'''
     return str(os.path.join(folder, name))
 
+def importContext(contextName):
+    '''Gets the objects defined in the module of test contexts named
+       p_contextName. Also used as context factory for rendering results in a
+       RenderPool.'''
+    contextPkg = 'appy.pod.test.contexts.%s' % contextName
+    exec 'import %s' % contextPkg
+    exec 'context = dir(%s)' % contextPkg
+    res = {}
+    for elem in context:
+        if not elem.startswith('__'):
+            exec 'res[elem] = %s.%s' % (contextPkg, elem)
+    return res
+
 # ------------------------------------------------------------------------------
 class AnnotationsRemover(OdfParser):
     '''This parser is used to remove from content.xml and styles.xml the
@@ -83,6 +99,9 @@ class Test(BaseTest):
     ignoreAttrs = ('draw:name', 'text:name', 'text:bullet-char', 'table:name',
                    'table:style-name', 'text:style-name', 'xlink:href',
                    'xml:id')
+    # Page styles from sub-pods are given random, unique names (see
+    # appy.pod.styles_manager.PageStyle.rename).
+    uniqueName = re.compile('[0-9a-f]{32}')
 
     def __init__(self, testData, testDescription, testFolder,
                  config, flavour, rendererParams):
@@ -99,19 +118,10 @@ class Test(BaseTest):
         contextPy = os.path.join(self.contextsFolder, contextName + '.py')
         if not os.path.exists(contextPy):
             raise TesterError(CONTEXT_NOT_FOUND % contextPy)
-        contextPkg = 'appy.pod.test.contexts.%s' % contextName
-        exec 'import %s' % contextPkg
-        exec 'context = dir(%s)' % contextPkg
-        res = {}
-        for elem in context:
-            if not elem.startswith('__'):
-                exec 'res[elem] = %s.%s' % (contextPkg, elem)
-        return res
+        return importContext(contextName)
 
-    def do(self):
-        tempFileName = '%s.%s' % (self.data['Name'], self.data['Result'])
-        self.result = sjoin(self.tempFolder, tempFileName)
-        # Get the path to the template to use for this test
+    def getTemplate(self):
+        '''Gets the path to the template to use for this test'''
         if self.data['Template'].endswith('.ods'):
             suffix = ''
         else:
@@ -121,18 +131,33 @@ class Test(BaseTest):
         template = sjoin(self.templatesFolder, self.data['Template'] + suffix)
         if not os.path.exists(template):
             raise TesterError(TEMPLATE_NOT_FOUND % template)
-        # Get the context
-        context = self.getContext(self.data['Context'])
+        return template
+
+    def getParams(self, custom=True):
+        '''Gets the parameters to pass to the renderer. If p_custom is False,
+           the test-specific parameters defined in column "Params" are
+           ignored.'''
         # Get the LibreOffice port
         ooPort = self.data['LibreOfficePort']
         pythonWithUno = self.config['pythonWithUnoPath']
         # Get the styles mapping. Dicts are not yet managed by the TablesParser
         stylesMapping = eval('{' + self.data['StylesMapping'] + '}')
+        r = {'ooPort': ooPort, 'pythonWithUnoPath': pythonWithUno,
+             'stylesMapping': stylesMapping, 'protection': True}
+        # Get the test-specific parameters, defined like the styles mapping
+        if custom: r.update(eval('{' + self.data['Params'] + '}'))
+        r.update(self.rendererParams)
+        return r
+
+    def do(self):
+        tempFileName = '%s.%s' % (self.data['Name'], self.data['Result'])
+        self.result = sjoin(self.tempFolder, tempFileName)
+        # Get the path to the template to use for this test
+        template = self.getTemplate()
+        # Get the context
+        context = self.getContext(self.data['Context'])
         # Call the renderer
-        params = {'ooPort': ooPort, 'pythonWithUnoPath': pythonWithUno,
-                  'stylesMapping': stylesMapping, 'protection': True}
-        params.update(self.rendererParams)
-        Renderer(template, context, self.result, **params).run()
+        Renderer(template, context, self.result, **self.getParams()).run()
 
     def getOdtContent(self, odtFile):
         '''Creates in the temp folder content.xml and styles.xml extracted
@@ -155,6 +180,7 @@ class Test(BaseTest):
                 remover = AnnotationsRemover(OdfEnvironment(), self)
                 remover.parse(fileContent)
                 fileContent = remover.getResult()
+                fileContent = self.uniqueName.sub('UNIQUE', fileContent)
                 try:
                     f.write(fileContent.encode('utf-8'))
                 except UnicodeDecodeError:
@@ -164,14 +190,19 @@ class Test(BaseTest):
 
     def checkResult(self):
         '''r_ is False if the test succeeded'''
-        # Get styles.xml and content.xml from the actual result
-        res = False
-        self.getOdtContent(self.result)
-        # Get styles.xml and content.xml from the expected result
         expectedResult = os.path.join(self.resultsFolder,
                                   self.data['Name'] + '.' + self.data['Result'])
         if not os.path.exists(expectedResult):
             raise TesterError(EXPECTED_RESULT_NOT_FOUND % expectedResult)
+        return self.compareWith(expectedResult)
+
+    def compareWith(self, expectedResult):
+        '''Compares the actual result with p_expectedResult. r_ is False if
+           they are similar.'''
+        # Get styles.xml and content.xml from the actual result
+        res = False
+        self.getOdtContent(self.result)
+        # Get styles.xml and content.xml from the expected result
         self.getOdtContent(expectedResult)
         for fileName in self.interestingOdtContent:
             diffOccurred = self.compareFiles(
@@ -192,13 +223,92 @@ class ErrorTest(Test):
         Test.onError(self)
         return not self.isExpectedError(self.data['Message'])
 
+class CacheTest(Test):
+    '''Renders a template several times with the parameters defined in column
+       "Params", enabling some cache or optimization, and compares the last
+       result with the result of rendering it without these parameters.'''
+
+    # The process-wide caches, emptied before rendering the template
+    caches = (pcache.templates, pcache.styles, pcache.xhtml, pcache.images,
+              pcache.pdfs)
+
+    def do(self):
+        template = self.getTemplate()
+        context = self.getContext(self.data['Context'])
+        name = self.data['Name']
+        ext = self.data['Result']
+        # Render the reference result
+        self.reference = sjoin(self.tempFolder, '%s.reference.%s' % (name, ext))
+        Renderer(template, context.copy(), self.reference,
+                 **self.getParams(custom=False)).run()
+        # Render the result as many times as required, the same parameters
+        # (and thus the same caches) being used for every rendering. Column
+        # "Method" determines the way the results are rendered.
+        for cache in self.caches: cache.clear()
+        results = [sjoin(self.tempFolder, '%s.%d.%s' % (name, i, ext)) \
+                   for i in range(int(self.data['Renders']))]
+        method = self.data['Method']
+        method = getattr(self, 'call%s%s' % (method[0].upper(), method[1:]))
+        method(template, context, results, self.getParams())
+        self.result = results[-1]
+
+    def callRun(self, template, context, results, params):
+        '''Renders every result with its own renderer'''
+        for result in results:
+            renderer = Renderer(template, context.copy(), result, **params)
+            renderer.run()
+        # The last renderer may be used by column "Check"
+        self.renderer = renderer
+
+    def callRunAsync(self, template, context, results, params):
+        '''Renders all results concurrently, every one in its own thread'''
+        self.jobs = []
+        for result in results:
+            renderer = Renderer(template, context.copy(), result, **params)
+            self.jobs.append(renderer.runAsync(timeout=60))
+        for job in self.jobs: job.get()
+
+    def callRenderMany(self, template, context, results, params):
+        '''Renders all results with a single call to Renderer.renderMany'''
+        contexts = [context.copy() for result in results]
+        for result, error in Renderer.renderMany(template, contexts,
+                                   lambda i, ctx: results[i-1], **params):
+            if error: raise error
+
+    def callRenderPool(self, template, context, results, params):
+        '''Renders all results in parallel, in a RenderPool whose workers
+           have been warmed with the template.'''
+        pool = RenderPool(2, [template], **params)
+        try:
+            factory = importContext
+            args = (self.data['Context'],)
+            jobs = [(template, factory, result, args) for result in results]
+            for result, error in pool.renderAll(jobs):
+                if error: raise error
+        finally:
+            pool.close()
+
+    def checkResult(self):
+        # Column "Check" may hold an expression that must be true once the
+        # template has been rendered, ie, for checking that caches were used.
+        check = self.data['Check']
+        if check and not eval(check):
+            self.report.say(CHECK_KO % check)
+            return True
+        return self.compareWith(self.reference)
+
 # ------------------------------------------------------------------------------
 class PodTestFactory(TestFactory):
     @staticmethod
     def createTest(testData, testDescription, testFolder, config, flavour,
                    rendererParams):
-        isErrorTest = testData.table.instanceOf('ErrorTest')
-        testClass = isErrorTest and ErrorTest or NominalTest
+        table = testData.table
+        if table.instanceOf('ErrorTest'):
+            testClass = ErrorTest
+        elif table.instanceOf('CacheTest'):
+            testClass = CacheTest
+        else:
+            testClass = NominalTest
         return testClass(testData, testDescription, testFolder,
                          config, flavour, rendererParams)
 
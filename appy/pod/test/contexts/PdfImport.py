@@ -0,0 +1,6 @@
+from appy.pod.test.contexts.PodImport import getAppyPath
+from appy.pod.doc_importers import PdfImporter
+
+# Pages.pdf has 16 pages: rasterise them with 2 gs processes, converting 8 pages
+# each, whatever the number of CPU cores.
+PdfImporter.workers = 2
@@ -0,0 +1,10 @@
+import os.path
+import appy
+
+def getAppyPath():
+    return os.path.dirname(appy.__file__)
+
+# The name of the sub-pod template to import
+subPod = 'SimpleTest'
+IWillTellYouWhatInAMoment = 'return'
+beingPaidForIt = True
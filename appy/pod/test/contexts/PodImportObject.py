@@ -0,0 +1,6 @@
+from appy.pod.test.contexts.PodImport import getAppyPath
+from appy.pod.test.contexts.Chart1 import *
+
+# This sub-pod contains embedded objects (charts): it can't be merged into the
+# main result.
+subPod = 'Chart1'
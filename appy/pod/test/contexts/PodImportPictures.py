@@ -0,0 +1,5 @@
+from appy.pod.test.contexts.PodImport import getAppyPath
+
+# This sub-pod contains a picture and a page style, and declares fonts and a
+# namespace that are not declared in the main template.
+subPod = 'SubPod'
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# The XHTML chunks of context XhtmlNominal, chunk "defaultStyles" being
+# rendered from the cache of PX fragments.
+from appy.px import Px
+from appy.pod.test.contexts.XhtmlNominal import dummy, titles
+
+pxDefaultStyles = '''
+<p>Vu que...</p>
+<p>Vu que 2...</p>
+<p style="page-break-after: always">Page break after this paragraph.</p>
+<p style="margin-left:25px">Attendu que...;</p>
+<div style="page-break-before: always">Page break before this one.</div>
+'''
+
+def getDefaultStyles():
+    '''Renders PX "pxDefaultStyles" from the cache of fragments'''
+    px = Px(pxDefaultStyles, cacheKey=True)
+    px({})
+    r = px({})
+    if px.fragmentHits != 1:
+        raise Exception('Fragments: %d hit(s)' % px.fragmentHits)
+    return r
+
+defaultStyles = getDefaultStyles()
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# The XHTML chunks of context XhtmlNominal, chunk "titles" being produced by a
+# PX loaded from a ParseCache.
+from appy.px import Px
+from appy.px.cache import ParseCache
+from appy.shared.utils import getOsTempFolder, FolderDeleter
+from appy.pod.test.contexts.XhtmlNominal import dummy, defaultStyles
+
+pxTitles = '''
+<h1>Title <x>:1</x></h1>
+<h2>Title <x>:1 + 1</x></h2>
+<h3>Title 3</h3>
+<h4>Title 4</h4>
+<h5>Title 5</h5>
+<h6>Title 6</h6>'''
+
+def getTitles():
+    '''Renders PX "pxTitles" with a PX whose AST is loaded from a ParseCache'''
+    folder = getOsTempFolder(sub=True)
+    cache = Px.cache = ParseCache(folder)
+    try:
+        # The first PX is parsed and its AST is stored in the cache
+        Px(pxTitles)({})
+        # The second one is loaded from it
+        r = Px(pxTitles)({})
+        if (cache.hits, cache.misses) != (1, 1):
+            raise Exception('Parse cache: %d hit(s), %d miss(es)' % \
+                            (cache.hits, cache.misses))
+    finally:
+        Px.cache = None
+        FolderDeleter.delete(folder)
+    return r
+
+titles = getTitles()
@@ -48,7 +48,7 @@ class XhtmlParser(XmlParser):
 
     def __init__(self, env=None, caller=None, chunk=False, encoded=False,
                  compress=True, normalizeTables=True, optimizeTables=False,
-                 keepWithNext=0, removeTrailingParas=None):
+                 keepWithNext=0, removeTrailingParas=None, dump=True):
         # Define a default environment if p_env is None
         env = env or XhtmlEnvironment()
         # Call the base constructor
@@ -65,6 +65,10 @@ class XhtmlParser(XmlParser):
         # whitespace to produce a shorter output. If it is a requirement to keep
         # the general formatting of the input XHTML, set p_compress to False.
         self.compress = compress
+        # By default, once parsed and visited, the tree of tags is dumped as
+        # XHTML in p_self.res. If you intend to use the tree directly (in
+        # p_self.env.r), set p_dump to False.
+        self.dump = dump
         # Define the visitors that will walk the tree of tags we will build
         activated = []
         if normalizeTables:
@@ -140,6 +144,7 @@ class XhtmlParser(XmlParser):
         for visitor in self.visitors:
             updated = visitor.visit(env)
             self.updated = self.updated or updated
+        if not self.dump: return
         self.res = env.r.asXhtml()
         if self.chunk:
             # Remove the base tag
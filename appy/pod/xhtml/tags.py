@@ -1,6 +1,8 @@
 # ------------------------------------------------------------------------------
+import re
+
 from appy import Object as O
-from appy.shared.xml_parser import Escape
+from appy.shared.xml_parser import Escape, XmlTree
 
 # ------------------------------------------------------------------------------
 # Self-closing XHTML tags
@@ -9,6 +11,16 @@ SELF_CLOSING = {'area':n, 'base':n, 'br':n, 'col':n, 'command':n, 'embed':n,
                 'hr':n, 'img':n, 'input':n, 'keygen':n, 'link':n, 'menuitem':n,
                 'meta':n, 'param':n, 'source':n, 'track':n, 'wbr':n}
 
+# Chars that the SAX parser converts to spaces in attribute values
+blanks = re.compile('[\t\n\r]')
+
+def getAttributeValue(value):
+    '''Returns attribute p_value as the SAX parser would return it after
+       having parsed it: blanks are replaced with spaces.'''
+    value = XmlTree.toUnicode(value)
+    if '\r\n' in value: value = value.replace(u'\r\n', u' ')
+    return blanks.sub(u' ', value)
+
 # ------------------------------------------------------------------------------
 class ChildrenIterator:
     ''''Iterator on children of a given tag'''
@@ -238,6 +250,23 @@ class Tag:
         r.append('</%s>' % self.name)
         return ''.join(r)
 
+    def asEvents(self, parser):
+        '''Fires, on this XmlParser p_parser, the SAX events that would be
+           fired by parsing the result of m_asXhtml.'''
+        u = XmlTree.toUnicode
+        name = u(self.name)
+        attrs = {}
+        if self.css:
+            attrs[u'class'] = getAttributeValue(' '.join(self.css))
+        if self.attrs:
+            for k, v in self.attrs.d().iteritems():
+                attrs[u(k)] = getAttributeValue(v)
+        parser.startElement(name, attrs)
+        if not self.selfClosing and self.children:
+            for child in self.children:
+                child.asEvents(parser)
+        parser.endElement(name)
+
     def iterChildren(self, **kwargs):
         '''Iterates over p_self's children via a ChildIterator'''
         return ChildrenIterator(self, **kwargs)
@@ -313,4 +342,18 @@ class Content:
 
     def asXhtml(self):
         return self.text
+
+    def asEvents(self, parser):
+        '''Fires, on this XmlParser p_parser, the "characters" event that would
+           be fired by parsing the result of m_asXhtml.'''
+        text = self.text
+        if not text: return
+        # Unescape the text, that was escaped by the XhtmlParser
+        if '&' in text:
+            text = text.replace('&lt;', '<').replace('&gt;', '>').\
+                        replace('&quot;', '"').replace('&amp;', '&')
+        # Line ends are normalized by the SAX parser
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        parser.characters(XmlTree.toUnicode(text))
 # ------------------------------------------------------------------------------
@@ -1424,6 +1424,13 @@ class Xhtml2OdtConverter:
     '''Converts a chunk of XHTML into a chunk of ODT'''
     verbose = False
 
+    # With the "etree" backend, when keep-with-next must be applied, the tree of
+    # tags built by the sub-parser (see appy/pod/xhtml/parser.py) is directly
+    # walked by the main parser, instead of being dumped as XHTML and parsed
+    # again. This is not possible if some "class" attribute contains entities
+    # or double quotes: the sub-parser dumps such attributes unescaped.
+    unsafeClass = re.compile('\sclass\s*=\s*(?:"[^"]*&|\'[^\']*[&"])')
+
     def __init__(self, s, encoding, stylesManager, localStylesMapping,
                  keepWithNext, keepImagesRatio, imagesMaxWidth, imagesMaxHeight,
                  renderer, html, unwrap):
@@ -1434,13 +1441,24 @@ class Xhtml2OdtConverter:
         self.localStylesMapping = localStylesMapping
         self.odtChunk = None
         self.xhtmlParser = XhtmlParser(XhtmlEnvironment(renderer), self)
+        # The parser backend: "sax" or "etree" (see the Renderer constructor)
+        self.backend = renderer.xhtmlBackend
+        # The tree of tags to walk instead of parsing self.xhtmlString, if any
+        self.tree = None
         if keepWithNext:
             if keepWithNext is True or keepWithNext > 1:
                 # Apply "keep-with-next" functionality by using a sub-SAX parser
                 from appy.pod.xhtml import parser as xparser
+                direct = self.backend == 'etree' and \
+                         not self.unsafeClass.search(self.xhtmlString)
                 parser = xparser.XhtmlParser(xparser.XhtmlEnvironment(), self,
-                                             keepWithNext=keepWithNext)
-                self.xhtmlString= parser.parse(self.xhtmlString).encode('utf-8')
+                                     keepWithNext=keepWithNext, dump=not direct)
+                if direct:
+                    parser.parseTree(self.xhtmlString)
+                    self.tree = parser.env.r
+                else:
+                    r = parser.parse(self.xhtmlString)
+                    self.xhtmlString = r.encode('utf-8')
             else:
                 self.xhtmlString = self.applyKeepWithNext()
         self.keepImagesRatio = keepImagesRatio
@@ -1455,8 +1473,15 @@ class Xhtml2OdtConverter:
 
     def run(self):
         '''Parses the input XHTML string and returns the resulting ODF chunk'''
-        self.xhtmlParser.parse(self.xhtmlString)
-        r = self.xhtmlParser.env.res
+        parser = self.xhtmlParser
+        if self.tree is not None:
+            self.tree.asEvents(parser)
+            parser.endDocument()
+        elif self.backend == 'etree':
+            parser.parseTree(self.xhtmlString)
+        else:
+            parser.parse(self.xhtmlString)
+        r = parser.env.res
         if self.unwrap and r.startswith('<text:p>'):
             r = r[8:-9]
         return r
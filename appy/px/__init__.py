@@ -4,11 +4,12 @@
 
 # ~license~
 # ------------------------------------------------------------------------------
-import xml.sax
+import xml.sax, itertools
 
 from appy.pod.evaluator import Evaluator
 from appy.pod.buffers import MemoryBuffer
 from appy.px.px_parser import PxParser, PxEnvironment
+from appy.px.cache import fragments, Fragment, Calls
 from appy.shared.xml_parser import xmlPrologue, xhtmlPrologue
 
 # Exception class --------------------------------------------------------------
@@ -20,9 +21,18 @@ class Px:
     xmlPrologue = xmlPrologue
     xhtmlPrologue = xhtmlPrologue
 
+    # The on-disk cache of parsed PXs, as an appy.px.cache.ParseCache instance.
+    # If None, every PX is parsed as soon as it is created. Else, every PX is
+    # parsed, or loaded from the cache, the first time it is called.
+    cache = None
+
+    # Every PX content gets a unique ID, identifying its results in the cache
+    # of fragments (see m_getFragmentKey).
+    contentIds = itertools.count()
+
     def __init__(self, content, isFileName=False, partial=True,
                  template=None, hook=None, prologue=None, unicode=True,
-                 css=None, js=None, name=None):
+                 css=None, js=None, name=None, cacheKey=None, ttl=None):
         '''p_content is the PX code, as a string, or a file name if p_isFileName
            is True. If this code represents a complete XML file, p_partial is
            False. Else, we must surround p_content with a root tag to be able
@@ -44,16 +54,24 @@ class Px:
            dumped just before the PX result. Note that if the PX is executed
            more than once, its corresponding p_css and p_js will only be dumped
            before the first PX result.
+
+           If p_cacheKey is not None, the PX results are cached, in the
+           process-wide cache appy.px.cache.fragments. A result is reused for
+           any call with a context defining the same user roles, language,
+           object (its ID and modification date) and custom key. p_cacheKey is
+           a function, accepting the context as unique arg and returning the
+           custom key (any hashable value), or None if the result of this call
+           must not be cached. If p_cacheKey is True, there is no custom key.
+           If p_ttl is given, a result is reused for at most p_ttl seconds.
+           Results must not depend on anything else, and the PX must not have
+           side-effects on the context.
         '''
         # Get the PX content
         if isFileName:
             f = file(content)
-            self.content = f.read()
+            content = f.read()
             f.close()
-        else:
-            self.content = content
-        # It this content a complete XML file, or just some part of it ?
-        self.partial = partial
+        self.setContent(content, partial)
         # Is this PX based on a template PX ?
         self.template = template
         self.hook = hook
@@ -68,24 +86,45 @@ class Px:
         self.name = name
         # A PX can be profiled (see m_profile below)
         self.profiler = None
-        # Parse the PX
-        self.parse()
+        # Caching of PX results (see m_getFragmentKey)
+        self.cacheKey = cacheKey
+        self.ttl = ttl
+        self.fragmentHits = self.fragmentMisses = 0
+        # Parse the PX, now or at its first call (see attribute "cache")
+        self.parser = None
+        if not self.cache: self.parse()
+
+    def setContent(self, content, partial):
+        '''Sets the PX p_content. If this content is not a complete XML file,
+           p_partial is True.'''
+        self.partial = partial
+        if partial:
+            # Surround the partial chunk with a root tag: it must be valid XML
+            content = '<x>%s</x>' % content
+        self.content = content
+        self.contentId = self.contentIds.next()
 
     def parse(self):
         '''Parses self.content and create the structure corresponding to this
            PX.'''
-        if self.partial:
-            # Surround the partial chunk with a root tag: it must be valid XML
-            self.content = '<x>%s</x>' % self.content
+        cache = self.cache
+        env = cache and cache.load(self)
+        if env:
+            # The AST was loaded from the cache. The parser is only created for
+            # being referred to by the AST: it will parse nothing.
+            self.parser = PxParser(env, self)
+            return
         # Create a PX parser
-        self.parser = PxParser(PxEnvironment(), self)
-        # Parses self.content (a PX code in a string) with self.parser, to
+        parser = PxParser(PxEnvironment(), self)
+        # Parses self.content (a PX code in a string) with the parser, to
         # produce a tree of memory buffers.
         try:
-            self.parser.parse(self.content)
+            parser.parse(self.content)
         except xml.sax.SAXParseException, spe:
             self.completeErrorMessage(spe)
             raise spe
+        self.parser = parser
+        if cache: cache.save(self, parser.env)
 
     def compact(self, s):
         '''Removes single-line comments and unnecessary spaces in p_s,
@@ -109,6 +148,84 @@ class Px:
     def addCss(self, css): self.addCssJs(css, 'css')
     def addJs(self, js): self.addCssJs(js, 'js')
 
+    def getFragmentKey(self, context):
+        '''Returns the key identifying, in the cache of fragments, the result of
+           rendering this PX with this p_context, or None if this result must
+           not be cached.'''
+        custom = self.cacheKey
+        if custom is None: return
+        if custom is not True:
+            custom = custom(context)
+            if custom is None: return
+        # Take into account the user roles (on the object, if any), language
+        # and object being base variables of any Appy PX (see
+        # m_setBaseVariables).
+        user = context.get('user')
+        obj = context.get('obj')
+        roles = None
+        if user:
+            roles = obj and user.getRolesFor(obj) or user.getRoles()
+            roles = tuple(sorted(roles))
+        zobj = context.get('zobj')
+        objKey = zobj and (zobj.id, zobj.Modified().millis()) or None
+        return self.contentId, roles, context.get('lang'), objKey, custom
+
+    def render(self, context):
+        '''Renders the PX with this p_context and returns its result, without
+           CSS, JS and prologue.'''
+        env = self.parser.env
+        # Create a Memory buffer for storing the result
+        result = MemoryBuffer(env, None)
+        # Execute the PX
+        env.ast.evaluate(result, context)
+        return result.content
+
+    def renderFragment(self, context, key):
+        '''Gets, from the cache of fragments, the result of rendering this PX
+           with this p_context, whose key is p_key. If it is not found, the PX
+           is rendered and its result is cached.'''
+        fragment = fragments.get(key)
+        if fragment and fragment.isExpired(): fragment = None
+        rt = context['_rt_']
+        if fragment:
+            self.fragmentHits += 1
+        else:
+            self.fragmentMisses += 1
+            calls = context['_rt_'] = Calls()
+            try:
+                content = self.render(context)
+            finally:
+                context['_rt_'] = rt
+            fragment = Fragment(content, calls.pxs, self.ttl)
+            fragments.set(key, fragment)
+        # Count the calls to the PXs called within the fragment, and include
+        # their CSS and JS code when relevant.
+        r = fragment.content
+        if fragment.pxs:
+            r = ''.join([px.countCall(rt) for px in fragment.pxs]) + r
+        return r
+
+    def countCall(self, rt):
+        '''Counts this call to the PX in p_rt, the dict of PX calls from the
+           context. Returns the PX-specific CSS and JS code if it is the first
+           call, or the empty string else.'''
+        if isinstance(rt, Calls):
+            # A fragment is being rendered: CSS and JS code will be included
+            # before the fragment.
+            rt.add(self)
+            return ''
+        pxId = id(self)
+        if pxId in rt:
+            rt[pxId] += 1
+            return ''
+        rt[pxId] = 1
+        # This is the first time we execute it: include CSS and JS code if
+        # present.
+        r = ''
+        if self.css: r = '<style>%s</style>\n' % self.css
+        if self.js: r += '<script>%s</script>\n' % self.js
+        return r
+
     def completeErrorMessage(self, parsingError):
         '''A p_parsingError occurred. Complete the error message with the
            erroneous line from self.content.'''
@@ -163,24 +280,16 @@ class Px:
             # Start profiling when relevant
             profiler = self.profiler
             if profiler: profiler.enter(self.name)
-            # Create a Memory buffer for storing the result
-            env = self.parser.env
-            result = MemoryBuffer(env, None)
-            # Execute the PX
-            env.ast.evaluate(result, context)
-            # Get the PX result
-            r = result.content
-            # Count this call and include CSS and JS code when relevant
-            pxId = id(self)
-            rt = context['_rt_']
-            if pxId in rt:
-                rt[pxId] += 1
+            # Parse the PX if not done yet
+            if not self.parser: self.parse()
+            # Get the PX result, from the cache of fragments when relevant
+            key = self.getFragmentKey(context)
+            if key is None:
+                r = self.render(context)
             else:
-                rt[pxId] = 1
-                # This is the first time we execute it: include CSS and JS code
-                # if present.
-                if self.js: r = ('<script>%s</script>\n' % self.js) + r
-                if self.css: r = ('<style>%s</style>\n' % self.css) + r
+                r = self.renderFragment(context, key)
+            # Count this call and include CSS and JS code when relevant
+            r = self.countCall(context['_rt_']) + r
             # Include the prologue and manage encoding
             if self.prologue:
                 r = self.prologue + r
@@ -196,10 +305,10 @@ class Px:
     def override(self, content, partial=True):
         '''Overrides the content of this PX with a new p_content (as a
            string).'''
-        self.partial = partial
-        self.content = content
+        self.setContent(content, partial)
         # Parse again, with new content
-        self.parse()
+        self.parser = None
+        if not self.cache: self.parse()
 
     def profile(self, name, profiler):
         '''Enables profiling of this PX, that will be named p_name in the
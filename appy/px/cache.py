@@ -0,0 +1,192 @@
+'''On-disk cache of parsed PXs and in-memory cache of PX results'''
+
+# ~license~
+
+# Every PX is parsed into a tree of memory buffers (its AST) by a SAX parser.
+# An application defines many PXs (appy.fields, appy.gen...), that are all
+# parsed every time a process starts. A ParseCache stores, on disk, the ASTs
+# of PXs, as pickles: a process having such a cache loads, instead of parsing
+# them, the PXs it has already parsed at a previous run or that another
+# process has parsed. To enable it, set attribute "cache" on class Px, before
+# PXs are defined, ie, at the very start of the application's startup:
+#
+#           from appy.px import Px
+#           from appy.px.cache import ParseCache
+#           Px.cache = ParseCache('/var/cache/myApp/px')
+#
+# When a cache is enabled, PXs are loaded lazily: a PX is parsed or loaded
+# from the cache the first time it is called.
+
+# A cached AST is identified by the hash of the PX content and by the Appy
+# version: a new Appy version, or, for a development version, any change to
+# the modules defining the AST, invalidates the cache.
+
+# ------------------------------------------------------------------------------
+import os, os.path, stat, time, hashlib, cPickle
+
+import appy.version
+from appy.shared.cache import LruCache
+from appy.shared.utils import getOsTempFolder
+
+# ------------------------------------------------------------------------------
+UNSAFE_FOLDER = 'Folder "%s" can\'t store cached PXs: it must be owned by the ' \
+                'user running this process and must not be writable by others.'
+
+# ------------------------------------------------------------------------------
+class ParseCache:
+    '''Stores and retrieves the ASTs of PXs, in a folder on disk'''
+
+    # The modules defining the classes of objects being part of an AST
+    astModules = ('pod/buffers.py', 'pod/actions.py', 'pod/elements.py',
+                  'px/px_parser.py', 'px/__init__.py')
+
+    def __init__(self, folder=None):
+        # The folder where ASTs are stored. If None, a folder private to the
+        # current user is created in the OS temp folder. Cached ASTs being
+        # pickles, that are executed when loaded, anyone able to write in this
+        # folder could run code in this process: the folder is refused if it is
+        # not owned by the current user or is writable by others.
+        if folder is None:
+            folder = os.path.join(getOsTempFolder(), self.getDefaultName())
+        if not os.path.isdir(folder): os.makedirs(folder, 0700)
+        self.checkFolder(folder)
+        self.folder = folder
+        self.stamp = self.getStamp()
+        # Statistics
+        self.hits = self.misses = 0
+
+    def getDefaultName(self):
+        '''Returns the name of the default cache folder, within the OS temp
+           folder.'''
+        if hasattr(os, 'getuid'): return 'appy-px-%d' % os.getuid()
+        return 'appy-px'
+
+    def checkFolder(self, folder):
+        '''Raises an exception if this p_folder can be written by other users
+           than the current one.'''
+        # The check is not possible on Windows
+        if not hasattr(os, 'getuid'): return
+        info = os.stat(folder)
+        if (info.st_uid != os.getuid()) or \
+           (info.st_mode & (stat.S_IWGRP | stat.S_IWOTH)):
+            raise Exception(UNSAFE_FOLDER % folder)
+
+    def getStamp(self):
+        '''Returns a string identifying the version of the code producing
+           ASTs.'''
+        version = appy.version
+        if version.short != 'dev':
+            return '%s %s' % (version.short, version.verbose)
+        # A development version: take into account the last modifications of
+        # the modules defining ASTs.
+        base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        r = ['dev']
+        for name in self.astModules:
+            try:
+                r.append(str(os.stat(os.path.join(base, name)).st_mtime))
+            except OSError:
+                pass
+        return ' '.join(r)
+
+    def getPath(self, px):
+        '''Returns the path to the file storing the AST of this p_px'''
+        content = px.content
+        if isinstance(content, unicode): content = content.encode('utf-8')
+        key = hashlib.md5('%s\n%s' % (self.stamp, content)).hexdigest()
+        return os.path.join(self.folder, '%s.pickle' % key)
+
+    def load(self, px):
+        '''Returns the parser environment, containing the AST, of this p_px,
+           or None if it is not in the cache.'''
+        path = self.getPath(px)
+        try:
+            f = file(path, 'rb')
+        except IOError:
+            self.misses += 1
+            return
+        try:
+            try:
+                r = cPickle.load(f)
+            finally:
+                f.close()
+        except Exception:
+            # A corrupted or incompatible file: it will be overwritten
+            self.misses += 1
+            return
+        self.hits += 1
+        return r
+
+    def save(self, px, env):
+        '''Stores, in the cache, this parser p_env containing the AST of this
+           p_px.'''
+        path = self.getPath(px)
+        # Several processes may save the same PX at the same time: the file is
+        # written under a temporary name and then renamed.
+        temp = '%s.%d' % (path, os.getpid())
+        try:
+            f = file(temp, 'wb')
+            try:
+                cPickle.dump(env, f, cPickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.rename(temp, path)
+        except Exception:
+            # Caching is a mere optimization
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+
+    def clear(self):
+        '''Removes all cached ASTs'''
+        for name in os.listdir(self.folder):
+            if name.endswith('.pickle'):
+                os.remove(os.path.join(self.folder, name))
+        self.hits = self.misses = 0
+
+    def __repr__(self):
+        '''p_self's short string representation'''
+        return '<ParseCache %s>' % self.folder
+
+# ------------------------------------------------------------------------------
+class Fragment:
+    '''The cached result of rendering a PX'''
+
+    # A PX defining a cache key (see parameter "cacheKey" on class Px) stores
+    # its results in the process-wide LRU cache "fragments" below. Every result
+    # is stored with the PXs called while producing it: the first time such a
+    # result is used within a series of PX calls sharing the same context, the
+    # CSS and JS code of these PXs is dumped before it.
+
+    def __init__(self, content, pxs, ttl=None):
+        # The PX result, without CSS, JS and prologue
+        self.content = content
+        # The PXs called while producing it
+        self.pxs = pxs
+        # The date, as a number of seconds since the epoch, beyond which the
+        # fragment can't be used anymore, or None if it never expires.
+        self.expires = (ttl is not None) and (time.time() + ttl) or None
+
+    def isExpired(self):
+        '''Is this fragment too old to be used ?'''
+        return (self.expires is not None) and (time.time() > self.expires)
+
+class Calls(dict):
+    '''Replaces, in the context, the dict of PX calls (see key "_rt_" in
+       appy.px.Px.__call__) while a fragment is being rendered.'''
+
+    # PXs called while rendering a fragment do not dump their CSS and JS code
+    # in it: they are recorded here instead.
+
+    def __init__(self):
+        dict.__init__(self)
+        self.pxs = []
+
+    def add(self, px):
+        '''Records a call to this p_px'''
+        if px not in self.pxs: self.pxs.append(px)
+
+# The process-wide cache of fragments
+fragments = LruCache(maxEntries=1000, maxSize=16 * 1024 * 1024,
+                     sizer=lambda fragment: len(fragment.content))
+# ------------------------------------------------------------------------------
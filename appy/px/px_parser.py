@@ -35,6 +35,13 @@ class PxEnvironment(XmlEnvironment):
         # Exceptions are always raised (for pod, it is not the case)
         self.raiseOnError = True
 
+    def __getstate__(self):
+        '''When the AST is pickled (see appy.px.cache.ParseCache), the parser
+           having produced it is not.'''
+        r = self.__dict__.copy()
+        r['parser'] = None
+        return r
+
     def addSubBuffer(self):
         subBuffer = self.currentBuffer.addSubBuffer()
         self.currentBuffer = subBuffer
@@ -0,0 +1,99 @@
+'''Generic, thread-safe, in-memory caches'''
+
+# ~license~
+# ------------------------------------------------------------------------------
+import threading
+from collections import OrderedDict
+
+# ------------------------------------------------------------------------------
+class LruCache:
+    '''Bounded dict-like cache, evicting the least recently used entries'''
+
+    def __init__(self, maxEntries=100, maxSize=None, sizer=None):
+        # The maximum number of entries in the cache. None means: no limit.
+        self.maxEntries = maxEntries
+        # The maximum total size of the cached values. None means: no limit. If
+        # p_maxSize is specified, p_sizer must be a function accepting a value
+        # as unique arg and returning its size (as an integer, ie, a number of
+        # bytes). A value being larger than p_maxSize is never cached.
+        self.maxSize = maxSize
+        self.sizer = sizer
+        self.size = 0
+        # The cached values ~{key: value}~, from the least to the most recently
+        # used one.
+        self.values = OrderedDict()
+        # Statistics
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+
+    def getSize(self, value):
+        '''Returns the size of this p_value, or 0 if no sizer is defined'''
+        return (self.sizer and self.sizer(value)) or 0
+
+    def get(self, key, default=None):
+        '''Returns the value stored at this p_key, or p_default if not found'''
+        with self.lock:
+            if key not in self.values:
+                self.misses += 1
+                return default
+            self.hits += 1
+            # Mark the entry as the most recently used one
+            r = self.values.pop(key)
+            self.values[key] = r
+            return r
+
+    def set(self, key, value):
+        '''Stores this p_value at this p_key, evicting the least recently used
+           entries if the cache is full.'''
+        size = self.getSize(value)
+        with self.lock:
+            if key in self.values:
+                self.size -= self.getSize(self.values.pop(key))
+            if self.maxSize is not None and size > self.maxSize: return
+            self.values[key] = value
+            self.size += size
+            self.evict()
+
+    def pop(self, key, default=None):
+        '''Removes the entry at this p_key and returns its value, or p_default
+           if not found.'''
+        with self.lock:
+            if key not in self.values: return default
+            r = self.values.pop(key)
+            self.size -= self.getSize(r)
+            return r
+
+    def evict(self):
+        '''Removes the least recently used entries until the cache respects its
+           limits. Must be called while holding p_self.lock.'''
+        values = self.values
+        while values and \
+              ((self.maxEntries is not None and len(values)>self.maxEntries) or\
+               (self.maxSize is not None and self.size > self.maxSize)):
+            key, value = values.popitem(last=False)
+            self.size -= self.getSize(value)
+            self.evictions += 1
+
+    def clear(self):
+        '''Empties the cache and resets its statistics'''
+        with self.lock:
+            self.values.clear()
+            self.size = self.hits = self.misses = self.evictions = 0
+
+    def getStats(self):
+        '''Returns a dict of statistics about this cache'''
+        with self.lock:
+            total = self.hits + self.misses
+            return {'entries': len(self.values), 'size': self.size,
+                    'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hitRate': total and (float(self.hits) / total) or 0.0}
+
+    def __contains__(self, key): return key in self.values
+    def __len__(self): return len(self.values)
+
+    def __repr__(self):
+        '''p_self's short string representation'''
+        return '<LruCache entries=%d hits=%d misses=%d>' % \
+               (len(self.values), self.hits, self.misses)
+# ------------------------------------------------------------------------------
@@ -6,6 +6,10 @@ from xml.parsers.expat import XML_PARAM_ENTITY_PARSING_NEVER
 from xml.sax.handler import ContentHandler, ErrorHandler, feature_external_ges
 from xml.sax.xmlreader import InputSource
 from xml.sax import SAXParseException
+try:
+    import xml.etree.cElementTree as etree
+except ImportError:
+    import xml.etree.ElementTree as etree
 
 from appy.shared import UnicodeBuffer
 from appy.shared.errors import AppyError
@@ -287,6 +291,127 @@ class XmlParser(ContentHandler, ErrorHandler):
         if isinstance(xml, file): xml.close()
         return self.res
 
+    def parseTree(self, xml):
+        '''Parses p_xml, that must be a string containing valid XML content,
+           with the C-accelerated ElementTree parser if possible (see class
+           XmlTree below), with the SAX parser else.'''
+        if XmlTree.run(self, xml): return self.res
+        return self.parse(xml)
+
+# ------------------------------------------------------------------------------
+class XmlTree:
+    '''Parses XML with the C-accelerated ElementTree parser and walks the
+       resulting tree, firing, on a XmlParser, the events that the SAX parser
+       would have fired.'''
+
+    # Both parsers rely on expat and thus apply the same rules regarding line
+    # ends, whitespace and attribute values. Building the tree in C is much
+    # faster than calling Python methods from the SAX parser for every element
+    # and chunk of text. Walking the tree then fires a single "characters"
+    # event for every text node, while the SAX parser may split it into
+    # several chunks: XmlParser sub-classes using this class must not depend
+    # on the way text is split.
+
+    # The ElementTree parser only supports a subset of what XmlParser supports:
+    # namespaces, DOCTYPEs, CDATA sections, comments and processing
+    # instructions are not supported. HTML entities are supported by replacing
+    # them, before parsing, with the chars that m_skippedEntity would have
+    # produced. For any XML that can't be parsed that way, m_run returns False
+    # and the caller must use the SAX parser.
+    unsupported = re.compile('<!|<\?|xmlns|xml:')
+
+    # A tag, or an entity found outside tags. Within a tag, quoted attribute
+    # values may contain char ">".
+    token = re.compile('(<(?:[^>"\']|"[^"]*"|\'[^\']*\')*>)|&([^\s&;<>#]+);')
+    entity = re.compile('&([^\s&;<>#]+);')
+
+    @staticmethod
+    def toUnicode(s):
+        '''ElementTree returns ASCII-only strings as str instances, while the
+           SAX parser always returns unicode strings.'''
+        if isinstance(s, str): return s.decode('utf-8')
+        return s
+
+    @staticmethod
+    def removeEntity(match):
+        '''The SAX parser ignores HTML entities found in attribute values'''
+        if match.group(1) in XML_ENTITIES: return match.group(0)
+        return ''
+
+    @staticmethod
+    def replaceEntity(match):
+        '''Replaces a HTML entity with its value, or removes HTML entities from
+           a tag.'''
+        tag = match.group(1)
+        if tag:
+            if '&' not in tag: return tag
+            return XmlTree.entity.sub(XmlTree.removeEntity, tag)
+        name = match.group(2)
+        if name in XML_ENTITIES: return match.group(0)
+        if name not in HTML_ENTITIES: return '?'
+        r = HTML_ENTITIES[name]
+        # The SAX parser would fire an event for an empty chunk of text, that
+        # could be meaningful for the XmlParser.
+        if not r: raise ValueError(name)
+        return r
+
+    @staticmethod
+    def parse(xml):
+        '''Returns the root element of the tree parsed from p_xml, or None if
+           p_xml can't be parsed by the ElementTree parser.'''
+        if not isinstance(xml, str) or XmlTree.unsupported.search(xml): return
+        if '&' in xml:
+            try:
+                xml = XmlTree.token.sub(XmlTree.replaceEntity, xml)
+            except ValueError:
+                return
+        parser = etree.XMLParser()
+        try:
+            parser.feed(xml)
+            return parser.close()
+        except etree.ParseError:
+            pass
+
+    @staticmethod
+    def walk(parser, root):
+        '''Walks the tree whose p_root element is given, firing events on this
+           XmlParser p_parser.'''
+        u = XmlTree.toUnicode
+        startElement = parser.startElement
+        characters = parser.characters
+        endElement = parser.endElement
+        stack = []
+        elem = root
+        while True:
+            if elem is not None:
+                # Start walking p_elem
+                attrs = {}
+                for name, value in elem.items(): attrs[u(name)] = u(value)
+                startElement(u(elem.tag), attrs)
+                if elem.text: characters(u(elem.text))
+                stack.append((elem, iter(elem)))
+            # Get the next child of the currently walked element
+            current, children = stack[-1]
+            elem = next(children, None)
+            if elem is None:
+                # All children have been walked: close the current element
+                stack.pop()
+                endElement(u(current.tag))
+                if not stack: break
+                if current.tail: characters(u(current.tail))
+
+    @staticmethod
+    def run(parser, xml):
+        '''Parses p_xml and fires the corresponding events on this XmlParser
+           p_parser. Returns False if p_xml can't be parsed by the ElementTree
+           parser: in that case, no event was fired.'''
+        root = XmlTree.parse(xml)
+        if root is None: return False
+        parser._xml = xml
+        XmlTree.walk(parser, root)
+        parser.endDocument()
+        return True
+
 # ------------------------------------------------------------------------------
 from appy.shared import UnmarshalledFile
 from appy import Object
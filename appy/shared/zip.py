@@ -48,13 +48,20 @@ def subUnzip(folder, zipName, odf=False, fixNames=False):
     # Delete p_zipName
     os.remove(absZipName)
 
-def unzip(f, folder, odf=False, unzipSubZips=False, fixNames=False):
+def unzip(f, folder, odf=False, unzipSubZips=False, fixNames=False,
+          entries=None):
     '''Unzips file p_f into p_folder. p_f can be any anything accepted by the
        zipfile.ZipFile constructor. p_folder must exist.
        
        If p_odf is True, p_f is considered to be an odt or ods file and this
        function will return a dict containing the content of content.xml,
-       styles.xml, meta.xml and metadata from the zipped file.'''
+       styles.xml, meta.xml and metadata from the zipped file.
+
+       If p_entries is a list, for every unzipped file or folder, a tuple
+       (s_name, s_content) is added to it, s_content being None for a folder.
+       Function m_dumpEntries may then dump them again in another folder,
+       without having to unzip p_f again. If p_folder is None, nothing is
+       written on disk: files are only collected in p_entries.'''
     zipFile = zipfile.ZipFile(f)
     if odf: res = {}
     else: res = None
@@ -66,12 +73,14 @@ def unzip(f, folder, odf=False, unzipSubZips=False, fixNames=False):
             # This is an empty folder. Create it nevertheless. If zippedFile
             # starts with a '/', os.path.join will consider it an absolute
             # path and will throw away folder.
-            os.makedirs(os.path.join(folder, zippedFile.lstrip('/')))
+            if folder is not None:
+                os.makedirs(os.path.join(folder, zippedFile.lstrip('/')))
+            if entries is not None: entries.append((zippedFile, None))
         else:
             fileName = os.path.basename(zippedFile)
             folderName = os.path.dirname(zippedFile)
             fullFolderName = folder
-            if folderName:
+            if folderName and folder is not None:
                 fullFolderName = os.path.join(fullFolderName, folderName)
                 if not os.path.exists(fullFolderName):
                     os.makedirs(fullFolderName)
@@ -79,33 +88,58 @@ def unzip(f, folder, odf=False, unzipSubZips=False, fixNames=False):
         if fileName:
             # Fix fileName when requested
             if fixNames: fileName = fixFileName(fileName)
-            fullFileName = os.path.join(fullFolderName, fileName)
-            f = open(fullFileName, 'wb')
             fileContent = zipFile.read(zippedFile)
             if odf and not folderName:
                 # content.xml and others may reside in subfolders. Get only the
                 # one in the root folder.
                 if fileName in odfInnerFiles:
                     res[fileName] = fileContent
-            f.write(fileContent)
-            f.close()
+            if folder is not None:
+                f = open(os.path.join(fullFolderName, fileName), 'wb')
+                f.write(fileContent)
+                f.close()
+            if entries is not None:
+                entries.append((os.path.join(folderName, fileName),fileContent))
             # If the unzipped file is itself a zip file, and p_unzipSubZips is
             # True, replace it with a folder containing its unzipped content.
-            if unzipSubZips and fileName.endswith('.zip'):
+            if unzipSubZips and folder is not None and \
+               fileName.endswith('.zip'):
                 subUnzip(fullFolderName, fileName, odf=odf, fixNames=fixNames)
     zipFile.close()
     return res
 
+def dumpEntries(entries, folder):
+    '''Dumps, into p_folder, files and folders as collected by m_unzip in its
+       p_entries parameter. p_folder must exist.'''
+    for name, content in entries:
+        path = os.path.join(folder, name.lstrip('/'))
+        if content is None:
+            # An empty folder
+            if not os.path.exists(path): os.makedirs(path)
+            continue
+        folderName = os.path.dirname(path)
+        if not os.path.exists(folderName): os.makedirs(folderName)
+        f = open(path, 'wb')
+        f.write(content)
+        f.close()
+
 # ------------------------------------------------------------------------------
-def zip(f, folder, odf=False, encode=False):
+def zip(f, folder, odf=False, encode=False, contents=None):
     '''Zips the content of p_folder into the zip file whose (preferably)
        absolute filename is p_f. If p_odf is True, p_folder is considered to
        contain the standard content of an ODF file (content.xml,...). In this
        case, some rules must be respected while building the zip (see below).
        If p_encode is True, we ensure the name of every file in the zip is
-       encoded with encoding CP437.'''
+       encoded with encoding CP437.
+
+       p_contents may be a dict ~{s_name: s_content}~ of files whose content
+       is already in memory: such a file is zipped from its content, instead of
+       from its homonym in p_folder, if any. Names are relative to p_folder,
+       with "/" as separator.
+
+       p_f may also be a file-like object, opened for writing.'''
     # Remove p_f if it exists
-    if os.path.exists(f): os.remove(f)
+    if isinstance(f, basestring) and os.path.exists(f): os.remove(f)
     try:
         zipFile = zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED)
     except RuntimeError:
@@ -130,6 +164,11 @@ def zip(f, folder, odf=False, encode=False):
             # For p_odf files, ignore file "mimetype" that was already inserted
             if odf and (folderName == '') and (name == 'mimetype'): continue
             targetName = os.path.join(folderName, name)
+            if contents:
+                key = targetName.replace(os.sep, '/')
+                if key in contents:
+                    writeContent(zipFile, key, contents[key])
+                    continue
             if encode:
                 targetName = targetName.decode('utf-8').encode('cp437')
             zipFile.write(os.path.join(dir, name), targetName)
@@ -140,5 +179,48 @@ def zip(f, folder, odf=False, encode=False):
             zInfo = zipfile.ZipInfo("%s/" % folderName, time.localtime()[:6])
             zInfo.external_attr = 0777 << 16L
             zipFile.writestr(zInfo, '')
+    # Add in-memory files having no homonym in p_folder
+    if contents:
+        for name, content in contents.iteritems():
+            if name not in zipFile.NameToInfo:
+                writeContent(zipFile, name, content)
+    zipFile.close()
+
+def zipEntries(f, entries, contents=None):
+    '''Zips, into p_f (a file name or a file-like object opened for writing),
+       the ODF files and folders collected by m_unzip in its p_entries
+       parameter. p_contents has the same meaning as in m_zip.'''
+    try:
+        zipFile = zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED)
+    except RuntimeError:
+        zipFile = zipfile.ZipFile(f, 'w')
+    # File "mimetype" must be the first one, uncompressed (see m_zip)
+    for name, content in entries:
+        if name == 'mimetype':
+            zipFile.writestr('mimetype', content, zipfile.ZIP_STORED)
+            break
+    for name, content in entries:
+        if name == 'mimetype': continue
+        name = name.replace(os.sep, '/')
+        if content is None:
+            # An empty folder
+            zInfo = zipfile.ZipInfo(name, time.localtime()[:6])
+            zInfo.external_attr = 0777 << 16L
+            zipFile.writestr(zInfo, '')
+            continue
+        if contents and name in contents: content = contents[name]
+        writeContent(zipFile, name, content)
+    # Add in-memory files having no homonym in p_entries
+    if contents:
+        for name, content in contents.iteritems():
+            if name not in zipFile.NameToInfo:
+                writeContent(zipFile, name, content)
     zipFile.close()
+
+def writeContent(zipFile, name, content):
+    '''Adds, in p_zipFile, a file named p_name, from its p_content'''
+    zInfo = zipfile.ZipInfo(name, time.localtime()[:6])
+    zInfo.compress_type = zipFile.compression
+    zInfo.external_attr = 0644 << 16L
+    zipFile.writestr(zInfo, content)
 # ------------------------------------------------------------------------------